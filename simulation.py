@@ -1,22 +1,28 @@
 #!/usr/bin/env python3
 
+import argparse
+import asyncio
 import json
 import hashlib
 import logging
-import time
 import random
+import time
 
-from http.client import HTTPConnection
-
-#sames as agent but imitates requests by incrementing index 
+#load generator, imitates many agents checking in to provisioning endpoint.
+#'devices' mode is closed loop: every simulated device checks in every interval (with jitter) after its previous
+#check-in has finished, like real agents do. 'open' mode is open loop: check-ins are started at a fixed rate no
+#matter how fast server answers, rate is raised every step, which shows where the server saturates.
+#Latency is measured from the time check-in was due, so time spent waiting for a free connection is included
 CTX = {
 	"timeout": 10, # Seconds.
-	"interval": 1, # Seconds.
-	"server": "192.168.1.79",
+	"server": "127.0.0.1",
 	"port": 8000,
+	"path": "/wrtapp/provisioning",
 	"password": "yJAFruh5RTuMVpvxRvc7xOBFGTrB3abd"
 }
 
+KINDS = ["new", "steady", "changed"]
+
 class Statistics:
 	def __init__(self, idx):
 		self.idx = idx
@@ -24,9 +30,9 @@ class Statistics:
 	def get(self):
 		stats = {
 			"system": {
-				"model": "SIM{}".format(str(self.idx)),
+				"model": "SIM{}".format(str(self.idx % 100)),
 				"status": "OK",
-				"mac": "{:02d}:{:02d}:{:02d}:{:02d}:{:02d}:{:02d}".format(self.idx, self.idx, self.idx, self.idx, self.idx, self.idx),
+				"mac": ":".join(["{:02X}".format(byte) for byte in (0x02, 0x51) + tuple(self.idx.to_bytes(4, "big"))]),
 				"cpu_load": round(random.uniform(10.0, 30.0),1),
 				"memory_usage": round(random.uniform(40.0, 50.0),1),
 			}
@@ -36,84 +42,322 @@ class Statistics:
 class Configuration:
 	def __init__(self, idx):
 		self.idx = idx
-
-	def get(self):
-		config = {
+		octets = self.idx.to_bytes(3, "big")
+		self.config = {
 			"system": {
 				"hostname": "sim{}".format(str(self.idx)),
 			},
 			"network": {
-				"ip": "{}.{}.{}.{}".format(str(self.idx), str(self.idx), str(self.idx), str(self.idx)),
-				"netmask": "{}.{}.{}.{}".format(str(self.idx), str(self.idx), str(self.idx), str(self.idx)),
-				"gateway": "{}.{}.{}.{}".format(str(self.idx), str(self.idx), str(self.idx), str(self.idx)),
-				"dns1": "{}.{}.{}.{}".format(str(self.idx), str(self.idx), str(self.idx), str(self.idx)),
-				"dns2": "{}.{}.{}.{}".format(str(self.idx), str(self.idx), str(self.idx), str(self.idx)),
+				"ip": "10.{}.{}.{}".format(*octets),
+				"netmask": "255.0.0.0",
+				"gateway": "10.0.0.1",
+				"dns1": "8.8.8.8",
+				"dns2": "8.8.4.4",
 			}
 		}
-		return config
 
-def server_send(datadict):
-	try:
-		reqdata = json.dumps(datadict).encode("utf-8")
-	except:
-		logging.error("Failed to serialize request data")
-		return None
+	def get(self):
+		return self.config
 
-	headers = {"Content-type": "application/json"}
-	conn = HTTPConnection(CTX["server"], CTX["port"], CTX["timeout"])
-	try:
-		conn.request("POST", "/wrtapp/provisioning", reqdata, headers)
-	except:
-		logging.error("Failed to send request")
-		conn.close()
-		return None
+	def apply(self, changes): #same as agent, takes changed values from server response
+		for section, values in changes.items():
+			self.config.setdefault(section, {}).update(values)
 
-	response = conn.getresponse()
-	if response.status != 200:
-		logging.error("Server returned error: {}".format(str(response.status)))
-		conn.close()
-		return None
+class Device:
+	def __init__(self, idx):
+		self.idx = idx
+		self.stats = Statistics(idx)
+		self.config = Configuration(idx)
+		self.config_hash = None
 
-	respdata = response.read()
-	if not respdata:
-		logging.error("Failed to read response data")
-		conn.close()
-		return None
+	def request(self, token, kind):
+		if kind == "changed": #agent config drifted from the one in db, server has to diff it and send changes back
+			self.config.get()["system"]["hostname"] = "drifted{}".format(str(self.idx))
+			self.config_hash = None
+		reqdict = {
+			"statistics": self.stats.get(),
+			"configuration": self.config.get(),
+			"token": token,
+		}
+		if self.config_hash:
+			reqdict["config_hash"] = self.config_hash
+		return reqdict
 
-	conn.close()
-	try:
-		resp = json.loads(respdata.decode("utf-8"))
-		return resp
-	except:
-		logging.error("Failed to deserialize response data")
-		return None
+	def response(self, resp):
+		if resp.get("config_status") == "CHANGED":
+			self.config.apply(resp.get("configuration", {}))
+		self.config_hash = resp.get("config_hash")
+
+class HTTPError(Exception):
+	pass
+
+class Connection: #http/1.1 keep-alive connection, reopened when server closes it
+	def __init__(self):
+		self.reader = None
+		self.writer = None
+
+	async def open(self):
+		self.reader, self.writer = await asyncio.wait_for(asyncio.open_connection(CTX["server"], CTX["port"]), CTX["timeout"])
+
+	def close(self):
+		if self.writer:
+			self.writer.close()
+		self.reader = self.writer = None
+
+	async def post(self, path, body):
+		if self.writer is None:
+			await self.open()
+		head = ("POST {} HTTP/1.1\r\n"
+			"Host: {}:{}\r\n"
+			"Content-Type: application/json\r\n"
+			"Content-Length: {}\r\n"
+			"Connection: keep-alive\r\n\r\n").format(path, CTX["server"], CTX["port"], len(body))
+		self.writer.write(head.encode("ascii") + body)
+		await self.writer.drain()
+		return await asyncio.wait_for(self.read_response(), CTX["timeout"])
+
+	async def read_response(self):
+		status = await self.reader.readline()
+		if not status:
+			raise HTTPError("connection closed")
+		code = int(status.split()[1])
+		headers = {}
+		while True:
+			line = await self.reader.readline()
+			if line in (b"\r\n", b"\n", b""):
+				break
+			name, _, value = line.decode("latin-1").partition(":")
+			headers[name.strip().lower()] = value.strip()
+
+		if "content-length" in headers:
+			body = await self.reader.readexactly(int(headers["content-length"]))
+		elif headers.get("transfer-encoding", "").lower() == "chunked":
+			body = b""
+			while True:
+				size = int((await self.reader.readline()).split(b";")[0], 16)
+				chunk = await self.reader.readexactly(size + 2)
+				if size == 0:
+					break
+				body += chunk[:-2]
+		else:
+			body = await self.reader.read()
+			headers["connection"] = "close"
+
+		if headers.get("connection", "").lower() == "close":
+			self.close()
+		return code, body
+
+class Pool: #bounded pool of keep-alive connections
+	def __init__(self, size):
+		self.free = asyncio.Queue()
+		for _ in range(size):
+			self.free.put_nowait(Connection())
+
+	async def post(self, path, body):
+		conn = await self.free.get()
+		try:
+			return await conn.post(path, body)
+		except:
+			conn.close() #broken or timed out connection is reopened by the next request
+			raise
+		finally:
+			self.free.put_nowait(conn)
+
+	def close(self):
+		while not self.free.empty():
+			self.free.get_nowait().close()
+
+class Recorder: #latencies and errors, per report window and for the whole run
+	def __init__(self):
+		self.total = {kind: [] for kind in KINDS}
+		self.window = []
+		self.errors = 0
+		self.window_errors = 0
+		self.window_started = time.monotonic()
+		self.started = self.window_started
+
+	def add(self, kind, latency, ok):
+		if ok:
+			self.total[kind].append(latency)
+			self.window.append(latency)
+		else:
+			self.errors += 1
+			self.window_errors += 1
+
+	def take_window(self): #returns (duration, latencies, errors) of the window and starts a new one
+		now = time.monotonic()
+		window = (now - self.window_started, self.window, self.window_errors)
+		self.window, self.window_errors, self.window_started = [], 0, now
+		return window
+
+def percentiles(latencies):
+	if not latencies:
+		return {"p50": 0.0, "p95": 0.0, "p99": 0.0}
+	ordered = sorted(latencies)
+	pick = lambda share: ordered[min(len(ordered) - 1, int(share * len(ordered)))] * 1000
+	return {"p50": pick(0.50), "p95": pick(0.95), "p99": pick(0.99)}
+
+def format_stats(duration, latencies, errors):
+	stats = percentiles(latencies)
+	return "{:8.1f} req/s  errors {:6d}  p50 {:7.1f} ms  p95 {:7.1f} ms  p99 {:7.1f} ms".format(
+		len(latencies) / duration if duration else 0.0, errors, stats["p50"], stats["p95"], stats["p99"])
 
 def calculate_token():
 	hash = hashlib.sha256()
 	hash.update(bytearray(CTX["password"], "utf8"))
 	return hash.hexdigest()
 
-def provisioning_sync(idx):
-	config = Configuration(idx)
-	stats = Statistics(idx)
+class Simulation:
+	def __init__(self, args):
+		self.args = args
+		self.pool = Pool(args.connections)
+		self.recorder = Recorder()
+		self.token = calculate_token()
+		self.devices = [Device(idx) for idx in range(1, args.devices + 1)]
+		self.next_idx = args.devices + 1 # Index of the next new device.
+		self.mix = args.mix
 
-	reqdict = {
-		"statistics": stats.get(),
-		"configuration": config.get(),
-		"token": calculate_token(),
-	}
+	def pick_kind(self):
+		return random.choices(KINDS, weights=[self.mix[kind] for kind in KINDS])[0]
 
-	server_send(reqdict)
+	def new_device(self, idx): #device is replaced by a not yet registered one
+		self.devices[idx] = Device(self.next_idx)
+		self.next_idx += 1
+		return self.devices[idx]
 
-def simulation_run():
-	try:
+	async def checkin(self, device, kind, due):
+		body = json.dumps(device.request(self.token, kind)).encode("utf-8")
+		ok = False
+		try:
+			code, respdata = await self.pool.post(CTX["path"], body)
+			if code == 200:
+				device.response(json.loads(respdata.decode("utf-8")))
+				ok = True
+			else:
+				logging.debug("Server returned error: {}".format(str(code)))
+		except Exception as exc:
+			logging.debug("Request failed: {}".format(repr(exc)))
+		self.recorder.add(kind, time.monotonic() - due, ok)
+
+	def first_kind(self, device): #first check-in of unknown device registers it
+		if device.config_hash is None and not self.args.registered:
+			return "new"
+		return None
+
+	async def device_loop(self, idx, stop):
+		await asyncio.sleep(random.uniform(0, self.args.interval)) #spreads devices over the interval
+		while time.monotonic() < stop:
+			due = time.monotonic()
+			device = self.devices[idx]
+			kind = self.first_kind(device) or self.pick_kind()
+			if kind == "new" and device.config_hash is not None:
+				device = self.new_device(idx)
+			await self.checkin(device, kind, due)
+			jitter = self.args.interval * self.args.jitter
+			await asyncio.sleep(max(0.0, self.args.interval + random.uniform(-jitter, jitter) - (time.monotonic() - due)))
+
+	async def reporter(self, label=""):
 		while True:
-			for idx in range(1, 28):
-				logging.warning("Simulating client {}".format(str(idx)))
-				provisioning_sync(idx)
-				time.sleep(CTX["interval"])
+			await asyncio.sleep(self.args.report_interval)
+			logging.warning("{}{}".format(label, format_stats(*self.recorder.take_window())))
+
+	async def run_devices(self):
+		stop = time.monotonic() + self.args.duration
+		reporter = asyncio.ensure_future(self.reporter())
+		await asyncio.gather(*[self.device_loop(idx, stop) for idx in range(len(self.devices))])
+		reporter.cancel()
+
+	async def run_open(self): #raises rate every step until duration ends or server saturates
+		rate = self.args.rate
+		stop = time.monotonic() + self.args.duration
+		pending = set()
+		while time.monotonic() < stop:
+			self.recorder.take_window()
+			step_end = min(stop, time.monotonic() + self.args.step_duration)
+			due = time.monotonic()
+			while due < step_end:
+				delay = due - time.monotonic()
+				if delay > 0:
+					await asyncio.sleep(delay)
+				idx = random.randrange(len(self.devices))
+				task = asyncio.ensure_future(self.open_checkin(idx, due))
+				pending.add(task)
+				task.add_done_callback(pending.discard)
+				due += random.expovariate(rate) #poisson arrivals
+			duration, latencies, errors = self.recorder.take_window()
+			logging.warning("rate {:8.1f} req/s: {}".format(rate, format_stats(duration, latencies, errors)))
+			if latencies and percentiles(latencies)["p99"] > self.args.max_p99 or errors > len(latencies) * 0.01:
+				logging.warning("Server saturated at about {:.1f} req/s".format(rate))
+				break
+			rate += self.args.rate_step
+		if pending:
+			await asyncio.wait(pending)
+
+	async def open_checkin(self, idx, due):
+		device = self.devices[idx]
+		kind = self.first_kind(device) or self.pick_kind()
+		if kind == "new" and device.config_hash is not None:
+			device = self.new_device(idx)
+		await self.checkin(device, kind, due)
 
+	def summary(self):
+		duration = time.monotonic() - self.recorder.started
+		logging.warning("Total over {:.1f} s:".format(duration))
+		for kind in KINDS:
+			latencies = self.recorder.total[kind]
+			if latencies:
+				logging.warning("  {:8s}{:8d} check-ins  {}".format(kind, len(latencies), format_stats(duration, latencies, 0)))
+		logging.warning("  errors  {:8d}".format(self.recorder.errors))
+
+def parse_mix(value): #e.g. 'new=0.01,steady=0.94,changed=0.05'
+	mix = {kind: 0.0 for kind in KINDS}
+	for item in value.split(","):
+		kind, _, share = item.partition("=")
+		if kind not in mix:
+			raise argparse.ArgumentTypeError("unknown check-in kind {}".format(kind))
+		mix[kind] = float(share)
+	return mix
+
+def parse_args():
+	parser = argparse.ArgumentParser(description="Provisioning load generator")
+	parser.add_argument("--server", default=CTX["server"])
+	parser.add_argument("--port", type=int, default=CTX["port"])
+	parser.add_argument("--path", default=CTX["path"], help="e.g. /wrtapp/provisioning/async")
+	parser.add_argument("--password", default=CTX["password"])
+	parser.add_argument("--mode", choices=["devices", "open"], default="devices")
+	parser.add_argument("--devices", type=int, default=10000, help="simulated devices")
+	parser.add_argument("--registered", action="store_true", help="devices are already registered, skip registration check-ins")
+	parser.add_argument("--interval", type=float, default=10.0, help="seconds between check-ins of one device (devices mode)")
+	parser.add_argument("--jitter", type=float, default=0.2, help="interval jitter as a share of interval")
+	parser.add_argument("--mix", type=parse_mix, default=parse_mix("new=0.01,steady=0.94,changed=0.05"))
+	parser.add_argument("--connections", type=int, default=100, help="keep-alive connection pool size")
+	parser.add_argument("--duration", type=float, default=60.0, help="seconds")
+	parser.add_argument("--report-interval", type=float, default=5.0, help="seconds")
+	parser.add_argument("--rate", type=float, default=100.0, help="starting check-ins per second (open mode)")
+	parser.add_argument("--rate-step", type=float, default=100.0, help="rate increase per step (open mode)")
+	parser.add_argument("--step-duration", type=float, default=10.0, help="seconds (open mode)")
+	parser.add_argument("--max-p99", type=float, default=1000.0, help="p99 latency in ms considered saturated (open mode)")
+	parser.add_argument("--timeout", type=float, default=CTX["timeout"], help="seconds")
+	return parser.parse_args()
+
+async def simulation_run(args):
+	simulation = Simulation(args)
+	try:
+		if args.mode == "open":
+			await simulation.run_open()
+		else:
+			await simulation.run_devices()
+	finally:
+		simulation.pool.close()
+		simulation.summary()
+
+def main():
+	args = parse_args()
+	CTX.update({"server": args.server, "port": args.port, "path": args.path, "password": args.password, "timeout": args.timeout})
+	try:
+		asyncio.run(simulation_run(args))
 	except KeyboardInterrupt:
 		logging.warning("Interrupted!")
 
-simulation_run()
+if __name__ == "__main__":
+	main()
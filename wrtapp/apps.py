@@ -4,3 +4,7 @@ from django.apps import AppConfig
 class WrtappConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'wrtapp'
+
+    def ready(self):
+        from wrtapp import signals # connects config cache invalidation handlers
+        from wrtapp import lookups # registers 'ilike' lookups
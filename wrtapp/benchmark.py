@@ -0,0 +1,246 @@
+import datetime
+import hashlib
+import json
+import platform
+import random
+import statistics
+import subprocess
+import time
+import tracemalloc
+
+import django
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.db import connection
+from django.test import RequestFactory
+from django.utils import timezone
+
+from wrtapp.models import Device
+from wrtapp.models import Configuration
+from wrtapp.models import Statistics
+from wrtapp.models import StatisticsSample
+from wrtapp.models import Log
+from wrtapp.models import normalize_mac
+from wrtapp import provision
+from wrtapp import views
+from wrtapp.configcache import CONFIG_CACHE
+from wrtapp.logthrottle import DEDUPLICATOR, LIMITER
+from wrtapp.sqlprofile import profiled
+
+#benchmark of provisioning and dashboard hot paths against a seeded db (see benchmark command).
+#Every case is a function and a prepare function which builds its arguments for one call, arguments are
+#built before measuring, so only the call itself is timed. Calls are measured twice: timing pass records
+#wall time, db queries and db time of every call, allocation pass runs under tracemalloc (which slows
+#python code down a lot) and records peak and retained memory of every call
+
+SEED_BATCH = 5000
+OFFLINE_SHARE = 0.05 # Share of seeded devices which did not report for OFFLINE_THRESHOLD.
+LOG_DAYS = 7 # Seeded log rows are spread over this many past days.
+BENCH_USER = 'benchmark'
+
+def device_mac(idx):
+	return '02BE{:08X}'.format(idx)
+
+def device_config(idx):
+	return {
+		'hostname': 'sim{}'.format(idx),
+		'ip': '10.{}.{}.{}'.format(*idx.to_bytes(3, 'big')),
+		'netmask': '255.0.0.0',
+		'gateway': '10.0.0.1',
+		'dns1': '8.8.8.8',
+		'dns2': '8.8.4.4',
+	}
+
+def checkin_data(idx, config_hash=None, hostname=None): #check-in of seeded device, as agent sends it
+	config = device_config(idx)
+	data = {
+		'statistics': {
+			'system': {
+				'mac': device_mac(idx),
+				'model': 'SIM{}'.format(idx % 100),
+				'cpu_load': 12.5,
+				'memory_usage': 40.1,
+				'status': 'OK'
+			}
+		},
+		'configuration': {
+			'system': {
+				'hostname': hostname or config['hostname']
+			},
+			'network': {key: config[key] for key in ['ip', 'netmask', 'gateway', 'dns1', 'dns2']}
+		},
+		'token': hashlib.sha256(bytearray(settings.PROVISIONING_PASSWORD, 'utf8')).hexdigest()
+	}
+	if config_hash:
+		data['config_hash'] = config_hash
+	return data
+
+def clear():
+	with connection.cursor() as cursor: #cascades to configs, stats and logs
+		cursor.execute('TRUNCATE {}, {} CASCADE'.format(Device._meta.db_table, StatisticsSample._meta.db_table))
+	CONFIG_CACHE.clear()
+	DEDUPLICATOR.clear()
+	LIMITER.clear()
+
+def seed(size):
+	clear()
+	rng = random.Random(size)
+	now = timezone.now()
+	stale = now - datetime.timedelta(seconds=settings.OFFLINE_THRESHOLD * 2)
+	for start in range(1, size + 1, SEED_BATCH):
+		idxs = range(start, min(size, start + SEED_BATCH - 1) + 1)
+		devices = Device.objects.bulk_create([Device(mac=device_mac(idx), model='SIM{}'.format(idx % 100),
+			name='Device {}'.format(idx), description='Benchmark device') for idx in idxs])
+		configs = []
+		for idx, device in zip(idxs, devices):
+			config = Configuration(device=device, **device_config(idx))
+			config.config_hash = config.compute_hash()
+			configs.append(config)
+		Configuration.objects.bulk_create(configs)
+		Statistics.objects.upsert([(device.id, 'OK', round(rng.uniform(0, 100), 1), round(rng.uniform(0, 100), 1),
+			stale if rng.random() < OFFLINE_SHARE else now) for device in devices])
+		Log.objects.bulk_create([Log(device=device, severity='WARNING', message='Added new device',
+			date=now - datetime.timedelta(seconds=rng.uniform(0, LOG_DAYS * 86400))) for device in devices])
+	if not User.objects.filter(username=BENCH_USER).exists():
+		User.objects.create_superuser(BENCH_USER, 'benchmark@localhost', None)
+	with connection.cursor() as cursor: #planner statistics, otherwise plans depend on when autovacuum ran
+		cursor.execute('ANALYZE')
+
+def percentile(values, share):
+	ordered = sorted(values)
+	return ordered[min(len(ordered) - 1, int(share * len(ordered)))]
+
+class Benchmark:
+	def __init__(self, size, iterations, alloc_iterations, warmup, seed=0):
+		self.size = size
+		self.iterations = iterations
+		self.alloc_iterations = alloc_iterations
+		self.warmup = warmup
+		self.rng = random.Random(seed)
+		self.next_idx = size + 1 # Index of the next not yet registered device.
+		self.factory = RequestFactory()
+		self.user = User.objects.get(username=BENCH_USER)
+
+	def random_idx(self):
+		return self.rng.randint(1, self.size)
+
+	def steady_data(self): #agent which already applied current config
+		idx = self.random_idx()
+		return checkin_data(idx, config_hash=Configuration(**device_config(idx)).compute_hash())
+
+	def changed_data(self): #agent config differs from db config, it has to be diffed
+		return checkin_data(self.random_idx(), hostname='changed')
+
+	def new_data(self):
+		self.next_idx += 1
+		return checkin_data(self.next_idx - 1)
+
+	def loaded(self, data): #stage function arguments, device is loaded as store_checkin would do it
+		return data, provision.load_device(normalize_mac(data['statistics']['system']['mac']))
+
+	def post(self, data):
+		return (self.factory.post('/wrtapp/provisioning', json.dumps(data), content_type='application/json'),)
+
+	def get(self, path, search=None):
+		request = self.factory.get(path, {'search': search} if search else {})
+		request.user = self.user
+		return (request,)
+
+	def cases(self): #(name, function, prepare) of every measured case
+		return [
+			('data_is_valid', provision.data_is_valid, lambda: (self.steady_data(),)),
+			('register_device existing', provision.register_device, lambda: self.loaded(self.steady_data())),
+			('register_device new', provision.register_device, lambda: (self.new_data(), None)),
+			('update_stats', provision.update_stats, lambda: self.loaded(self.steady_data())),
+			('build_config unchanged', provision.build_config, lambda: self.loaded(self.steady_data())),
+			('build_config changed', provision.build_config, lambda: self.loaded(self.changed_data())),
+			('process steady', provision.ops.process, lambda: self.post(self.steady_data())),
+			('process changed', provision.ops.process, lambda: self.post(self.changed_data())),
+			('process new', provision.ops.process, lambda: self.post(self.new_data())),
+			('device show', views.deviceView.show, lambda: self.get('/wrtapp/device/show')),
+			('device search', views.deviceView.search, lambda: self.get('/wrtapp/device/search', 'SIM{}'.format(self.rng.randint(0, 99)))),
+			('config show', views.configView.show, lambda: self.get('/wrtapp/configuration/show')),
+			('config search', views.configView.search, lambda: self.get('/wrtapp/configuration/search', 'sim{}'.format(self.random_idx()))),
+			('stats show', views.statsView.show, lambda: self.get('/wrtapp/statistics/show')),
+			('stats search', views.statsView.search, lambda: self.get('/wrtapp/statistics/search', 'cpu>{}'.format(self.rng.randint(50, 99)))),
+			('user show', views.userView.show, lambda: self.get('/wrtapp/user/show')),
+			('user search', views.userView.search, lambda: self.get('/wrtapp/user/search', BENCH_USER)),
+			('log show', views.logView.show, lambda: self.get('/wrtapp/log/show')),
+			('log search', views.logView.search, lambda: self.get('/wrtapp/log/search', 'added')),
+		]
+
+	def measure(self, name, func, prepare):
+		for _ in range(self.warmup): #fills caches, compiles templates and regexes
+			func(*prepare())
+
+		wall, queries, db_time = [], [], []
+		for _ in range(self.iterations):
+			args = prepare()
+			with profiled() as profile:
+				started = time.perf_counter()
+				func(*args)
+				wall.append(time.perf_counter() - started)
+			queries.append(profile.count)
+			db_time.append(profile.duration)
+
+		peak, retained = [], []
+		tracemalloc.start()
+		try:
+			for _ in range(self.alloc_iterations):
+				args = prepare()
+				tracemalloc.clear_traces() #resets peak too
+				func(*args)
+				current, top = tracemalloc.get_traced_memory()
+				peak.append(top)
+				retained.append(current)
+		finally:
+			tracemalloc.stop()
+
+		result = {
+			'size': self.size,
+			'case': name,
+			'iterations': self.iterations,
+			'wall_ms': {
+				'min': min(wall) * 1000,
+				'median': statistics.median(wall) * 1000,
+				'p95': percentile(wall, 0.95) * 1000,
+				'mean': statistics.mean(wall) * 1000,
+			},
+			'queries': statistics.mean(queries),
+			'db_ms': statistics.median(db_time) * 1000,
+		}
+		if peak:
+			result['alloc_kb'] = {'peak': statistics.median(peak) / 1024, 'retained': statistics.median(retained) / 1024}
+		return result
+
+	def run(self, only=None):
+		return [self.measure(name, func, prepare) for name, func, prepare in self.cases() if not only or name in only]
+
+def environment(): #recorded with results, comparing runs with different settings is meaningless
+	try:
+		commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=settings.BASE_DIR,
+			capture_output=True, text=True, timeout=5).stdout.strip() or 'unknown'
+	except (OSError, subprocess.SubprocessError):
+		commit = 'unknown'
+	return {
+		'commit': commit,
+		'date': timezone.now().isoformat(),
+		'python': platform.python_version(),
+		'django': django.get_version(),
+		'postgres': connection.pg_version,
+		'settings': {name: getattr(settings, name) for name in ['CONFIG_CACHE_ENABLED', 'CONFIG_CACHE_BACKEND',
+			'STATS_HISTORY_ENABLED', 'LOG_DEDUP_WINDOW', 'LOG_RATE_LIMIT', 'PAGE_SIZE']},
+	}
+
+def compare(results, baseline, threshold): #returns (size, case, old median, new median, change %, slower) of cases found in both
+	old = {(result['size'], result['case']): result for result in baseline}
+	rows = []
+	for result in results:
+		previous = old.get((result['size'], result['case']))
+		if previous is None:
+			continue
+		before = previous['wall_ms']['median']
+		after = result['wall_ms']['median']
+		change = (after - before) / before * 100 if before else 0.0
+		rows.append((result['size'], result['case'], before, after, change, change > threshold))
+	return rows
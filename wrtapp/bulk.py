@@ -0,0 +1,162 @@
+import csv
+import io
+import json
+
+from django.conf import settings
+from django.db import connection, transaction
+
+from wrtapp.models import Device
+from wrtapp.models import Configuration
+from wrtapp.models import CONFIG_FIELDS
+
+from wrtapp.configcache import CONFIG_CACHE
+from wrtapp.notifier import NOTIFIER
+
+#bulk import of devices together with their configs. All rows are copied with one COPY into temporary
+#staging table, checked there with set-based UPDATEs (invalid rows get an error and are skipped) and
+#valid rows are merged into device and config tables with one upsert per table, so import of 100k rows
+#costs the same few statements as import of 10. Config columns of a row are either all empty (device
+#without config) or all valid. Export of the same columns is streamed, see export.py
+
+DEVICE_COLUMNS = ['mac', 'model', 'name', 'description'] + CONFIG_FIELDS
+STAGING_TABLE = 'wrtapp_device_import'
+ERRORS_SHOWN = 100 # Invalid rows listed in import result.
+
+IPV4_PATTERN = r'^((25[0-5]|2[0-4][0-9]|1[0-9][0-9]|[1-9]?[0-9])\.){3}(25[0-5]|2[0-4][0-9]|1[0-9][0-9]|[1-9]?[0-9])$'
+
+def has_config(prefix=''): #condition true for rows with any config column filled
+	return "concat({}) <> ''".format(', '.join(prefix + field for field in CONFIG_FIELDS))
+
+#(error, condition true for invalid row, params), checked in this order, row keeps its first error
+CHECKS = [
+	('invalid mac', "mac !~ '^[0-9A-F]{12}$'", []),
+	('duplicate mac', 'EXISTS (SELECT 1 FROM {0} AS first WHERE first.mac = {0}.mac AND first.line < {0}.line)'.format(STAGING_TABLE), []),
+	('invalid model', "model = '' OR length(model) > 64", []),
+	('invalid name', 'length(name) > 64', []),
+	('invalid description', 'length(description) > 128', []),
+	('invalid hostname', has_config() + " AND hostname !~ '^\\w{1,64}$'", []),
+] + [('invalid ' + field, has_config() + ' AND {} !~ %s'.format(field), [IPV4_PATTERN]) for field in CONFIG_FIELDS[1:]]
+
+class CopyStream: #file-like object which feeds rows to COPY as csv, whole file is never in memory
+	def __init__(self, rows):
+		self.rows = rows
+		self.buffer = io.StringIO()
+		self.writer = csv.writer(self.buffer)
+		self.data = ''
+		self.error = None #parse error of the input, COPY just ends there and caller raises it
+
+	def read(self, size=-1):
+		while self.error is None and (size < 0 or len(self.data) < size):
+			try:
+				row = next(self.rows, None)
+			except Exception as exc:
+				self.error = exc
+				break
+			if row is None:
+				break
+			self.buffer.seek(0)
+			self.buffer.truncate()
+			self.writer.writerow(row)
+			self.data += self.buffer.getvalue()
+		if size < 0:
+			size = len(self.data)
+		chunk, self.data = self.data[:size], self.data[size:]
+		return chunk
+
+def read_rows(fp, fmt): #yields [line] + DEVICE_COLUMNS values of binary csv (with header) or jsonl file
+	text = io.TextIOWrapper(fp, encoding='utf-8-sig', newline='')
+	if fmt == 'jsonl':
+		for line, data in enumerate(text, 1):
+			if not data.strip():
+				continue
+			obj = json.loads(data)
+			if not isinstance(obj, dict):
+				raise ValueError('Line {}: object expected'.format(line))
+			yield [line] + [str(obj.get(column) or '').strip() for column in DEVICE_COLUMNS]
+	else:
+		reader = csv.DictReader(text)
+		if not reader.fieldnames or 'mac' not in reader.fieldnames:
+			raise ValueError('CSV header with mac column expected')
+		for row in reader:
+			yield [reader.line_num] + [(row.get(column) or '').strip() for column in DEVICE_COLUMNS]
+
+def import_devices(fp, fmt, update=False):
+	#existing devices (by mac) are kept as they are unless update is set, their missing configs are added.
+	#Returns dict with numbers of rows, created and updated devices, written configs and first invalid rows
+	with transaction.atomic(), connection.cursor() as cursor:
+		#dropped at the end, on failure rollback removes it
+		cursor.execute('CREATE TEMPORARY TABLE {} (line integer, {}, error text)'.format(
+			STAGING_TABLE, ', '.join(column + ' text' for column in DEVICE_COLUMNS)))
+		stream = CopyStream(read_rows(fp, fmt))
+		cursor.copy_expert('COPY {} (line, {}) FROM STDIN WITH (FORMAT csv, FORCE_NOT_NULL ({}))'.format(
+			STAGING_TABLE, ', '.join(DEVICE_COLUMNS), ', '.join(DEVICE_COLUMNS)), stream)
+		if stream.error:
+			raise stream.error
+
+		cursor.execute("UPDATE {} SET mac = upper(regexp_replace(mac, '[:|\\-\\.\\s]', '', 'g'))".format(STAGING_TABLE)) #as normalize_mac
+		cursor.execute('CREATE INDEX ON {} (mac)'.format(STAGING_TABLE))
+		cursor.execute('ANALYZE {}'.format(STAGING_TABLE))
+		for error, condition, params in CHECKS:
+			cursor.execute('UPDATE {} SET error = %s WHERE error IS NULL AND ({})'.format(STAGING_TABLE, condition), [error] + params)
+
+		if update:
+			conflict = ('DO UPDATE SET model = EXCLUDED.model, name = EXCLUDED.name, description = EXCLUDED.description '
+				'WHERE (device.model, device.name, device.description) IS DISTINCT FROM (EXCLUDED.model, EXCLUDED.name, EXCLUDED.description)')
+		else:
+			conflict = 'DO NOTHING'
+		cursor.execute(('INSERT INTO {0} AS device (mac, model, name, description, date_added) '
+			"SELECT mac, model, COALESCE(NULLIF(name, ''), 'Generic device'), COALESCE(NULLIF(description, ''), 'Imported'), now() "
+			'FROM {1} WHERE error IS NULL ORDER BY line '
+			'ON CONFLICT (mac) {2} '
+			'RETURNING id, mac, xmax = 0').format(Device._meta.db_table, STAGING_TABLE, conflict)) #xmax is 0 for inserted rows
+		devices = cursor.fetchall()
+
+		if update:
+			conflict = ('DO UPDATE SET {}, config_hash = EXCLUDED.config_hash '
+				'WHERE config.config_hash <> EXCLUDED.config_hash').format(', '.join('{0} = EXCLUDED.{0}'.format(field) for field in CONFIG_FIELDS))
+		else:
+			conflict = 'DO NOTHING'
+		cursor.execute(('WITH written AS (INSERT INTO {0} AS config (device_id, {2}, config_hash) '
+			'SELECT device.id, staged.hostname, {3}, '
+			"encode(sha256(convert_to(concat_ws(E'\\n', {4}), 'UTF8')), 'hex') " #same as Configuration.compute_hash
+			'FROM {1} AS staged JOIN {5} AS device ON device.mac = staged.mac '
+			'WHERE staged.error IS NULL AND {6} '
+			'ON CONFLICT (device_id) {7} '
+			'RETURNING device_id) '
+			'SELECT written.device_id, device.mac FROM written JOIN {5} AS device ON device.id = written.device_id').format(
+			Configuration._meta.db_table, STAGING_TABLE, ', '.join(CONFIG_FIELDS),
+			', '.join('staged.{}::inet'.format(field) for field in CONFIG_FIELDS[1:]),
+			', '.join('staged.' + field for field in CONFIG_FIELDS),
+			Device._meta.db_table, has_config('staged.'), conflict))
+		configs = cursor.fetchall()
+
+		cursor.execute('SELECT count(*) FROM {}'.format(STAGING_TABLE))
+		rows = cursor.fetchone()[0]
+		cursor.execute('SELECT line, mac, error FROM {} WHERE error IS NOT NULL ORDER BY line LIMIT %s'.format(STAGING_TABLE), [ERRORS_SHOWN])
+		errors = [{'line': line, 'mac': mac, 'error': error} for line, mac, error in cursor.fetchall()]
+		cursor.execute('SELECT count(*) FROM {} WHERE error IS NOT NULL'.format(STAGING_TABLE))
+		invalid = cursor.fetchone()[0]
+		cursor.execute('DROP TABLE {}'.format(STAGING_TABLE))
+
+		#raw sql does not send model signals, cached and long-polled configs of changed devices are refreshed here
+		changed = {device_id: mac for device_id, mac, created in devices if not created}
+		changed.update(configs)
+		def refresh():
+			for device_id, mac in changed.items():
+				CONFIG_CACHE.invalidate(device_id, mac)
+				NOTIFIER.publish(device_id)
+		transaction.on_commit(refresh)
+
+	created = sum(1 for device in devices if device[2])
+	return {
+		'rows': rows,
+		'invalid': invalid,
+		'created': created,
+		'updated': len(devices) - created,
+		'configs': len(configs),
+		'errors': errors,
+	}
+
+def export_rows(): #rows in the order of DEVICE_COLUMNS from server-side cursor, devices without config have empty config columns
+	return Device.objects.order_by('pk').values_list('mac', 'model', 'name', 'description',
+		*['configuration__' + field for field in CONFIG_FIELDS]).iterator(chunk_size=settings.EXPORT_CHUNK_SIZE)
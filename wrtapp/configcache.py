@@ -0,0 +1,108 @@
+import threading
+import time
+
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.cache import caches
+
+from wrtapp.models import Device
+from wrtapp.models import Configuration
+from wrtapp.models import CONFIG_FIELDS
+
+#cache of device id and desired configuration keyed by normalized mac. Configuration only changes when admin
+#saves it, so steady-state check-ins do not have to read it from db. Entries are invalidated by model signals
+#(see signals.py) and also expire after timeout, which bounds staleness if other process changed the config
+
+class LocalBackend: #per-process LRU cache, suitable for single process deployments
+	def __init__(self, max_entries, timeout):
+		self.max_entries = max_entries
+		self.timeout = timeout
+		self.entries = OrderedDict() # key -> (expires, value)
+		self.lock = threading.Lock()
+
+	def get(self, key):
+		with self.lock:
+			item = self.entries.get(key)
+			if item is None:
+				return None
+			if item[0] < time.monotonic():
+				del self.entries[key]
+				return None
+			self.entries.move_to_end(key)
+			return item[1]
+
+	def set(self, key, value):
+		with self.lock:
+			self.entries[key] = (time.monotonic() + self.timeout, value)
+			self.entries.move_to_end(key)
+			while len(self.entries) > self.max_entries: #evicts least recently used
+				self.entries.popitem(last=False)
+
+	def delete(self, key):
+		with self.lock:
+			self.entries.pop(key, None)
+
+	def clear(self):
+		with self.lock:
+			self.entries.clear()
+
+class DjangoBackend: #django cache framework (e.g. memcached or redis), shared by all worker processes
+	def __init__(self, alias, timeout):
+		self.cache = caches[alias]
+		self.timeout = timeout
+
+	def get(self, key):
+		return self.cache.get(key)
+
+	def set(self, key, value):
+		self.cache.set(key, value, self.timeout)
+
+	def delete(self, key):
+		self.cache.delete(key)
+
+	def clear(self):
+		self.cache.clear()
+
+class ConfigCache:
+	def __init__(self, backend):
+		self.backend = backend
+
+	def get(self, mac): #returns device with attached configuration or None
+		entry = self.backend.get('wrtapp:mac:' + mac)
+		if entry is None:
+			return None
+		device = Device(id=entry['id'], mac=mac)
+		device._state.adding = False
+		device._state.db = 'default'
+		device.configuration = Configuration(device=device, **entry['config'])
+		return device
+
+	def put(self, device):
+		try:
+			config = device.configuration
+		except Configuration.DoesNotExist: #device without config is not cached, check-in will fail anyway
+			return
+		entry = {
+			'id': device.id,
+			'config': {field: getattr(config, field) for field in CONFIG_FIELDS + ['config_hash']}
+		}
+		self.backend.set('wrtapp:mac:' + device.mac, entry)
+		self.backend.set('wrtapp:device:' + str(device.id), device.mac) #lets signals invalidate by id if mac was changed
+
+	def invalidate(self, device_id, mac=None):
+		oldmac = self.backend.get('wrtapp:device:' + str(device_id))
+		for key in set([oldmac, mac]):
+			if key:
+				self.backend.delete('wrtapp:mac:' + key)
+		self.backend.delete('wrtapp:device:' + str(device_id))
+
+	def clear(self):
+		self.backend.clear()
+
+def create_cache():
+	if settings.CONFIG_CACHE_BACKEND == 'django':
+		return ConfigCache(DjangoBackend(settings.CONFIG_CACHE_ALIAS, settings.CONFIG_CACHE_TIMEOUT))
+	return ConfigCache(LocalBackend(settings.CONFIG_CACHE_MAX_ENTRIES, settings.CONFIG_CACHE_TIMEOUT))
+
+CONFIG_CACHE = create_cache()
@@ -0,0 +1,120 @@
+import csv
+import datetime
+import io
+import json
+import zlib
+
+from django.conf import settings
+from django.db.models import Q
+from django.http import StreamingHttpResponse
+from django.utils import timezone
+from django.utils.dateparse import parse_date, parse_datetime
+
+from wrtapp.models import normalize_mac
+from wrtapp.pagination import key_fields, seek
+
+#streamed exports of db tables, csv or jsonl, optionally gzipped. Rows are serialized and sent in chunks of
+#EXPORT_CHUNK_SIZE rows, response never holds the whole file. Big tables (logs, stats history) are read with
+#keyset_rows: every chunk is a separate short indexed query starting after the last row of previous chunk
+#(see pagination.py), so export of millions of rows never runs one long query or keeps a snapshot open,
+#which would hold back vacuum and block 'manage.py partitions' from dropping old partitions
+
+FORMATS = {'csv': 'text/csv', 'jsonl': 'application/x-ndjson'}
+
+def value_str(value): #csv cell, dates in iso format as in jsonl
+	if value is None:
+		return ''
+	if hasattr(value, 'isoformat'):
+		return value.isoformat()
+	return value
+
+def json_value(value):
+	if hasattr(value, 'isoformat'):
+		return value.isoformat()
+	return value
+
+def csv_chunks(rows, columns, size):
+	buffer = io.StringIO()
+	writer = csv.writer(buffer)
+	writer.writerow(columns)
+	count = 0
+	for row in rows:
+		writer.writerow([value_str(value) for value in row])
+		count += 1
+		if count % size == 0:
+			yield buffer.getvalue()
+			buffer.seek(0)
+			buffer.truncate()
+	yield buffer.getvalue()
+
+def jsonl_chunks(rows, columns, size):
+	lines = []
+	for row in rows:
+		lines.append(json.dumps({column: json_value(value) for column, value in zip(columns, row)}))
+		if len(lines) == size:
+			yield '\n'.join(lines) + '\n'
+			lines = []
+	if lines:
+		yield '\n'.join(lines) + '\n'
+
+def gzip_chunks(chunks):
+	compressor = zlib.compressobj(6, zlib.DEFLATED, 31) # 31 = gzip container
+	for chunk in chunks:
+		data = compressor.compress(chunk.encode('utf8'))
+		if data:
+			yield data
+	yield compressor.flush()
+
+def export_chunks(rows, columns, fmt): #rows are tuples of values in the order of columns
+	if fmt == 'jsonl':
+		return jsonl_chunks(rows, columns, settings.EXPORT_CHUNK_SIZE)
+	return csv_chunks(rows, columns, settings.EXPORT_CHUNK_SIZE)
+
+def keyset_rows(queryset, ordering, columns): #values of columns, read in keyset chunks, ordering must be unique
+	keys = key_fields(queryset, ordering)
+	size = settings.EXPORT_CHUNK_SIZE
+	after = None
+	while True:
+		chunk = queryset if after is None else queryset.filter(seek(keys, after, True))
+		rows = list(chunk.order_by(*ordering).values_list(*[attname for attname, _, _ in keys], *columns)[:size])
+		for row in rows:
+			yield row[len(keys):]
+		if len(rows) < size:
+			return
+		after = rows[-1][:len(keys)]
+
+def date_bound(value, end): #'2024-05-01' or iso datetime, date of range end is included as a whole day
+	bound = parse_datetime(value)
+	if bound is None:
+		day = parse_date(value)
+		if day is None:
+			raise ValueError('Invalid date {}'.format(value))
+		if end:
+			day += datetime.timedelta(days=1)
+		bound = datetime.datetime.combine(day, datetime.time())
+	if timezone.is_naive(bound):
+		bound = timezone.make_aware(bound)
+	return bound
+
+def export_filter(request): #date range (?from=, ?to=) and device (?device=mac) of export, raises ValueError
+	condition = Q()
+	if request.GET.get('from'):
+		condition &= Q(date__gte=date_bound(request.GET['from'], False))
+	if request.GET.get('to'):
+		condition &= Q(date__lt=date_bound(request.GET['to'], True))
+	if request.GET.get('device'):
+		condition &= Q(device__mac=normalize_mac(request.GET['device']))
+	return condition
+
+def export_response(request, rows, columns, filename): #?format=csv|jsonl, ?gzip=1
+	fmt = request.GET.get('format', 'csv')
+	if fmt not in FORMATS:
+		fmt = 'csv'
+	chunks = export_chunks(rows, columns, fmt)
+	if request.GET.get('gzip') == '1': #as sent by export form checkbox, gzip=0 or other values mean plain text
+		response = StreamingHttpResponse(gzip_chunks(chunks), content_type='application/gzip')
+		response['Content-Disposition'] = 'attachment; filename="{}.{}.gz"'.format(filename, fmt)
+	else:
+		response = StreamingHttpResponse(chunks, content_type=FORMATS[fmt])
+		response['Content-Disposition'] = 'attachment; filename="{}.{}"'.format(filename, fmt)
+	return response
@@ -3,6 +3,7 @@ from django.contrib.auth.models import User
 
 from wrtapp.models import Device
 from wrtapp.models import Configuration
+from wrtapp.models import normalize_mac
 
 #these classes define ui forms rendered on the browser 
 #django forms api has a lot of methods and objects to define ui elements using python instead pure html
@@ -14,6 +15,9 @@ class DeviceForm(forms.ModelForm):
 		model = Device
 		fields = '__all__'
 
+	def clean_mac(self): #normalized before unique check, so 'a4:2b:..' and 'A42B..' are the same device
+		return normalize_mac(self.cleaned_data['mac'])
+
 class ConfigurationForm(forms.ModelForm):
 	class Meta:
 		model = Configuration
@@ -40,3 +44,8 @@ class UserUpdateForm(forms.Form):
 
 class SearchForm(forms.Form):
 	search = forms.CharField()
+
+class DeviceImportForm(forms.Form): #csv with header or json lines, columns as in bulk.DEVICE_COLUMNS
+	file = forms.FileField()
+	format = forms.ChoiceField(choices=[('csv', 'CSV'), ('jsonl', 'JSON lines')])
+	update = forms.BooleanField(required = False) #overwrite existing devices and configs
@@ -1,14 +1,30 @@
 import logging
 
+from django.conf import settings
+
 from wrtapp.models import Log, Device
+from wrtapp.logsink import LOG_SINK
+from wrtapp.logthrottle import DEDUPLICATOR, LIMITER, log_source
 from django.contrib.auth.models import User
 
+from asgiref.sync import sync_to_async
+
+LEVELS = {'ERROR': logging.ERROR, 'WARNING': logging.WARNING, 'DEBUG': logging.DEBUG}
+MESSAGE_LENGTH = Log._meta.get_field('message').max_length
+
+#messages can be passed as format string with args, e.g. LOGGER.debug('Batch of {} check-ins', len(checkins)),
+#they are formatted only if they are written somewhere, so disabled debug messages cost almost nothing
 class Logger:
 	def __init__(self, name):
 		self.logger = logging.getLogger()
 		self.logname = name
 
-	def log_message(self, severity, msg, device, user):
+	def log_message(self, severity, msg, device, user, args=(), source=None): #source: sender of request without device row, see logthrottle.py
+		if severity not in LEVELS:
+			self.logger.error('invalid severity level')
+			return
+		if severity == 'DEBUG' and not self.logger.isEnabledFor(logging.DEBUG): #debug messages are not written to db
+			return
 		if device and not isinstance(device, Device):
 			self.logger.error('logger got non-device arg')
 			return
@@ -18,69 +34,106 @@ class Logger:
 		if not isinstance(msg, str) or not isinstance(severity, str):
 			self.logger.error('logger got non-string arg')
 			return
-
-		log = Log()
-		log.severity = severity
-		log.message = msg
-
-		logstr = '[{}]'.format(self.logname.upper())
-		if user:
-			log.user = user
-			logstr = logstr + '[{}]'.format(user.username)
-		if device:
-			log.device = device
-			logstr = logstr + '[{}]'.format(device.mac)
-		logstr = logstr + ': {}'.format(msg)
-
-		if severity == 'ERROR':
-			try:
-				log.save()
-			except:
-				self.logger.error('failed to log error to db')
-			self.logger.error(logstr)
-		elif severity == 'WARNING':
-			try:
+		if args:
+			msg = msg.format(*args)
+
+		if severity != 'DEBUG':
+			self.write(Log(severity=severity, message=msg[:MESSAGE_LENGTH], device=device, user=user), source)
+
+		if self.logger.isEnabledFor(LEVELS[severity]):
+			logstr = '[{}]'.format(self.logname.upper())
+			if user:
+				logstr = logstr + '[{}]'.format(user.username)
+			if device:
+				logstr = logstr + '[{}]'.format(device.mac)
+			elif source:
+				logstr = logstr + '[{}]'.format(source)
+			self.logger.log(LEVELS[severity], logstr + ': {}'.format(msg))
+
+	def write(self, log, source=None): #repeats only update counter of the first row, new rows are rate limited per source
+		first = DEDUPLICATOR.merge(log, source)
+		if first is not None and settings.LOG_SINK_ENABLED:
+			LOG_SINK.touch(first)
+			return
+		if not LIMITER.allow(log_source(log, self.logname, source)):
+			if first is None:
+				DEDUPLICATOR.forget(log, source)
+			return
+		try:
+			if first is not None: #counter is absolute, so skipped updates are caught up by the next one
+				Log.objects.update_repeats([first])
+			elif settings.LOG_SINK_ENABLED:
+				if not LOG_SINK.add(log):
+					DEDUPLICATOR.forget(log, source)
+			else:
 				log.save()
-			except:
-				self.logger.error('failed to log warning to db')
-			self.logger.warning(logstr)
-		elif severity == 'DEBUG':
-			self.logger.debug(logstr)
+		except:
+			DEDUPLICATOR.forget(log, source)
+			self.logger.error('failed to log {} to db'.format(log.severity.lower()))
+
+	async def alog_message(self, severity, msg, device, user, args=(), source=None): #async version for async views, db write is done in a worker thread
+		#debug messages are not written to db and queued messages are written by the sink, no need for thread hop
+		if severity == 'DEBUG' or settings.LOG_SINK_ENABLED:
+			self.log_message(severity, msg, device, user, args, source)
 		else:
-			self.logger.error('invalid severity level')
+			await sync_to_async(self.log_message)(severity, msg, device, user, args, source)
+
+	def app_error(self, msg, device, user, *args):
+		self.log_message('ERROR', msg, device, user, args)
+
+	def app_warning(self, msg, device, user, *args):
+		self.log_message('WARNING', msg, device, user, args)
+
+	def app_debug(self, msg, device, user, *args):
+		self.log_message('DEBUG', msg, device, user, args)
+
+	def dev_error(self, msg, device, *args):
+		self.log_message('ERROR', msg, device, None, args)
+
+	def dev_warning(self, msg, device, *args):
+		self.log_message('WARNING', msg, device, None, args)
+
+	def dev_debug(self, msg, device, *args):
+		self.log_message('DEBUG', msg, device, None, args)
+
+	def user_error(self, msg, user, *args):
+		self.log_message('ERROR', msg, None, user, args)
+
+	def user_warning(self, msg, user, *args):
+		self.log_message('WARNING', msg, None, user, args)
 
-	def app_error(self, msg, device, user):
-		self.log_message('ERROR', msg, device, user)
+	def user_debug(self, msg, user, *args):
+		self.log_message('DEBUG', msg, None, user, args)
 
-	def app_warning(self, msg, device, user):
-		self.log_message('WARNING', msg, device, user)
+	def src_error(self, msg, source, *args):
+		self.log_message('ERROR', msg, None, None, args, source)
 
-	def app_debug(self, msg, device, user):
-		self.log_message('DEBUG', msg, device, user)
+	def error(self, msg, *args):
+		self.log_message('ERROR', msg, None, None, args)
 
-	def dev_error(self, msg, device):
-		self.log_message('ERROR', msg, device, None)
+	def warning(self, msg, *args):
+		self.log_message('WARNING', msg, None, None, args)
 
-	def dev_warning(self, msg, device):
-		self.log_message('WARNING', msg, device, None)
+	def debug(self, msg, *args):
+		self.log_message('DEBUG', msg, None, None, args)
 
-	def dev_debug(self, msg, device):
-		self.log_message('DEBUG', msg, device, None)
+	async def adev_error(self, msg, device, *args):
+		await self.alog_message('ERROR', msg, device, None, args)
 
-	def user_error(self, msg, user):
-		self.log_message('ERROR', msg, None, user)
+	async def adev_warning(self, msg, device, *args):
+		await self.alog_message('WARNING', msg, device, None, args)
 
-	def user_warning(self, msg, user):
-		self.log_message('WARNING', msg, None, user)
+	async def adev_debug(self, msg, device, *args):
+		await self.alog_message('DEBUG', msg, device, None, args)
 
-	def user_debug(self, msg, user):
-		self.log_message('DEBUG', msg, None, user)
+	async def asrc_error(self, msg, source, *args):
+		await self.alog_message('ERROR', msg, None, None, args, source)
 
-	def error(self, msg):
-		self.log_message('ERROR', msg, None, None)
+	async def aerror(self, msg, *args):
+		await self.alog_message('ERROR', msg, None, None, args)
 
-	def warning(self, msg):
-		self.log_message('WARNING', msg, None, None)
+	async def awarning(self, msg, *args):
+		await self.alog_message('WARNING', msg, None, None, args)
 
-	def debug(self, msg):
-		self.log_message('DEBUG', msg, None, None)
+	async def adebug(self, msg, *args):
+		await self.alog_message('DEBUG', msg, None, None, args)
@@ -0,0 +1,133 @@
+import atexit
+import logging
+import queue
+import threading
+
+from django.conf import settings
+from django.db import connection
+
+from wrtapp.models import Log
+
+#write-behind queue for Log rows. Logger puts rows here instead of saving every one inline in the
+#request, background thread writes them with bulk_create every interval or as soon as batch_size rows
+#are waiting. Queue is bounded, when it is full the overflow policy decides what is lost:
+#'drop_new' drops the incoming row, 'drop_old' drops the oldest queued one, 'block' makes the caller
+#wait up to one interval for free space and drops the row after that
+OVERFLOW_POLICIES = ['drop_new', 'drop_old', 'block']
+
+class LogSink:
+	def __init__(self, interval, batch_size, max_queue, overflow, autostart=True):
+		self.interval = interval / 1000.0 # Milliseconds.
+		self.batch_size = batch_size
+		self.overflow = overflow if overflow in OVERFLOW_POLICIES else 'drop_new'
+		self.autostart = autostart
+		self.queue = queue.Queue(max_queue)
+		self.lock = threading.Lock()
+		self.wakeup = threading.Event()
+		self.stopping = False
+		self.thread = None
+		self.logger = logging.getLogger() #own failures must not go through the sink again
+		self.touched = {} # id(log) -> already queued or written row with changed repeat count
+		self.counters = {'added': 0, 'dropped': 0, 'flushed': 0, 'failed': 0}
+
+	def start(self): #flush thread is started lazily, so every worker process gets its own one
+		self.thread = threading.Thread(target=self.run, name='log-sink', daemon=True)
+		self.thread.start()
+		atexit.register(self.stop)
+
+	def add(self, log):
+		with self.lock:
+			if self.thread is None and self.autostart:
+				self.start()
+		if not self.put(log):
+			with self.lock:
+				self.counters['dropped'] += 1
+			return False
+		with self.lock:
+			self.counters['added'] += 1
+		if self.queue.qsize() >= self.batch_size:
+			self.wakeup.set()
+		return True
+
+	def touch(self, log): #repeat counter of log is written with next flush
+		with self.lock:
+			if self.thread is None and self.autostart:
+				self.start()
+			self.touched[id(log)] = log
+
+	def put(self, log):
+		try:
+			if self.overflow == 'block':
+				self.queue.put(log, timeout=self.interval)
+			else:
+				self.queue.put_nowait(log)
+			return True
+		except queue.Full:
+			pass
+		if self.overflow == 'drop_old':
+			try:
+				self.queue.get_nowait()
+				with self.lock:
+					self.counters['dropped'] += 1
+				self.queue.put_nowait(log)
+				return True
+			except (queue.Empty, queue.Full):
+				pass
+		return False
+
+	def drain(self):
+		batch = []
+		while len(batch) < self.batch_size:
+			try:
+				batch.append(self.queue.get_nowait())
+			except queue.Empty:
+				break
+		return batch
+
+	def flush(self): #writes everything queued so far, returns number of written rows
+		written = 0
+		while True:
+			batch = self.drain()
+			if not batch:
+				break
+			try:
+				Log.objects.bulk_create(batch)
+			except:
+				self.logger.error('failed to write {} queued log rows to db'.format(len(batch)))
+				with self.lock:
+					self.counters['failed'] += len(batch)
+				continue
+			written += len(batch)
+			with self.lock:
+				self.counters['flushed'] += len(batch)
+
+		with self.lock: #after inserts, so rows repeated while queued already have ids
+			touched, self.touched = list(self.touched.values()), {}
+		try:
+			Log.objects.update_repeats(touched)
+		except:
+			self.logger.error('failed to update {} repeated log rows in db'.format(len(touched)))
+		return written
+
+	def run(self):
+		while not self.stopping:
+			self.wakeup.wait(self.interval)
+			self.wakeup.clear()
+			connection.close_if_unusable_or_obsolete() #thread keeps own db connection, reconnect if it went away
+			self.flush()
+		connection.close()
+
+	def stop(self): #flushes everything on shutdown
+		self.stopping = True
+		self.wakeup.set()
+		if self.thread:
+			self.thread.join(self.interval + 5)
+		self.flush()
+
+	def stats(self):
+		with self.lock:
+			stats = dict(self.counters)
+		stats['pending'] = self.queue.qsize()
+		return stats
+
+LOG_SINK = LogSink(settings.LOG_SINK_INTERVAL, settings.LOG_SINK_BATCH_SIZE, settings.LOG_SINK_MAX_QUEUE, settings.LOG_SINK_OVERFLOW)
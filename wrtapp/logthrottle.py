@@ -0,0 +1,94 @@
+import datetime
+import threading
+import time
+
+from collections import OrderedDict
+
+from django.conf import settings
+
+#protects Log table from agents which repeat the same error forever.
+#LogDeduplicator merges repeats of (device, user, source, severity, message) seen within the window into the
+#row of the first occurrence, which keeps repeat count and time of the last repeat. RateLimiter is a token
+#bucket per source (device, user, sender of the request or logger), rows over the limit are not written to
+#db at all. Source is passed by callers which log errors of requests not tied to a device row (e.g. agent
+#mac of a check-in with bad token), so the same error of different agents is neither merged nor limited together
+
+class LogDeduplicator:
+	def __init__(self, window, max_entries):
+		self.window = datetime.timedelta(seconds=window)
+		self.max_entries = max_entries
+		self.entries = OrderedDict() # key -> (first row, window end)
+		self.lock = threading.Lock()
+
+	def merge(self, log, source=None): #returns row of the first occurrence with updated count if log is a repeat, otherwise None
+		if not self.window:
+			return None
+		key = (log.device_id, log.user_id, source, log.severity, log.message)
+		with self.lock:
+			entry = self.entries.get(key)
+			if entry is not None and log.date < entry[1]:
+				first = entry[0]
+				first.count += 1
+				first.last_seen = log.date
+				return first
+			self.entries[key] = (log, log.date + self.window)
+			self.entries.move_to_end(key)
+			while len(self.entries) > self.max_entries: #forgets oldest, its next repeat starts a new row
+				self.entries.popitem(last=False)
+		return None
+
+	def forget(self, log, source=None): #called when first row was not written, so its repeats are not merged into nothing
+		key = (log.device_id, log.user_id, source, log.severity, log.message)
+		with self.lock:
+			entry = self.entries.get(key)
+			if entry is not None and entry[0] is log:
+				del self.entries[key]
+
+	def clear(self):
+		with self.lock:
+			self.entries.clear()
+
+class RateLimiter:
+	def __init__(self, rate, burst, max_sources):
+		self.rate = rate # Rows per second, 0 disables limit.
+		self.burst = burst
+		self.max_sources = max_sources
+		self.buckets = OrderedDict() # source -> [tokens, last refill]
+		self.lock = threading.Lock()
+		self.suppressed = 0
+
+	def allow(self, source):
+		if not self.rate:
+			return True
+		now = time.monotonic()
+		with self.lock:
+			bucket = self.buckets.get(source)
+			if bucket is None:
+				bucket = [self.burst, now]
+				self.buckets[source] = bucket
+				while len(self.buckets) > self.max_sources:
+					self.buckets.popitem(last=False)
+			self.buckets.move_to_end(source)
+			bucket[0] = min(self.burst, bucket[0] + (now - bucket[1]) * self.rate)
+			bucket[1] = now
+			if bucket[0] < 1:
+				self.suppressed += 1
+				return False
+			bucket[0] -= 1
+			return True
+
+	def clear(self):
+		with self.lock:
+			self.buckets.clear()
+
+def log_source(log, logname, source=None): #rows are limited per device, then per user, then per given source, then per logger module
+	if log.device_id:
+		return 'device:{}'.format(log.device_id)
+	if log.user_id:
+		return 'user:{}'.format(log.user_id)
+	if source:
+		return 'source:' + source
+	return 'logger:' + logname
+
+DEDUPLICATOR = LogDeduplicator(settings.LOG_DEDUP_WINDOW, settings.LOG_DEDUP_MAX_ENTRIES)
+LIMITER = RateLimiter(settings.LOG_RATE_LIMIT, settings.LOG_RATE_BURST, settings.LOG_DEDUP_MAX_ENTRIES)
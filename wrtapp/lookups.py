@@ -0,0 +1,26 @@
+from django.db.models import CharField, GenericIPAddressField, Lookup
+
+#substring lookups which can use pg_trgm GIN indexes (see 0012 migration). Django icontains is compiled
+#to UPPER(col::text) LIKE UPPER(...), an expression no index is built on, so it always scans the table
+
+class ILike(Lookup): # field__ilike='A4:2' -> field ILIKE '%A4:2%'
+	lookup_name = 'ilike'
+	prepare_rhs = False # Fragment of ip is not a valid ip, field must not validate it.
+
+	def lhs_sql(self, lhs):
+		return lhs
+
+	def get_db_prep_lookup(self, value, connection):
+		return '%s', ['%' + connection.ops.prep_for_like_query(value) + '%']
+
+	def as_sql(self, compiler, connection):
+		lhs, lhs_params = self.process_lhs(compiler, connection)
+		rhs, rhs_params = self.process_rhs(compiler, connection)
+		return '{} ILIKE {}'.format(self.lhs_sql(lhs), rhs), list(lhs_params) + list(rhs_params)
+
+class HostILike(ILike): #inet is matched by its text form without netmask, same expression as the trigram index
+	def lhs_sql(self, lhs):
+		return 'host({})'.format(lhs)
+
+CharField.register_lookup(ILike)
+GenericIPAddressField.register_lookup(HostILike)
@@ -0,0 +1,65 @@
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test.utils import override_settings
+
+from wrtapp.benchmark import Benchmark, seed, environment, compare
+
+class Command(BaseCommand):
+	help = ('Seeds a separate benchmark database with 1k, 10k and 100k devices, measures provisioning stages and '
+		'dashboard views (wall time, queries, allocations) and writes results as json, e.g. for comparing commits')
+
+	def add_arguments(self, parser):
+		parser.add_argument('--sizes', default='1000,10000,100000', help='comma separated numbers of seeded devices')
+		parser.add_argument('--iterations', type=int, default=200, help='measured calls of every case')
+		parser.add_argument('--alloc-iterations', type=int, default=20, help='calls of every case measured under tracemalloc')
+		parser.add_argument('--warmup', type=int, default=5, help='not measured calls before every case')
+		parser.add_argument('--case', action='append', help='runs only this case, can be repeated')
+		parser.add_argument('--output', help='results file, default is benchmark-<commit>.json')
+		parser.add_argument('--compare', help='results file of an earlier run to compare median wall time with')
+		parser.add_argument('--threshold', type=float, default=10.0, help='slowdown in percent reported as regression')
+		parser.add_argument('--fail', action='store_true', help='exits with error if any case regressed')
+		parser.add_argument('--keepdb', action='store_true', help='keeps benchmark database between runs')
+
+	def handle(self, *args, **options):
+		sizes = [int(size) for size in options['sizes'].split(',')]
+		baseline = None
+		if options['compare']:
+			with open(options['compare']) as fp:
+				baseline = json.load(fp)['results']
+
+		#never runs against real data, database is created like the test database and dropped afterwards
+		old_name = connection.settings_dict['NAME']
+		connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False, keepdb=options['keepdb'])
+		try:
+			#write-behind buffers write from own threads at random moments, which would make timings
+			#and query counts of single calls meaningless, so stats and logs are written inline
+			with override_settings(DEBUG=False, STATS_BUFFER_ENABLED=False, LOG_SINK_ENABLED=False):
+				env = environment()
+				results = []
+				for size in sizes:
+					self.stdout.write('Seeding {} devices'.format(size))
+					seed(size)
+					bench = Benchmark(size, options['iterations'], options['alloc_iterations'], options['warmup'])
+					for result in bench.run(options['case']):
+						results.append(result)
+						self.stdout.write('{:>7} {:<26} {:9.3f} ms median {:9.3f} ms p95 {:6.1f} queries {:9.1f} KiB peak'.format(
+							size, result['case'], result['wall_ms']['median'], result['wall_ms']['p95'], result['queries'],
+							result.get('alloc_kb', {}).get('peak', 0.0)))
+		finally:
+			connection.creation.destroy_test_db(old_name, verbosity=0, keepdb=options['keepdb'])
+
+		output = options['output'] or 'benchmark-{}.json'.format(env['commit'])
+		with open(output, 'w') as fp:
+			json.dump(dict(env, results=results), fp, indent=2)
+		self.stdout.write('Results written to {}'.format(output))
+
+		if baseline is not None:
+			regressed = 0
+			for size, case, before, after, change, slower in compare(results, baseline, options['threshold']):
+				regressed += slower
+				self.stdout.write('{:>7} {:<26} {:9.3f} -> {:9.3f} ms {:+7.1f}%{}'.format(size, case, before, after, change,
+					'  REGRESSION' if slower else ''))
+			if regressed and options['fail']:
+				raise CommandError('{} cases are slower by more than {}%'.format(regressed, options['threshold']))
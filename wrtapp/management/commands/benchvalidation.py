@@ -0,0 +1,100 @@
+import re
+import timeit
+
+from django.core.management.base import BaseCommand
+
+from wrtapp.provision import PROV_SCHEMA, data_is_valid, validate
+
+#provisioning schema in the form used by the recursive validator before it was compiled
+LEGACY_SCHEMA = {
+	'statistics': {
+		'system': {
+			'mac': r'^([a-fA-F0-9]{2}[:|\-]?){6}$',
+			'model': r'^[\w\s\+\.\-]+$',
+			'cpu_load': r'^\d+\.\d+$',
+			'memory_usage': r'^\d+\.\d+$',
+			'status': r'^[\w]+$'
+		}
+	},
+	'configuration': {
+		'system': {
+			'hostname': r'^[\w]+$'
+		},
+		'network': {
+			'ip': r'^([0-9]+[\.]?){4}$',
+			'netmask': r'^([0-9]+[\.]?){4}$',
+			'gateway': r'^([0-9]+[\.]?){4}$',
+			'dns1': r'^([0-9]+[\.]?){4}$',
+			'dns2': r'^([0-9]+[\.]?){4}$',
+		}
+	},
+	'token': r'^[a-fA-F0-9]{64}$'
+}
+
+def legacy_data_is_valid(schema, data): #recursive validator as it was before, without db logging
+	for key in schema:
+		if key in data:
+			if isinstance(schema[key], dict):
+				if not isinstance(data[key], dict):
+					return False
+				elif not legacy_data_is_valid(schema[key], data[key]):
+					return False
+			else:
+				if not re.search(schema[key], str(data[key])):
+					return False
+		else:
+			return False
+	return True
+
+def sample_data():
+	return {
+		'statistics': {
+			'system': {
+				'mac': 'A4:2B:3C:4D:5E:6F',
+				'model': 'TL-WR841N v14',
+				'cpu_load': 12.5,
+				'memory_usage': 40.1,
+				'status': 'OK'
+			}
+		},
+		'configuration': {
+			'system': {
+				'hostname': 'router'
+			},
+			'network': {
+				'ip': '192.168.1.1',
+				'netmask': '255.255.255.0',
+				'gateway': '192.168.1.254',
+				'dns1': '8.8.8.8',
+				'dns2': '8.8.4.4'
+			}
+		},
+		'token': 'a' * 64
+	}
+
+class Command(BaseCommand):
+	help = 'Measures per-request cost of provisioning data validation, legacy recursive validator vs compiled one'
+
+	def add_arguments(self, parser):
+		parser.add_argument('--iterations', type=int, default=100000)
+
+	def handle(self, *args, **options):
+		iterations = options['iterations']
+		valid = sample_data()
+		invalid = sample_data()
+		invalid['configuration']['network']['dns2'] = 'not-an-ip'
+
+		#both validators must agree on the samples, otherwise timings are meaningless
+		assert legacy_data_is_valid(LEGACY_SCHEMA, valid) and data_is_valid(valid)
+		assert not legacy_data_is_valid(LEGACY_SCHEMA, invalid) and validate(invalid)
+		assert set(LEGACY_SCHEMA) == set(PROV_SCHEMA)
+
+		cases = [
+			('legacy valid', lambda: legacy_data_is_valid(LEGACY_SCHEMA, valid)),
+			('compiled valid', lambda: data_is_valid(valid)),
+			('legacy invalid', lambda: legacy_data_is_valid(LEGACY_SCHEMA, invalid)),
+			('compiled invalid', lambda: validate(invalid)),
+		]
+		for name, func in cases:
+			best = min(timeit.repeat(func, number=iterations, repeat=5))
+			self.stdout.write('{:<18} {:8.2f} us/request'.format(name, best / iterations * 1e6))
@@ -0,0 +1,22 @@
+import sys
+
+from django.core.management.base import BaseCommand
+
+from wrtapp.bulk import DEVICE_COLUMNS, export_rows
+from wrtapp.export import export_chunks
+
+class Command(BaseCommand):
+	help = 'Exports devices with configs as csv or json lines, file can be imported with importdevices'
+
+	def add_arguments(self, parser):
+		parser.add_argument('--format', choices=['csv', 'jsonl'], default='csv')
+		parser.add_argument('--output', help='file, default is stdout')
+
+	def handle(self, *args, **options):
+		fp = open(options['output'], 'w', newline='') if options['output'] else sys.stdout
+		try:
+			for chunk in export_chunks(export_rows(), DEVICE_COLUMNS, options['format']):
+				fp.write(chunk)
+		finally:
+			if fp is not sys.stdout:
+				fp.close()
@@ -0,0 +1,25 @@
+import csv
+
+from django.core.management.base import BaseCommand, CommandError
+
+from wrtapp.bulk import import_devices
+
+class Command(BaseCommand):
+	help = 'Imports devices with configs from csv (with header) or json lines file, same as /wrtapp/device/import'
+
+	def add_arguments(self, parser):
+		parser.add_argument('path')
+		parser.add_argument('--format', choices=['csv', 'jsonl'], help='default is taken from file extension')
+		parser.add_argument('--update', action='store_true', help='overwrites existing devices and configs')
+
+	def handle(self, *args, **options):
+		fmt = options['format'] or ('jsonl' if options['path'].endswith(('.jsonl', '.json')) else 'csv')
+		try:
+			with open(options['path'], 'rb') as fp:
+				result = import_devices(fp, fmt, options['update'])
+		except (OSError, ValueError, csv.Error) as exc:
+			raise CommandError('Import failed, nothing was imported: {}'.format(exc))
+		self.stdout.write('{} rows: {} devices created, {} updated, {} configs written, {} invalid rows skipped'.format(
+			result['rows'], result['created'], result['updated'], result['configs'], result['invalid']))
+		for error in result['errors']:
+			self.stdout.write('  line {}: {} ({})'.format(error['line'], error['error'], error['mac']))
@@ -0,0 +1,19 @@
+import datetime
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from wrtapp.partitions import partitioned_tables, ensure_partitions, drop_partitions
+
+class Command(BaseCommand):
+	help = 'Creates upcoming daily partitions and drops partitions older than retention period, run it daily (e.g. from cron)'
+
+	def handle(self, *args, **options):
+		now = timezone.now()
+		for table, retention in partitioned_tables():
+			created = ensure_partitions(table, settings.PARTITIONS_AHEAD)
+			dropped = drop_partitions(table, now - datetime.timedelta(days=retention))
+			self.stdout.write('{}: created {}, dropped {}'.format(table, len(created), len(dropped)))
+			for name in dropped:
+				self.stdout.write('  dropped {}'.format(name))
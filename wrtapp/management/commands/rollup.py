@@ -0,0 +1,12 @@
+from django.core.management.base import BaseCommand
+
+from wrtapp.rollup import RESOLUTIONS, run_rollup, purge_rollups
+
+class Command(BaseCommand):
+	help = 'Aggregates newly arrived stats history into rollup buckets, run it every minute (e.g. from cron)'
+
+	def handle(self, *args, **options):
+		for resolution in RESOLUTIONS:
+			written = run_rollup(resolution)
+			self.stdout.write('{}s: {} buckets written'.format(resolution, written))
+		self.stdout.write('{} expired buckets removed'.format(purge_rollups()))
@@ -0,0 +1,22 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import connection
+
+from wrtapp.models import Statistics
+
+class Command(BaseCommand):
+	help = 'Marks devices which did not report for OFFLINE_THRESHOLD seconds as OFFLINE, once or periodically with --loop'
+
+	def add_arguments(self, parser):
+		parser.add_argument('--loop', type=int, default=0, help='sweep every LOOP seconds until interrupted')
+
+	def handle(self, *args, **options):
+		while True:
+			marked = Statistics.objects.mark_offline(settings.OFFLINE_THRESHOLD)
+			self.stdout.write('{} devices marked offline'.format(marked))
+			if not options['loop']:
+				break
+			time.sleep(options['loop'])
+			connection.close_if_unusable_or_obsolete()
@@ -0,0 +1,219 @@
+import atexit
+import contextlib
+import glob
+import json
+import os
+import threading
+import time
+import uuid
+
+from django.conf import settings
+from django.db.models import Count
+
+from wrtapp.models import Statistics
+
+#in-process metrics registry rendered in prometheus text format (see /wrtapp/metrics).
+#Every worker process keeps its own values in memory and, if METRICS_DIR is set, dumps them to its own
+#file in that directory at most every METRICS_DUMP_INTERVAL seconds and at exit. Scrape handled by any
+#worker sums files of all processes, so totals do not depend on which worker answers. Files of exited
+#processes are removed at scrape, their counts drop out of totals as after a restart (prometheus handles
+#counter resets). Process ids are checked on this host, METRICS_DIR must not be shared between hosts
+
+LATENCY_BUCKETS = [0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5] # Seconds.
+QUERY_BUCKETS = [0, 1, 2, 3, 5, 8, 13, 21, 34]
+
+class Counter:
+	kind = 'counter'
+
+	def __init__(self, registry, name, help, labels=()):
+		self.registry = registry
+		self.name = name
+		self.help = help
+		self.labels = labels
+		self.values = {} # label values -> number
+		registry.register(self)
+
+	def inc(self, value=1, **labels):
+		key = tuple(str(labels[label]) for label in self.labels)
+		with self.registry.lock:
+			self.values[key] = self.values.get(key, 0) + value
+		self.registry.changed()
+
+	def merge(self, values, other):
+		for key, value in other.items():
+			values[key] = values.get(key, 0) + value
+
+	def render(self, values):
+		lines = []
+		for key, value in sorted(values.items()):
+			lines.append('{}{} {}'.format(self.name, label_str(self.labels, key), value))
+		return lines
+
+class Histogram:
+	kind = 'histogram'
+
+	def __init__(self, registry, name, help, labels=(), buckets=LATENCY_BUCKETS):
+		self.registry = registry
+		self.name = name
+		self.help = help
+		self.labels = labels
+		self.buckets = buckets
+		self.values = {} # label values -> [count per bucket..., count over last bucket, sum]
+		registry.register(self)
+
+	def observe(self, value, **labels):
+		key = tuple(str(labels[label]) for label in self.labels)
+		idx = len(self.buckets)
+		for pos, bound in enumerate(self.buckets):
+			if value <= bound:
+				idx = pos
+				break
+		with self.registry.lock:
+			data = self.values.get(key)
+			if data is None:
+				data = self.values[key] = [0] * (len(self.buckets) + 2)
+			data[idx] += 1
+			data[-1] += value
+		self.registry.changed()
+
+	@contextlib.contextmanager
+	def time(self, **labels): #observes duration of the block in seconds
+		started = time.perf_counter()
+		try:
+			yield
+		finally:
+			self.observe(time.perf_counter() - started, **labels)
+
+	def merge(self, values, other):
+		for key, data in other.items():
+			if key in values:
+				values[key] = [a + b for a, b in zip(values[key], data)]
+			else:
+				values[key] = list(data)
+
+	def render(self, values):
+		lines = []
+		for key, data in sorted(values.items()):
+			cumulative = 0
+			for bound, count in zip(self.buckets + ['+Inf'], data):
+				cumulative += count
+				lines.append('{}_bucket{} {}'.format(self.name, label_str(self.labels + ('le',), key + (str(bound),)), cumulative))
+			lines.append('{}_sum{} {}'.format(self.name, label_str(self.labels, key), data[-1]))
+			lines.append('{}_count{} {}'.format(self.name, label_str(self.labels, key), cumulative))
+		return lines
+
+def file_pid(path): #pid of the process which wrote metrics file
+	try:
+		return int(os.path.basename(path).split('-')[1])
+	except (IndexError, ValueError):
+		return None
+
+def process_alive(pid):
+	if pid is None:
+		return False
+	try:
+		os.kill(pid, 0) #signal 0 only checks the process exists
+	except ProcessLookupError:
+		return False
+	except PermissionError: #exists, owned by other user
+		pass
+	return True
+
+class Registry:
+	def __init__(self, directory, interval):
+		self.directory = directory
+		self.interval = interval
+		self.metrics = []
+		self.collectors = [] # functions returning lines of metrics computed at scrape time
+		self.lock = threading.Lock()
+		self.dumped = 0
+		self.path = None
+
+	def register(self, metric):
+		self.metrics.append(metric)
+
+	def collector(self, func):
+		self.collectors.append(func)
+		return func
+
+	def snapshot(self):
+		with self.lock:
+			return {metric.name: {json.dumps(key): value for key, value in metric.values.items()} for metric in self.metrics}
+
+	def changed(self):
+		if self.directory and time.monotonic() - self.dumped >= self.interval:
+			self.dump()
+
+	def dump(self): #file is replaced atomically, readers never see half written file
+		if not self.directory:
+			return
+		self.dumped = time.monotonic()
+		if self.path is None:
+			os.makedirs(self.directory, exist_ok=True)
+			#unique per registry, several registries of one process must not overwrite each other
+			self.path = os.path.join(self.directory, 'metrics-{}-{}.json'.format(os.getpid(), uuid.uuid4().hex))
+			atexit.register(self.dump)
+		try:
+			tmppath = '{}.{}.tmp'.format(self.path, threading.get_ident())
+			with open(tmppath, 'w') as fp:
+				json.dump(self.snapshot(), fp)
+			os.replace(tmppath, self.path)
+		except OSError:
+			pass
+
+	def collect(self): #returns metric name -> merged values of all processes
+		snapshots = [self.snapshot()]
+		if self.directory:
+			for path in glob.glob(os.path.join(self.directory, 'metrics-*.json')):
+				if path == self.path: #live values of this process are used instead
+					continue
+				if not process_alive(file_pid(path)):
+					with contextlib.suppress(OSError):
+						os.remove(path)
+					continue
+				try:
+					with open(path) as fp:
+						snapshots.append(json.load(fp))
+				except (OSError, ValueError):
+					continue
+		merged = {metric.name: {} for metric in self.metrics}
+		for metric in self.metrics:
+			for snapshot in snapshots:
+				values = {tuple(json.loads(key)): value for key, value in snapshot.get(metric.name, {}).items()}
+				metric.merge(merged[metric.name], values)
+		return merged
+
+	def render(self):
+		merged = self.collect()
+		lines = []
+		for metric in self.metrics:
+			lines.append('# HELP {} {}'.format(metric.name, metric.help))
+			lines.append('# TYPE {} {}'.format(metric.name, metric.kind))
+			lines.extend(metric.render(merged[metric.name]))
+		for func in self.collectors:
+			lines.extend(func())
+		return '\n'.join(lines) + '\n'
+
+def label_str(names, values):
+	if not names:
+		return ''
+	pairs = ['{}="{}"'.format(name, value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')) for name, value in zip(names, values)]
+	return '{' + ','.join(pairs) + '}'
+
+REGISTRY = Registry(settings.METRICS_DIR, settings.METRICS_DUMP_INTERVAL)
+
+CHECKINS = Counter(REGISTRY, 'wrtapp_checkins_total', 'Device check-ins by outcome.', ('outcome',))
+STAGE_SECONDS = Histogram(REGISTRY, 'wrtapp_checkin_stage_seconds', 'Time spent in check-in processing stages.', ('stage',))
+CHECKIN_QUERIES = Histogram(REGISTRY, 'wrtapp_checkin_queries', 'Database queries per check-in.', buckets=QUERY_BUCKETS)
+
+@REGISTRY.collector
+def device_gauges(): #read from db at scrape time, same for every process
+	counts = dict(Statistics.objects.with_current_status(settings.OFFLINE_THRESHOLD)
+		.values_list('current_status').annotate(count=Count('pk')).order_by())
+	offline = counts.pop('OFFLINE', 0)
+	return [
+		'# HELP wrtapp_devices Devices by reporting state, offline did not report for OFFLINE_THRESHOLD.',
+		'# TYPE wrtapp_devices gauge',
+		'wrtapp_devices{{state="active"}} {}'.format(sum(counts.values())),
+		'wrtapp_devices{{state="offline"}} {}'.format(offline),
+	]
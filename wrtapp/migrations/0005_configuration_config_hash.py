@@ -0,0 +1,30 @@
+# Generated by Django 3.2.9 on 2026-10-18 10:12
+
+import hashlib
+
+from django.db import migrations, models
+
+
+def compute_hashes(apps, schema_editor):
+    Configuration = apps.get_model('wrtapp', 'Configuration')
+    fields = ['hostname', 'ip', 'netmask', 'gateway', 'dns1', 'dns2']
+    for config in Configuration.objects.all().iterator():
+        data = '\n'.join([str(getattr(config, field)) for field in fields])
+        config.config_hash = hashlib.sha256(data.encode('utf8')).hexdigest()
+        config.save(update_fields=['config_hash'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('wrtapp', '0004_alter_statistics_date'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='configuration',
+            name='config_hash',
+            field=models.CharField(default='', editable=False, max_length=64),
+        ),
+        migrations.RunPython(compute_hashes, migrations.RunPython.noop),
+    ]
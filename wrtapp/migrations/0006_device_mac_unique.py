@@ -0,0 +1,55 @@
+# Generated by Django 3.2.9 on 2026-10-18 11:40
+
+import re
+
+from django.db import migrations, models
+
+
+def normalize_mac(mac):
+    return re.sub(r'[:|\-\.\s]', '', mac).upper()
+
+
+def dedupe_devices(apps, schema_editor):
+    # Keeps the oldest device for every normalized mac. Logs of duplicates are moved to it,
+    # config and stats are moved only if the kept device has none, the rest is deleted.
+    Device = apps.get_model('wrtapp', 'Device')
+    Configuration = apps.get_model('wrtapp', 'Configuration')
+    Statistics = apps.get_model('wrtapp', 'Statistics')
+    Log = apps.get_model('wrtapp', 'Log')
+
+    groups = {}
+    for device_id, mac in Device.objects.order_by('id').values_list('id', 'mac').iterator():
+        groups.setdefault(normalize_mac(mac), []).append((device_id, mac))
+
+    for mac, devices in groups.items():
+        keep, keepmac = devices[0]
+        duplicates = [device_id for device_id, _ in devices[1:]]
+        if duplicates:
+            Log.objects.filter(device_id__in=duplicates).update(device_id=keep)
+            for model in (Configuration, Statistics):
+                if not model.objects.filter(device_id=keep).exists():
+                    newest = model.objects.filter(device_id__in=duplicates).order_by('-device_id').first()
+                    if newest:
+                        model.objects.filter(device_id=newest.device_id).update(device_id=keep)
+            Device.objects.filter(id__in=duplicates).delete()
+        if keepmac != mac:
+            Device.objects.filter(id=keep).update(mac=mac)
+    # Moved logs and deleted duplicates leave deferred foreign key checks pending,
+    # postgres refuses to alter the device table until they are run.
+    schema_editor.execute('SET CONSTRAINTS ALL IMMEDIATE')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('wrtapp', '0005_configuration_config_hash'),
+    ]
+
+    operations = [
+        migrations.RunPython(dedupe_devices, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='device',
+            name='mac',
+            field=models.CharField(max_length=32, unique=True),
+        ),
+    ]
@@ -0,0 +1,63 @@
+# Generated by Django 3.2.9 on 2026-10-18 13:05
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+# Daily partitions for today and next week, later ones are created by 'manage.py partitions'
+CREATE_PARTITIONS = """
+DO $$
+DECLARE
+    day date;
+BEGIN
+    FOR day IN SELECT generate_series(current_date, current_date + 7, interval '1 day')::date LOOP
+        EXECUTE format('CREATE TABLE IF NOT EXISTS %I PARTITION OF %I FOR VALUES FROM (%L) TO (%L)',
+            '{table}_p' || to_char(day, 'YYYYMMDD'), '{table}',
+            day::timestamp AT TIME ZONE 'UTC', (day + 1)::timestamp AT TIME ZONE 'UTC');
+    END LOOP;
+END $$;
+"""
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('wrtapp', '0006_device_mac_unique'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='StatisticsSample',
+            fields=[
+                ('id', models.BigAutoField(primary_key=True, serialize=False)),
+                ('status', models.CharField(max_length=32)),
+                ('cpu_load', models.FloatField()),
+                ('memory_usage', models.FloatField()),
+                ('date', models.DateTimeField()),
+                ('device', models.ForeignKey(db_constraint=False, on_delete=django.db.models.deletion.DO_NOTHING, to='wrtapp.device')),
+            ],
+            options={
+                'db_table': 'wrtapp_statisticssample',
+                'managed': False,
+            },
+        ),
+        migrations.RunSQL(
+            sql=[
+                """
+                CREATE TABLE wrtapp_statisticssample (
+                    id bigserial NOT NULL,
+                    device_id bigint NOT NULL,
+                    status varchar(32) NOT NULL,
+                    cpu_load double precision NOT NULL,
+                    memory_usage double precision NOT NULL,
+                    date timestamp with time zone NOT NULL,
+                    PRIMARY KEY (id, date)
+                ) PARTITION BY RANGE (date);
+                """,
+                'CREATE INDEX wrtapp_statisticssample_device_date ON wrtapp_statisticssample (device_id, date);',
+                'CREATE TABLE wrtapp_statisticssample_default PARTITION OF wrtapp_statisticssample DEFAULT;',
+                CREATE_PARTITIONS.format(table='wrtapp_statisticssample'),
+            ],
+            reverse_sql='DROP TABLE wrtapp_statisticssample;',
+        ),
+    ]
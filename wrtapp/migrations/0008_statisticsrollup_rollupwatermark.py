@@ -0,0 +1,48 @@
+# Generated by Django 3.2.9 on 2026-10-18 14:20
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('wrtapp', '0007_statisticssample'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RollupWatermark',
+            fields=[
+                ('resolution', models.PositiveIntegerField(primary_key=True, serialize=False)),
+                ('position', models.DateTimeField()),
+            ],
+        ),
+        migrations.CreateModel(
+            name='StatisticsRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('resolution', models.PositiveIntegerField()),
+                ('bucket', models.DateTimeField()),
+                ('samples', models.PositiveIntegerField()),
+                ('offline', models.PositiveIntegerField()),
+                ('cpu_min', models.FloatField()),
+                ('cpu_avg', models.FloatField()),
+                ('cpu_max', models.FloatField()),
+                ('cpu_p95', models.FloatField()),
+                ('memory_min', models.FloatField()),
+                ('memory_avg', models.FloatField()),
+                ('memory_max', models.FloatField()),
+                ('memory_p95', models.FloatField()),
+                ('device', models.ForeignKey(db_constraint=False, on_delete=django.db.models.deletion.DO_NOTHING, to='wrtapp.device')),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='statisticsrollup',
+            index=models.Index(fields=['resolution', 'bucket'], name='wrtapp_rollup_res_bucket'),
+        ),
+        migrations.AddConstraint(
+            model_name='statisticsrollup',
+            constraint=models.UniqueConstraint(fields=('device', 'resolution', 'bucket'), name='wrtapp_rollup_device_resolution_bucket'),
+        ),
+    ]
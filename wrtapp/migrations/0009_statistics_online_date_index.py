@@ -0,0 +1,17 @@
+# Generated by Django 3.2.9 on 2026-10-18 15:02
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('wrtapp', '0008_statisticsrollup_rollupwatermark'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='statistics',
+            index=models.Index(condition=models.Q(('status', 'OFFLINE'), _negated=True), fields=['date'], name='wrtapp_stats_online_date'),
+        ),
+    ]
@@ -0,0 +1,21 @@
+# Generated by Django 3.2.9 on 2026-10-18 16:20
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('wrtapp', '0009_statistics_online_date_index'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='statistics',
+            index=models.Index(fields=['date', 'device'], name='wrtapp_stats_date_device'),
+        ),
+        migrations.AddIndex(
+            model_name='log',
+            index=models.Index(fields=['date', 'id'], name='wrtapp_log_date_id'),
+        ),
+    ]
@@ -0,0 +1,106 @@
+# Generated by Django 3.2.9 on 2026-10-18 17:05
+
+import django.contrib.postgres.indexes
+import django.contrib.postgres.search
+from django.db import migrations
+
+# Search vectors are computed by BEFORE triggers, so every writer (ORM, raw upserts
+# in provisioning, COPY) keeps them current. 'simple' config is used because most
+# searched values are identifiers (macs, hostnames, addresses), which must not be stemmed.
+# Log vector also holds device mac and username, log rows are never updated.
+TRIGGERS_SQL = """
+CREATE FUNCTION wrtapp_device_search() RETURNS trigger AS $$
+BEGIN
+	NEW.search :=
+		setweight(to_tsvector('simple', coalesce(NEW.mac, '')), 'A') ||
+		setweight(to_tsvector('simple', coalesce(NEW.name, '')), 'B') ||
+		setweight(to_tsvector('simple', coalesce(NEW.model, '')), 'C') ||
+		setweight(to_tsvector('simple', coalesce(NEW.description, '')), 'D');
+	RETURN NEW;
+END
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER wrtapp_device_search BEFORE INSERT OR UPDATE OF mac, model, name, description
+	ON wrtapp_device FOR EACH ROW EXECUTE PROCEDURE wrtapp_device_search();
+
+CREATE FUNCTION wrtapp_config_search() RETURNS trigger AS $$
+BEGIN
+	NEW.search :=
+		setweight(to_tsvector('simple', coalesce(NEW.hostname, '')), 'A') ||
+		setweight(to_tsvector('simple', coalesce(host(NEW.ip), '')), 'A') ||
+		setweight(to_tsvector('simple', concat_ws(' ', host(NEW.gateway), host(NEW.dns1), host(NEW.dns2), host(NEW.netmask))), 'C');
+	RETURN NEW;
+END
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER wrtapp_config_search BEFORE INSERT OR UPDATE OF hostname, ip, netmask, gateway, dns1, dns2
+	ON wrtapp_configuration FOR EACH ROW EXECUTE PROCEDURE wrtapp_config_search();
+
+CREATE FUNCTION wrtapp_log_search() RETURNS trigger AS $$
+BEGIN
+	NEW.search :=
+		setweight(to_tsvector('simple', coalesce(NEW.message, '')), 'A') ||
+		setweight(to_tsvector('simple', coalesce(NEW.severity, '')), 'B') ||
+		setweight(to_tsvector('simple', coalesce((SELECT mac FROM wrtapp_device WHERE id = NEW.device_id), '')), 'C') ||
+		setweight(to_tsvector('simple', coalesce((SELECT username FROM auth_user WHERE id = NEW.user_id), '')), 'C');
+	RETURN NEW;
+END
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER wrtapp_log_search BEFORE INSERT OR UPDATE OF message, severity, device_id, user_id
+	ON wrtapp_log FOR EACH ROW EXECUTE PROCEDURE wrtapp_log_search();
+"""
+
+BACKFILL_SQL = """
+UPDATE wrtapp_device SET mac = mac;
+UPDATE wrtapp_configuration SET hostname = hostname;
+UPDATE wrtapp_log SET message = message;
+"""
+
+DROP_TRIGGERS_SQL = """
+DROP TRIGGER wrtapp_device_search ON wrtapp_device;
+DROP TRIGGER wrtapp_config_search ON wrtapp_configuration;
+DROP TRIGGER wrtapp_log_search ON wrtapp_log;
+DROP FUNCTION wrtapp_device_search();
+DROP FUNCTION wrtapp_config_search();
+DROP FUNCTION wrtapp_log_search();
+"""
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('wrtapp', '0010_dashboard_page_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='device',
+            name='search',
+            field=django.contrib.postgres.search.SearchVectorField(editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='configuration',
+            name='search',
+            field=django.contrib.postgres.search.SearchVectorField(editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='log',
+            name='search',
+            field=django.contrib.postgres.search.SearchVectorField(editable=False, null=True),
+        ),
+        migrations.RunSQL(TRIGGERS_SQL, DROP_TRIGGERS_SQL),
+        migrations.RunSQL(BACKFILL_SQL, migrations.RunSQL.noop), # Before indexes, bulk index build is faster.
+        migrations.AddIndex(
+            model_name='device',
+            index=django.contrib.postgres.indexes.GinIndex(fields=['search'], name='wrtapp_device_search'),
+        ),
+        migrations.AddIndex(
+            model_name='configuration',
+            index=django.contrib.postgres.indexes.GinIndex(fields=['search'], name='wrtapp_config_search'),
+        ),
+        migrations.AddIndex(
+            model_name='log',
+            index=django.contrib.postgres.indexes.GinIndex(fields=['search'], name='wrtapp_log_search'),
+        ),
+    ]
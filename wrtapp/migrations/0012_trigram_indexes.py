@@ -0,0 +1,34 @@
+# Generated by Django 3.2.9 on 2026-10-18 18:10
+
+import django.contrib.postgres.indexes
+from django.contrib.postgres.operations import TrigramExtension
+from django.db import migrations
+
+# Addresses are inet columns, they are indexed by their text form, which is
+# what the 'ilike' lookup (see wrtapp/lookups.py) compares.
+ADDRESS_FIELDS = ['ip', 'gateway', 'dns1', 'dns2']
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('wrtapp', '0011_search_vectors'),
+    ]
+
+    operations = [
+        TrigramExtension(),
+        migrations.AddIndex(
+            model_name='device',
+            index=django.contrib.postgres.indexes.GinIndex(fields=['mac'], name='wrtapp_device_mac_trgm', opclasses=['gin_trgm_ops']),
+        ),
+        migrations.AddIndex(
+            model_name='configuration',
+            index=django.contrib.postgres.indexes.GinIndex(fields=['hostname'], name='wrtapp_config_hostname_trgm', opclasses=['gin_trgm_ops']),
+        ),
+    ] + [
+        migrations.RunSQL(
+            'CREATE INDEX wrtapp_config_{0}_trgm ON wrtapp_configuration USING gin (host({0}) gin_trgm_ops)'.format(field),
+            'DROP INDEX wrtapp_config_{0}_trgm'.format(field),
+        )
+        for field in ADDRESS_FIELDS
+    ]
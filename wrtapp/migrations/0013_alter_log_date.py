@@ -0,0 +1,19 @@
+# Generated by Django 3.2.9 on 2026-10-18 19:02
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('wrtapp', '0012_trigram_indexes'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='log',
+            name='date',
+            field=models.DateTimeField(default=django.utils.timezone.now),
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 3.2.9 on 2026-10-18 19:40
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('wrtapp', '0013_alter_log_date'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='log',
+            name='count',
+            field=models.PositiveIntegerField(default=1),
+        ),
+        migrations.AddField(
+            model_name='log',
+            name='last_seen',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+    ]
@@ -0,0 +1,113 @@
+# Generated by Django 3.2.9 on 2026-10-18 20:15
+
+from django.db import migrations, models
+
+
+# Log table becomes partitioned by date with daily partitions. Existing table is kept as
+# one partition covering everything up to tomorrow, so no rows are copied, and it is
+# dropped by 'manage.py partitions' when all its rows are older than LOG_RETENTION.
+# Attaching it builds the (id, date) primary key index on it, which takes a while on
+# big tables. Id sequence is moved to the new table, otherwise it would be dropped
+# together with the old partition. Requires postgres 13 (row triggers on partitioned tables).
+PARTITION_SQL = [
+    'ALTER TABLE wrtapp_log RENAME TO wrtapp_log_legacy;',
+    'ALTER TABLE wrtapp_log_legacy DROP CONSTRAINT wrtapp_log_pkey;',
+    'ALTER INDEX wrtapp_log_date_id RENAME TO wrtapp_log_legacy_date_id;',
+    'ALTER INDEX wrtapp_log_search RENAME TO wrtapp_log_legacy_search;',
+    'ALTER INDEX wrtapp_log_device_id_d33b2496 RENAME TO wrtapp_log_legacy_device_id;',
+    'ALTER INDEX wrtapp_log_user_id_77ad38b7 RENAME TO wrtapp_log_legacy_user_id;',
+    'DROP TRIGGER wrtapp_log_search ON wrtapp_log_legacy;',
+    """
+    CREATE TABLE wrtapp_log (LIKE wrtapp_log_legacy INCLUDING DEFAULTS INCLUDING CONSTRAINTS)
+        PARTITION BY RANGE (date);
+    """,
+    'ALTER TABLE wrtapp_log ADD PRIMARY KEY (id, date);',
+    'ALTER SEQUENCE wrtapp_log_id_seq OWNED BY wrtapp_log.id;',
+    """
+    ALTER TABLE wrtapp_log ADD CONSTRAINT wrtapp_log_device_id_fk
+        FOREIGN KEY (device_id) REFERENCES wrtapp_device (id) DEFERRABLE INITIALLY DEFERRED;
+    """,
+    """
+    ALTER TABLE wrtapp_log ADD CONSTRAINT wrtapp_log_user_id_fk
+        FOREIGN KEY (user_id) REFERENCES auth_user (id) DEFERRABLE INITIALLY DEFERRED;
+    """,
+    # Matching indexes of the old table are attached, missing ones are built.
+    'CREATE INDEX wrtapp_log_date_id ON wrtapp_log (date, id);',
+    'CREATE INDEX wrtapp_log_device_date ON wrtapp_log (device_id, date);',
+    'CREATE INDEX wrtapp_log_user_id ON wrtapp_log (user_id);',
+    'CREATE INDEX wrtapp_log_search ON wrtapp_log USING gin (search);',
+    """
+    DO $$
+    BEGIN
+        EXECUTE format('ALTER TABLE wrtapp_log ATTACH PARTITION wrtapp_log_legacy FOR VALUES FROM (MINVALUE) TO (%L)',
+            (current_date + 1)::timestamp AT TIME ZONE 'UTC');
+    END $$;
+    """,
+    """
+    CREATE TRIGGER wrtapp_log_search BEFORE INSERT OR UPDATE OF message, severity, device_id, user_id
+        ON wrtapp_log FOR EACH ROW EXECUTE PROCEDURE wrtapp_log_search();
+    """,
+    'CREATE TABLE wrtapp_log_default PARTITION OF wrtapp_log DEFAULT;',
+    # Daily partitions for next week, later ones are created by 'manage.py partitions'.
+    """
+    DO $$
+    DECLARE
+        day date;
+    BEGIN
+        FOR day IN SELECT generate_series(current_date + 1, current_date + 7, interval '1 day')::date LOOP
+            EXECUTE format('CREATE TABLE IF NOT EXISTS %I PARTITION OF wrtapp_log FOR VALUES FROM (%L) TO (%L)',
+                'wrtapp_log_p' || to_char(day, 'YYYYMMDD'),
+                day::timestamp AT TIME ZONE 'UTC', (day + 1)::timestamp AT TIME ZONE 'UTC');
+        END LOOP;
+    END $$;
+    """,
+]
+
+# Rows of all partitions are copied back into a plain table with the names of 0014 (django's
+# hashed index and foreign key names included, so migrating forward again renames them), the
+# old partition is not reused, it may already be dropped by 'manage.py partitions'.
+REVERSE_SQL = [
+    'CREATE TABLE wrtapp_log_unpartitioned (LIKE wrtapp_log INCLUDING DEFAULTS INCLUDING CONSTRAINTS);',
+    'INSERT INTO wrtapp_log_unpartitioned SELECT * FROM wrtapp_log;',
+    'ALTER SEQUENCE wrtapp_log_id_seq OWNED BY wrtapp_log_unpartitioned.id;',
+    'DROP TABLE wrtapp_log;',
+    'ALTER TABLE wrtapp_log_unpartitioned RENAME TO wrtapp_log;',
+    'ALTER TABLE wrtapp_log ADD CONSTRAINT wrtapp_log_pkey PRIMARY KEY (id);',
+    """
+    ALTER TABLE wrtapp_log ADD CONSTRAINT wrtapp_log_device_id_d33b2496_fk_wrtapp_device_id
+        FOREIGN KEY (device_id) REFERENCES wrtapp_device (id) DEFERRABLE INITIALLY DEFERRED;
+    """,
+    """
+    ALTER TABLE wrtapp_log ADD CONSTRAINT wrtapp_log_user_id_77ad38b7_fk_auth_user_id
+        FOREIGN KEY (user_id) REFERENCES auth_user (id) DEFERRABLE INITIALLY DEFERRED;
+    """,
+    'CREATE INDEX wrtapp_log_device_id_d33b2496 ON wrtapp_log (device_id);',
+    'CREATE INDEX wrtapp_log_user_id_77ad38b7 ON wrtapp_log (user_id);',
+    'CREATE INDEX wrtapp_log_date_id ON wrtapp_log (date, id);',
+    'CREATE INDEX wrtapp_log_search ON wrtapp_log USING gin (search);',
+    """
+    CREATE TRIGGER wrtapp_log_search BEFORE INSERT OR UPDATE OF message, severity, device_id, user_id
+        ON wrtapp_log FOR EACH ROW EXECUTE PROCEDURE wrtapp_log_search();
+    """,
+]
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('wrtapp', '0014_log_count_last_seen'),
+    ]
+
+    operations = [
+        migrations.SeparateDatabaseAndState(
+            database_operations=[
+                migrations.RunSQL(PARTITION_SQL, REVERSE_SQL),
+            ],
+            state_operations=[
+                migrations.AddIndex(
+                    model_name='log',
+                    index=models.Index(fields=['device', 'date'], name='wrtapp_log_device_date'),
+                ),
+            ],
+        ),
+    ]
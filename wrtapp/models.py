@@ -1,17 +1,67 @@
+import datetime
+import hashlib
+import re
+
 from django.db import models #this django module implements sql queries required to manage db . Django apps should use this db api instead of manual sql queries
+from django.db import connection, transaction
+from django.conf import settings
+from django.utils import timezone
 from django.contrib.auth.models import User
+from django.contrib.postgres.indexes import GinIndex
+from django.contrib.postgres.search import SearchVectorField
 
 #every class bellow represents data model directly migrated to postgresql db
 #and objects of these classes represent an entry in corresponding db table 
 #and attribute of the obj represents a field in db 
 #
 
+MAC_SEPARATORS_RE = re.compile(r'[:|\-\.\s]')
+
+def normalize_mac(mac): #canonical compact form of mac used for storage and lookups, e.g. A42B3C4D5E6F
+	return MAC_SEPARATORS_RE.sub('', mac).upper()
+
+class DeviceManager(models.Manager):
+	#inserts device unless device with the same mac already exists, so concurrent first check-ins
+	#of one device can not create duplicates. Returns False if device was not inserted
+	def insert_ignore(self, device):
+		device.mac = normalize_mac(device.mac)
+		device.date_added = timezone.now()
+		sqlquery = ('INSERT INTO {} (mac, model, name, description, date_added) '
+			'VALUES (%s, %s, %s, %s, %s) '
+			'ON CONFLICT (mac) DO NOTHING '
+			'RETURNING id').format(self.model._meta.db_table)
+		with connection.cursor() as cursor:
+			cursor.execute(sqlquery, [device.mac, device.model, device.name, device.description, device.date_added])
+			row = cursor.fetchone()
+		if row is None:
+			return False
+		device.id = row[0]
+		device._state.adding = False
+		device._state.db = self.db
+		return True
+
 class Device(models.Model):
-	mac = models.CharField(max_length=32)
+	mac = models.CharField(max_length=32, unique=True) #unique index, provisioning looks devices up by mac
 	model = models.CharField(max_length=64)
 	name = models.CharField(max_length=64)
 	description = models.CharField(max_length=128)
 	date_added = models.DateTimeField(auto_now_add=True)
+	search = SearchVectorField(null=True, editable=False) #maintained by db trigger, see 0011 migration
+
+	objects = DeviceManager()
+
+	class Meta:
+		indexes = [
+			GinIndex(fields=['search'], name='wrtapp_device_search'),
+			GinIndex(fields=['mac'], opclasses=['gin_trgm_ops'], name='wrtapp_device_mac_trgm'), #mac__ilike
+		]
+
+	def save(self, *args, **kwargs):
+		self.mac = normalize_mac(self.mac)
+		super().save(*args, **kwargs)
+
+#configuration fields which are delivered to agent
+CONFIG_FIELDS = ['hostname', 'ip', 'netmask', 'gateway', 'dns1', 'dns2']
 
 class Configuration(models.Model):
 	device = models.OneToOneField(
@@ -25,6 +75,81 @@ class Configuration(models.Model):
 	gateway = models.GenericIPAddressField(protocol='IPv4')
 	dns1 = models.GenericIPAddressField(protocol='IPv4')
 	dns2 = models.GenericIPAddressField(protocol='IPv4')
+	config_hash = models.CharField(max_length=64, editable=False, default='') #agents echo it back, so unchanged config is not diffed
+	search = SearchVectorField(null=True, editable=False) #maintained by db trigger, see 0011 migration
+
+	class Meta:
+		indexes = [
+			GinIndex(fields=['search'], name='wrtapp_config_search'),
+			GinIndex(fields=['hostname'], opclasses=['gin_trgm_ops'], name='wrtapp_config_hostname_trgm'),
+			#addresses have host(...) expression trigram indexes, see 0012 migration
+		]
+
+	def compute_hash(self): #must stay in sync with the hash function in 0005 migration
+		data = '\n'.join([str(getattr(self, field)) for field in CONFIG_FIELDS])
+		return hashlib.sha256(data.encode('utf8')).hexdigest()
+
+	def save(self, *args, **kwargs): #every config change (e.g. ConfigurationForm save) gets a new hash
+		self.config_hash = self.compute_hash()
+		update_fields = kwargs.get('update_fields')
+		if update_fields is not None:
+			kwargs['update_fields'] = set(update_fields) | {'config_hash'}
+		super().save(*args, **kwargs)
+
+class StatisticsManager(models.Manager):
+	#writes stats rows with a single INSERT ... ON CONFLICT statement instead of get + save per row,
+	#the same statement also appends rows to stats history (STATS_HISTORY_ENABLED)
+	#rows is a list of (device_id, status, cpu_load, memory_usage, date) tuples with unique device ids.
+	#Rows of devices deleted in the meantime (e.g. while buffered, see statsbuffer.py) are skipped, device
+	#rows are locked with KEY SHARE, so concurrent delete waits or is seen. Returns number of written rows
+	def upsert(self, rows):
+		if not rows:
+			return 0
+		table = self.model._meta.db_table
+		values = ', '.join(['(%s::bigint, %s::varchar, %s::double precision, %s::double precision, %s::timestamptz)'] * len(rows))
+		params = [value for row in rows for value in row]
+		history = ''
+		if settings.STATS_HISTORY_ENABLED:
+			history = ', history AS (INSERT INTO {} (device_id, status, cpu_load, memory_usage, date) SELECT * FROM incoming)'.format(StatisticsSample._meta.db_table)
+		sqlquery = ('WITH incoming AS (SELECT reported.* FROM (VALUES {}) AS reported (device_id, status, cpu_load, memory_usage, date) '
+			'JOIN {} AS device ON device.id = reported.device_id FOR KEY SHARE OF device){} '
+			'INSERT INTO {} (device_id, status, cpu_load, memory_usage, date) '
+			'SELECT * FROM incoming '
+			'ON CONFLICT (device_id) DO UPDATE SET '
+			'status = EXCLUDED.status, '
+			'cpu_load = EXCLUDED.cpu_load, '
+			'memory_usage = EXCLUDED.memory_usage, '
+			'date = EXCLUDED.date').format(values, Device._meta.db_table, history, table)
+		with connection.cursor() as cursor:
+			cursor.execute(sqlquery, params)
+			return cursor.rowcount
+
+	#marks devices which did not report for threshold seconds as OFFLINE with one set-based UPDATE,
+	#OFFLINE sample is appended to history too. Returns number of devices marked offline
+	def mark_offline(self, threshold):
+		now = timezone.now()
+		history = ''
+		params = [now - datetime.timedelta(seconds=threshold)]
+		if settings.STATS_HISTORY_ENABLED:
+			history = (', history AS (INSERT INTO {} (device_id, status, cpu_load, memory_usage, date) '
+				'SELECT device_id, status, cpu_load, memory_usage, %s FROM stale)').format(StatisticsSample._meta.db_table)
+			params.append(now)
+		sqlquery = ('WITH stale AS (UPDATE {} SET status = \'OFFLINE\' '
+			'WHERE date < %s AND status <> \'OFFLINE\' '
+			'RETURNING device_id, status, cpu_load, memory_usage){} '
+			'SELECT count(*) FROM stale').format(self.model._meta.db_table, history)
+		with connection.cursor() as cursor:
+			cursor.execute(sqlquery, params)
+			return cursor.fetchone()[0]
+
+	#status shown on dashboard is computed from date at query time, so reading stats never writes
+	def with_current_status(self, threshold):
+		stale = timezone.now() - datetime.timedelta(seconds=threshold)
+		return self.get_queryset().annotate(current_status=models.Case(
+			models.When(date__lt=stale, then=models.Value('OFFLINE')),
+			default=models.F('status'),
+			output_field=models.CharField(),
+		))
 
 class Statistics(models.Model):
 	device = models.OneToOneField(
@@ -37,6 +162,93 @@ class Statistics(models.Model):
 	memory_usage = models.FloatField()
 	date = models.DateTimeField(auto_now=True)
 
+	objects = StatisticsManager()
+
+	class Meta:
+		indexes = [ #lets offline sweeper find stale devices without scanning whole table
+			models.Index(fields=['date'], name='wrtapp_stats_online_date', condition=~models.Q(status='OFFLINE')),
+			models.Index(fields=['date', 'device'], name='wrtapp_stats_date_device'), #dashboard page order
+		]
+
+#append-only stats history, one row per heartbeat. Statistics above stays as the latest sample fast path.
+#Table is partitioned by date (daily partitions, see 0007 migration and partitions.py), so old history is
+#dropped with partitions instead of DELETE. There is no db foreign key to device, history of deleted
+#device stays until its partitions are dropped
+class StatisticsSample(models.Model):
+	id = models.BigAutoField(primary_key=True) #real primary key is (id, date), as required by partitioning
+	device = models.ForeignKey(
+		Device,
+		on_delete=models.DO_NOTHING,
+		db_constraint=False,
+	)
+	status = models.CharField(max_length=32)
+	cpu_load = models.FloatField()
+	memory_usage = models.FloatField()
+	date = models.DateTimeField()
+
+	class Meta:
+		managed = False #table is created by raw sql in migration
+		db_table = 'wrtapp_statisticssample'
+
+#per device aggregates of stats history in 1 minute, 1 hour and 1 day buckets, filled by rollup.py
+class StatisticsRollup(models.Model):
+	device = models.ForeignKey(
+		Device,
+		on_delete=models.DO_NOTHING,
+		db_constraint=False,
+	)
+	resolution = models.PositiveIntegerField() # Seconds.
+	bucket = models.DateTimeField() #start of bucket
+	samples = models.PositiveIntegerField()
+	offline = models.PositiveIntegerField() #number of OFFLINE samples
+	cpu_min = models.FloatField()
+	cpu_avg = models.FloatField()
+	cpu_max = models.FloatField()
+	cpu_p95 = models.FloatField()
+	memory_min = models.FloatField()
+	memory_avg = models.FloatField()
+	memory_max = models.FloatField()
+	memory_p95 = models.FloatField()
+
+	class Meta:
+		constraints = [
+			models.UniqueConstraint(fields=['device', 'resolution', 'bucket'], name='wrtapp_rollup_device_resolution_bucket'),
+		]
+		indexes = [
+			models.Index(fields=['resolution', 'bucket'], name='wrtapp_rollup_res_bucket'),
+		]
+
+#end of the last aggregated period for every rollup resolution
+class RollupWatermark(models.Model):
+	resolution = models.PositiveIntegerField(primary_key=True) # Seconds.
+	position = models.DateTimeField()
+
+class LogManager(models.Manager):
+	#writes repeat counters of deduplicated rows (see logthrottle.py) with one UPDATE,
+	#rows are matched by (id, date), so only their partitions are searched
+	def update_repeats(self, logs):
+		logs = [log for log in logs if log.id is not None]
+		if not logs:
+			return
+		values = ', '.join(['(%s::bigint, %s::timestamptz, %s::integer, %s::timestamptz)'] * len(logs))
+		params = [value for log in logs for value in (log.id, log.date, log.count, log.last_seen)]
+		sqlquery = ('UPDATE {0} SET count = repeats.count, last_seen = repeats.last_seen '
+			'FROM (VALUES {1}) AS repeats (id, date, count, last_seen) '
+			'WHERE {0}.id = repeats.id AND {0}.date = repeats.date').format(self.model._meta.db_table, values)
+		with connection.cursor() as cursor:
+			cursor.execute(sqlquery, params)
+
+	def truncate(self): #removes all rows of all partitions without scanning them
+		with transaction.atomic(), connection.cursor() as cursor:
+			#foreign keys are deferred (as all of django), TRUNCATE fails while checks of rows
+			#written earlier in the same transaction are pending, so they are run first
+			cursor.execute('SET CONSTRAINTS ALL IMMEDIATE')
+			cursor.execute('TRUNCATE {}'.format(self.model._meta.db_table))
+			cursor.execute('SET CONSTRAINTS ALL DEFERRED')
+
+#Log table is partitioned by date with one partition per day (see 0015 migration and partitions.py),
+#old rows are removed by dropping partitions older than LOG_RETENTION. Primary key is (id, date)
+#in db, lookups which know the date should filter by it too, so only one partition is searched
 class Log(models.Model):
 	device = models.ForeignKey(
 		Device,
@@ -50,4 +262,16 @@ class Log(models.Model):
 	)
 	severity = models.CharField(max_length=32)
 	message = models.CharField(max_length=128)
-	date = models.DateTimeField(auto_now_add=True)
+	date = models.DateTimeField(default=timezone.now) #time of the event, not of the write (rows can be queued, see logsink.py)
+	count = models.PositiveIntegerField(default=1) #repeats of the same message merged into this row
+	last_seen = models.DateTimeField(null=True, blank=True)
+	search = SearchVectorField(null=True, editable=False) #maintained by db trigger, includes device mac and username
+
+	objects = LogManager()
+
+	class Meta:
+		indexes = [
+			models.Index(fields=['date', 'id'], name='wrtapp_log_date_id'), #dashboard page order
+			models.Index(fields=['device', 'date'], name='wrtapp_log_device_date'), #logs of one device
+			GinIndex(fields=['search'], name='wrtapp_log_search'),
+		]
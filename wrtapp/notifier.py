@@ -0,0 +1,90 @@
+import asyncio
+import select
+import threading
+import time
+
+from django.conf import settings
+from django.db import connection, transaction
+
+from wrtapp.logger import Logger
+
+LOGGER = Logger(__name__)
+CHANNEL = 'wrtapp_config' # Postgres notification channel, payload is device id
+
+#wakes long-poll requests (see AsyncProvisionOperations.wait) when configuration of their device changes.
+#With 'local' backend only requests of the process which saved the config are woken, with 'postgres'
+#backend change is published with NOTIFY and every process receives it through its own LISTEN thread
+class ConfigNotifier:
+	def __init__(self, backend):
+		self.backend = backend
+		self.waiters = {} # device id -> set of (loop, future)
+		self.lock = threading.Lock()
+		self.listener = None
+
+	def subscribe(self, device_id): #must be called before current config is checked, so no change is missed in between
+		if self.backend == 'postgres' and self.listener is None:
+			self.start_listener()
+		loop = asyncio.get_running_loop()
+		waiter = (loop, loop.create_future())
+		with self.lock:
+			self.waiters.setdefault(device_id, set()).add(waiter)
+		return waiter
+
+	def unsubscribe(self, device_id, waiter):
+		with self.lock:
+			waiters = self.waiters.get(device_id)
+			if waiters:
+				waiters.discard(waiter)
+				if not waiters:
+					del self.waiters[device_id]
+
+	async def wait(self, waiter, timeout): #returns True if config changed before timeout
+		try:
+			await asyncio.wait_for(waiter[1], timeout)
+			return True
+		except asyncio.TimeoutError:
+			return False
+
+	def notify(self, device_id): #thread safe, wakes all waiters of device in this process
+		with self.lock:
+			waiters = list(self.waiters.get(device_id, ()))
+		for loop, future in waiters:
+			loop.call_soon_threadsafe(wake, future)
+
+	def publish(self, device_id): #called from model signal, waiters are woken after transaction is committed
+		if self.backend == 'postgres':
+			with connection.cursor() as cursor: #postgres delivers notification on commit
+				cursor.execute('SELECT pg_notify(%s, %s)', [CHANNEL, str(device_id)])
+		else:
+			transaction.on_commit(lambda: self.notify(device_id))
+
+	def start_listener(self):
+		with self.lock:
+			if self.listener is not None:
+				return
+			self.listener = threading.Thread(target=self.listen, name='config-listener', daemon=True)
+		self.listener.start()
+
+	def listen(self): #runs in own thread with own db connection
+		while True:
+			try:
+				connection.ensure_connection()
+				conn = connection.connection
+				with connection.cursor() as cursor:
+					cursor.execute('LISTEN {}'.format(CHANNEL))
+				while True:
+					if select.select([conn], [], [], 5) == ([], [], []):
+						continue
+					conn.poll()
+					while conn.notifies:
+						self.notify(int(conn.notifies.pop(0).payload))
+			except:
+				LOGGER.error('Config change listener failed, reconnecting')
+				connection.close()
+				time.sleep(5)
+
+def wake(future):
+	if not future.done():
+		future.set_result(True)
+
+NOTIFIER = ConfigNotifier(settings.CONFIG_NOTIFY_BACKEND)
@@ -0,0 +1,113 @@
+from urllib.parse import urlencode
+
+from django.conf import settings
+from django.db.models import Q
+
+#keyset (cursor) pagination for dashboard tables. Instead of OFFSET, which makes postgres read and throw away
+#all previous rows, page boundary is remembered as values of ordering columns of its last (or first) row and
+#next page starts with index range scan right after it, so every page costs the same no matter how deep it is.
+#Ordering must be unique (end with pk) and should be backed by an index on the same columns
+
+SEPARATOR = '~'
+
+class Page:
+	def __init__(self, items, params, next_cursor, prev_cursor):
+		self.items = items
+		self.params = params # other query parameters (e.g. search string) kept in page links
+		self.next_cursor = next_cursor
+		self.prev_cursor = prev_cursor
+
+	def __iter__(self):
+		return iter(self.items)
+
+	def __len__(self):
+		return len(self.items)
+
+	@property
+	def next_query(self):
+		if self.next_cursor is None:
+			return None
+		return urlencode(dict(self.params, after=self.next_cursor))
+
+	@property
+	def prev_query(self):
+		if self.prev_cursor is None:
+			return None
+		return urlencode(dict(self.params, before=self.prev_cursor))
+
+def page_size(request):
+	try:
+		size = int(request.GET.get('size', settings.PAGE_SIZE))
+	except ValueError:
+		size = settings.PAGE_SIZE
+	return max(1, min(size, settings.PAGE_SIZE_MAX))
+
+def key_fields(queryset, ordering): #returns list of (attname, descending, field), keys may be annotations (e.g. rank)
+	keys = []
+	for key in ordering:
+		name = key.lstrip('-')
+		if name in queryset.query.annotations:
+			keys.append((name, key.startswith('-'), queryset.query.annotations[name].output_field))
+			continue
+		field = queryset.model._meta.pk if name == 'pk' else queryset.model._meta.get_field(name)
+		keys.append((field.attname, key.startswith('-'), field))
+	return keys
+
+def encode_cursor(obj, keys):
+	values = []
+	for attname, _, _ in keys:
+		value = getattr(obj, attname)
+		values.append(value.isoformat() if hasattr(value, 'isoformat') else str(value))
+	return SEPARATOR.join(values)
+
+def decode_cursor(cursor, keys): #returns list of key values or None for missing/malformed cursor
+	if not cursor:
+		return None
+	parts = cursor.split(SEPARATOR)
+	if len(parts) != len(keys):
+		return None
+	try:
+		values = [field.to_python(part) for part, (_, _, field) in zip(parts, keys)]
+	except:
+		return None
+	if None in values:
+		return None
+	return values
+
+def seek(keys, values, forward): #rows strictly after cursor in (forward) ordering
+	condition = Q()
+	equal = {}
+	for (attname, descending, _), value in zip(keys, values):
+		lookup = 'lt' if descending == forward else 'gt'
+		condition |= Q(**equal, **{attname + '__' + lookup: value})
+		equal[attname] = value
+	#redundant bound on the first column lets postgres use index range scan for the OR above
+	attname, descending, _ = keys[0]
+	bound = Q(**{attname + ('__lte' if descending == forward else '__gte'): values[0]})
+	return bound & condition
+
+def paginate(request, queryset, ordering, params=None):
+	keys = key_fields(queryset, ordering)
+	size = page_size(request)
+	after = decode_cursor(request.GET.get('after'), keys)
+	before = decode_cursor(request.GET.get('before'), keys) if after is None else None
+	params = dict(params or {})
+	if 'size' in request.GET:
+		params['size'] = size
+
+	if before is not None: #previous page is read in reverse ordering and flipped back
+		reverse = [key[1:] if key.startswith('-') else '-' + key for key in ordering]
+		items = list(queryset.filter(seek(keys, before, False)).order_by(*reverse)[:size + 1])
+		more = len(items) > size
+		items = items[:size][::-1]
+		prev_cursor = encode_cursor(items[0], keys) if more else None
+		next_cursor = encode_cursor(items[-1], keys) if items else None
+	else:
+		if after is not None:
+			queryset = queryset.filter(seek(keys, after, True))
+		items = list(queryset.order_by(*ordering)[:size + 1])
+		more = len(items) > size
+		items = items[:size]
+		next_cursor = encode_cursor(items[-1], keys) if more else None
+		prev_cursor = encode_cursor(items[0], keys) if after is not None and items else None
+	return Page(items, params, next_cursor, prev_cursor)
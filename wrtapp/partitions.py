@@ -0,0 +1,77 @@
+import datetime
+import re
+
+from django.conf import settings
+from django.db import connection
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from wrtapp.models import StatisticsSample
+from wrtapp.models import Log
+from wrtapp.logger import Logger
+
+LOGGER = Logger(__name__)
+
+#helpers for tables which use postgres declarative partitioning by date with one partition per day.
+#Partitions are created ahead of time and old ones are dropped, which is a metadata operation
+#instead of DELETE of millions of rows. Tables also have DEFAULT partition, which only catches
+#rows if partitions were not created in time
+
+UPPER_BOUND_RE = re.compile(r"TO \('([^']+)'\)")
+
+def partition_name(table, day):
+	return '{}_p{}'.format(table, day.strftime('%Y%m%d'))
+
+def ensure_partitions(table, days_ahead): #creates daily partitions from today up to days_ahead, returns names of created ones
+	created = []
+	today = timezone.now().date()
+	existing = set(name for name, _ in list_partitions(table))
+	for offset in range(days_ahead + 1):
+		day = today + datetime.timedelta(days=offset)
+		name = partition_name(table, day)
+		if name in existing:
+			continue
+		lower = datetime.datetime.combine(day, datetime.time.min, tzinfo=datetime.timezone.utc)
+		upper = lower + datetime.timedelta(days=1)
+		sqlquery = 'CREATE TABLE {} PARTITION OF {} FOR VALUES FROM (%s) TO (%s)'.format(
+			connection.ops.quote_name(name), connection.ops.quote_name(table))
+		try:
+			with connection.cursor() as cursor:
+				cursor.execute(sqlquery, [lower, upper])
+			created.append(name)
+		except:
+			LOGGER.error('Failed to create partition {}'.format(name))
+	return created
+
+def drop_partitions(table, before): #drops partitions which hold only rows older than before, returns names of dropped ones
+	dropped = []
+	for name, upper in list_partitions(table):
+		if upper is None or upper > before:
+			continue
+		with connection.cursor() as cursor:
+			cursor.execute('DROP TABLE {}'.format(connection.ops.quote_name(name)))
+		dropped.append(name)
+	return dropped
+
+def list_partitions(table): #returns list of (partition name, upper bound or None for DEFAULT/MAXVALUE)
+	sqlquery = ('SELECT child.relname, pg_get_expr(child.relpartbound, child.oid) '
+		'FROM pg_inherits '
+		'INNER JOIN pg_class parent ON parent.oid = pg_inherits.inhparent '
+		'INNER JOIN pg_class child ON child.oid = pg_inherits.inhrelid '
+		'WHERE parent.relname = %s '
+		'ORDER BY child.relname')
+	with connection.cursor() as cursor:
+		cursor.execute(sqlquery, [table])
+		rows = cursor.fetchall()
+
+	partitions = []
+	for name, bound in rows:
+		match = UPPER_BOUND_RE.search(bound)
+		partitions.append((name, parse_datetime(match.group(1)) if match else None))
+	return partitions
+
+def partitioned_tables(): #returns list of (table, retention in days) maintained by 'manage.py partitions'
+	return [
+		(StatisticsSample._meta.db_table, settings.STATS_HISTORY_RETENTION),
+		(Log._meta.db_table, settings.LOG_RETENTION),
+	]
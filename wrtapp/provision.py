@@ -1,105 +1,182 @@
 import json
 import hashlib
+import hmac
+import math
+import os
 import re
 
 from django.http import HttpResponse
 from django.http import HttpResponseBadRequest
 from django.http import HttpResponseServerError
 from django.http import HttpResponseForbidden
+from django.http import HttpResponseNotFound
+
+from django.db import transaction
+from django.utils import timezone
 
 from wrtapp.models import Device
 from wrtapp.models import Configuration
 from wrtapp.models import Statistics
+from wrtapp.models import normalize_mac
 
 from wrtapp.logger import Logger
+from wrtapp.statsbuffer import BUFFER
+from wrtapp.configcache import CONFIG_CACHE
+from wrtapp.notifier import NOTIFIER
+from wrtapp.metrics import CHECKINS, STAGE_SECONDS, CHECKIN_QUERIES
+from wrtapp.sqlprofile import profiled
 
 from django.conf import settings
 
+from asgiref.sync import sync_to_async
+
+NUMBER_RE = re.compile(r'[0-9]+(\.[0-9]+)?')
+IPV4_RE = re.compile(r'\.'.join([r'(25[0-5]|2[0-4][0-9]|1[0-9][0-9]|[1-9]?[0-9])'] * 4))
+
+def is_number(value): #cpu and memory loads are json numbers, numeric strings from older agents are accepted too
+	if isinstance(value, str):
+		if NUMBER_RE.fullmatch(value) is None:
+			return False
+	elif isinstance(value, bool) or not isinstance(value, (int, float)):
+		return False
+	try: #value must fit db double precision column, huge json integers do not even convert to float
+		value = float(value)
+	except OverflowError:
+		return False
+	return math.isfinite(value) and value >= 0
+
+def is_ipv4(value): #strict dotted quad with every octet in 0-255 range, so 999.1.1.1 is rejected like the db field would do
+	return isinstance(value, str) and IPV4_RE.fullmatch(value) is not None
+
 #reference dict which defines correct provisioning request structure and value formats
+#values are either regular expressions (matched against the whole string) or check functions
 PROV_SCHEMA = {
 	'statistics': {
 		'system': {
-			'mac': r'^([a-fA-F0-9]{2}[:|\-]?){6}$',
-			'model': r'^[\w\s\+\.\-]+$',
-			'cpu_load': r'^\d+\.\d+$',
-			'memory_usage': r'^\d+\.\d+$',
-			'status': r'^[\w]+$'
+			'mac': r'([a-fA-F0-9]{2}[:|\-]?){6}',
+			'model': r'[\w\s\+\.\-]+',
+			'cpu_load': is_number,
+			'memory_usage': is_number,
+			'status': r'[\w]+'
 		}
 	},
 	'configuration': {
 		'system': {
-			'hostname': r'^[\w]+$'
+			'hostname': r'[\w]+'
 		},
 		'network': {
-			'ip': r'^([0-9]+[\.]?){4}$',
-			'netmask': r'^([0-9]+[\.]?){4}$',
-			'gateway': r'^([0-9]+[\.]?){4}$',
-			'dns1': r'^([0-9]+[\.]?){4}$',
-			'dns2': r'^([0-9]+[\.]?){4}$',
+			'ip': is_ipv4,
+			'netmask': is_ipv4,
+			'gateway': is_ipv4,
+			'dns1': is_ipv4,
+			'dns2': is_ipv4,
 		}
 	},
-	'token': r'^[a-fA-F0-9]{64}$'
+	'token': r'[a-fA-F0-9]{64}'
 }
 
-#obj to log errors/warnings/debugs to db log table and system console (foreground mode)
-LOGGER = Logger(__name__)
+def regex_check(pattern): #builds check function from precompiled anchored regex
+	regex = re.compile(pattern)
+	def check(value):
+		return isinstance(value, str) and regex.fullmatch(value) is not None
+	return check
 
-def data_is_valid(schema, data): #checks agent data against schema
-	for key in schema:
-		if key in data:
-			if isinstance(schema[key], dict):
-				if not isinstance(data[key], dict):
-					LOGGER.error('No dict required by schema: {}'.format(key))
-					return False
-				elif not data_is_valid(schema[key], data[key]): #calls itself recursively for internal nested dicts
-					return False
-			else:
-				if not re.search(schema[key], str(data[key])): #checks if value matches regular excpresion from the schema
-					LOGGER.error('Invalid value by schema: {}'.format(str(data[key])))
-					return False
+#optional request fields, validated only if agent sends them
+PROV_OPTIONAL = {
+	'config_hash': r'[a-f0-9]{64}' #hash of the config agent applied last time
+}
+
+def compile_schema(schema, path=(), required=True): #flattens nested schema into list of (dict path, [(key, check, required), ...]) groups, done once at import
+	fields = []
+	groups = []
+	for key, rule in schema.items():
+		if isinstance(rule, dict):
+			groups.extend(compile_schema(rule, path + (key,), required))
+		elif callable(rule):
+			fields.append((key, rule, required))
 		else:
-			LOGGER.error('No key required by schema: {}'.format(key))
-			return False
-	return True
+			fields.append((key, regex_check(rule), required))
+	if fields:
+		groups.insert(0, (path, fields))
+	return groups
+
+PROV_CHECKS = compile_schema(PROV_SCHEMA) + compile_schema(PROV_OPTIONAL, required=False)
 
-def token_is_valid(token):
-	hash = hashlib.sha256()
-	hash.update(bytearray(settings.PROVISIONING_PASSWORD, 'utf8'))
+#obj to log errors/warnings/debugs to db log table and system console (foreground mode)
+LOGGER = Logger(__name__)
 
-	if hash.hexdigest() != token:
-		LOGGER.error('Password hash mismatch')
+def validate(data, checks=PROV_CHECKS): #checks agent data against compiled schema, returns list of errors (empty if valid)
+	errors = []
+	failed = set() #dicts which already reported an error, so a missing dict is reported once and not for every group in it
+	for path, fields in checks:
+		value = data
+		for depth in range(len(path) + 1): #walks down to the dict which holds this group of fields
+			if not isinstance(value, dict):
+				if path[:depth] not in failed:
+					failed.add(path[:depth])
+					errors.append({'field': '.'.join(path[:depth]), 'error': 'dict required by schema'})
+				break
+			if depth < len(path):
+				value = value.get(path[depth])
+		else:
+			for key, check, required in fields:
+				if key not in value:
+					if not required:
+						continue
+					errors.append({'field': '.'.join(path + (key,)), 'error': 'key required by schema'})
+				elif not check(value[key]):
+					errors.append({'field': '.'.join(path + (key,)), 'error': 'invalid value by schema'})
+	return errors
+
+def data_is_valid(data):
+	return not validate(data)
+
+def token_index(passwords): #maps keyed hash of every valid token to the token itself, computed once at startup
+	index = {}
+	for password in passwords:
+		token = hashlib.sha256(bytearray(password, 'utf8')).hexdigest()
+		index[hmac.digest(TOKEN_KEY, token.encode('ascii'), 'sha256')] = token
+	return index
+
+#random per-process key, dict lookup timing can only leak bits of the keyed hash, never of the token
+TOKEN_KEY = os.urandom(32)
+#main password plus optional extra ones (per-site or rotated) which are accepted at the same time
+TOKENS = token_index([settings.PROVISIONING_PASSWORD] + list(getattr(settings, 'PROVISIONING_PASSWORDS', [])))
+
+def token_matches(token): #pure check without logging, safe to call from async code
+	token = token.encode('ascii') #schema guarantees hex string
+	expected = TOKENS.get(hmac.digest(TOKEN_KEY, token, 'sha256'))
+	return expected is not None and hmac.compare_digest(expected.encode('ascii'), token)
+
+def token_is_valid(token, source=None):
+	if not token_matches(token):
+		LOGGER.src_error('Password hash mismatch', source)
 		return False
 
 	return True
 
-def register_device(data): #if devices does not exsist in db it makes initial table entry for device and config tables
-	reqst = data['statistics']['system']
-	mac = reqst['mac'].upper()
+def request_source(request, reqjson=None): #sender of check-in for log throttling, agent mac if post has one, otherwise client address
 	try:
-		device = Device.objects.get(mac=mac) #obj which directly represents db device table
-	except Device.DoesNotExist:
-		device = None
-	except:
-		LOGGER.error('Failed to get device for register')
-		return False
-	if device:
-		LOGGER.dev_debug('Device already exists', device)
-		return True
+		mac = reqjson['statistics']['system']['mac']
+	except (KeyError, TypeError, IndexError):
+		mac = None
+	if isinstance(mac, str) and mac:
+		return 'mac:' + normalize_mac(mac)[:32]
+	return 'addr:{}'.format(request.META.get('REMOTE_ADDR'))
 
-	device = Device( #creates initial device table entry in a form of Device class new object
-		mac = mac,
+def load_device(mac): #resolves device together with its config and stats in one joined query
+	return Device.objects.select_related('configuration', 'statistics').filter(mac=mac).first() #mac is unique
+
+def new_device(data):
+	reqst = data['statistics']['system']
+	return Device( #creates initial device table entry in a form of Device class new object
+		mac = normalize_mac(reqst['mac']),
 		model = reqst['model'],
 		name = 'Generic device',
 		description = 'Automatically added'
 	)
-	try:
-		device.save() #saves device obj to db
-		LOGGER.dev_warning('Added new device', device)
-	except:
-		LOGGER.dev_error('Failed to save device', device)
-		return False
 
-	LOGGER.dev_debug('Initializing config', device)
+def new_config(data, device):
 	cfg = data['configuration']
 	config = Configuration(#creates initial config table entry in a form of Configuration class new object
 		device = device,
@@ -110,73 +187,70 @@ def register_device(data): #if devices does not exsist in db it makes initial ta
 		dns1 = cfg['network']['dns1'],
 		dns2 = cfg['network']['dns2']
 	)
-	try:
-		config.save()
-	except:
-		LOGGER.dev_error('Failed to save config', device)
-		return False
+	config.config_hash = config.compute_hash() #bulk_create does not call save(), so hash is set here
+	return config
 
-	return True
+def register_device(data, device): #if devices does not exsist in db it makes initial table entry for device and config tables
+	if device:
+		LOGGER.dev_debug('Device already exists', device)
+		return device
 
-def update_stats(data):
-	reqst = data['statistics']['system']
-	mac = reqst['mac'].upper()
+	device = new_device(data)
 	try:
-		device = Device.objects.get(mac=mac)
+		created = Device.objects.insert_ignore(device) #saves device obj to db unless concurrent check-in already did it
 	except:
-		LOGGER.error('Failed to get device for stats')
-		return False
+		LOGGER.dev_error('Failed to save device', device)
+		return None
+
+	if not created:
+		LOGGER.dev_debug('Device was registered by concurrent check-in', device)
+		return load_device(device.mac)
 
+	LOGGER.dev_warning('Added new device', device)
+
+	LOGGER.dev_debug('Initializing config', device)
+	config = new_config(data, device)
 	try:
-		stat = Statistics.objects.get(device_id=device.id) # searches for device statistics entry in db using onetoone device and stats relation
-	except Statistics.DoesNotExist:
-		stat = None
+		config.save(force_insert=True) #pk is the device, plain save() would try UPDATE first
 	except:
-		LOGGER.dev_error('Failed to get stats', device)
-		return False
+		LOGGER.dev_error('Failed to save config', device)
+		return None
 
-	if stat: #update exsisting stats
-		LOGGER.dev_debug('Updating stats', device)
-		stat.status = reqst['status']
-		stat.cpu_load = reqst['cpu_load']
-		stat.memory_usage = reqst['memory_usage']
-	else: #cretae new stats
-		LOGGER.dev_debug('Creating stats', device)
-		stat = Statistics( #represents stats db table
-			device = device,
-			status = reqst['status'],
-			cpu_load = reqst['cpu_load'],
-			memory_usage = reqst['memory_usage']
-		)
+	device.configuration = config #keeps new config attached so build_config does not have to query it
+	return device
 
-	try:
-		stat.save()
+def update_stats(data, device):
+	reqst = data['statistics']['system']
+	row = (device.id, reqst['status'], reqst['cpu_load'], reqst['memory_usage'], timezone.now())
+	if settings.STATS_BUFFER_ENABLED: #stats are written later by write-behind buffer
+		if not BUFFER.add(row):
+			LOGGER.dev_debug('Stats buffer is full, dropped stats', device)
+		return True
+
+	LOGGER.dev_debug('Updating stats', device)
+	try: #creates or updates device stats entry with one upsert statement
+		Statistics.objects.upsert([row])
 	except:
 		LOGGER.dev_error('Failed to save stats', device)
 		return False
 
 	return True
 
-def build_config(data): #if db config is different from the config send by agent this function forms py dict from db config 
-	reqst = data['statistics']['system']
+def build_config(data, device): #if db config is different from the config send by agent this function forms py dict from db config 
 	reqcfg_sys = data['configuration']['system']# variable pointing to system config dict directly
 	reqcfg_net = data['configuration']['network']# variable pointing to network config dict directly
 
-	mac = reqst['mac'].upper()
 	try:
-		device = Device.objects.get(mac=mac)
-	except:
-		LOGGER.error('Failed to get device for config')
-		return None
-
-	try:
-		dbcfg = Configuration.objects.get(device_id=device.id) ## searches for device config entry in db using onetoone device and config relation
-	except:
+		dbcfg = device.configuration #config is already loaded by load_device or register_device
+	except Configuration.DoesNotExist:
 		LOGGER.dev_error('Failed to get config', device)
 		return None
 
+	cfgdata = {'config_status': 'UNCHANGED', 'config_hash': dbcfg.config_hash} #initial dict used to respond to agent request
+	if data.get('config_hash') == dbcfg.config_hash: #agent already applied current config, no need to diff it
+		return cfgdata
+
 	changed = False
-	cfgdata = {'config_status': 'UNCHANGED'} #initial dict used to respond to agent request
 	cfg = {}
 
 	#all following six if statements checks if specific config parameter in db has changed and adds it to response dict if it has changed
@@ -225,44 +299,284 @@ def build_config(data): #if db config is different from the config send by agent
 
 	return cfgdata
 
+def register_devices(checkins): #batch version of load_device + register_device, checkins is a mac -> data dict
+	devices = {}
+	if settings.CONFIG_CACHE_ENABLED:
+		for mac in checkins:
+			device = CONFIG_CACHE.get(mac)
+			if device:
+				devices[mac] = device
+
+	missing = [mac for mac in checkins if mac not in devices] #all other devices with their configs come from one joined query
+	if missing:
+		for device in Device.objects.select_related('configuration').filter(mac__in=missing):
+			devices[device.mac] = device
+			if settings.CONFIG_CACHE_ENABLED:
+				CONFIG_CACHE.put(device)
+
+	new = [new_device(data) for mac, data in checkins.items() if mac not in devices]
+	if new:
+		Device.objects.bulk_create(new, ignore_conflicts=True) #devices registered by concurrent check-ins are skipped
+		configs = []
+		for device in Device.objects.select_related('configuration').filter(mac__in=[device.mac for device in new]):
+			devices[device.mac] = device
+			if not hasattr(device, 'configuration'): #device was inserted by this batch
+				device.configuration = new_config(checkins[device.mac], device)
+				configs.append(device.configuration)
+				LOGGER.dev_warning('Added new device', device)
+		Configuration.objects.bulk_create(configs, ignore_conflicts=True)
+
+	return devices
+
+def update_stats_bulk(checkins, devices): #stats of the whole batch are written with one upsert statement
+	now = timezone.now()
+	rows = []
+	for mac, data in checkins.items():
+		reqst = data['statistics']['system']
+		rows.append((devices[mac].id, reqst['status'], reqst['cpu_load'], reqst['memory_usage'], now))
+	if settings.STATS_BUFFER_ENABLED:
+		for row in rows:
+			BUFFER.add(row)
+	else:
+		Statistics.objects.upsert(rows)
+
+def checkin(reqjson): #db part of provisioning for already validated and authentificated check-in
+	with profiled() as profile: #queries are counted for metrics
+		response = store_checkin(reqjson)
+	CHECKIN_QUERIES.observe(profile.count)
+	return response
+
+def store_checkin(reqjson):
+	with STAGE_SECONDS.time(stage='lookup'):
+		mac = normalize_mac(reqjson['statistics']['system']['mac'])
+		cached = settings.CONFIG_CACHE_ENABLED and CONFIG_CACHE.get(mac)
+		if cached:
+			device = cached
+		else:
+			try:
+				device = load_device(mac)
+			except:
+				LOGGER.error('Failed to get device')
+				return HttpResponseServerError()
+
+	with transaction.atomic(): #registration and stats upsert are committed as a single transaction
+		with STAGE_SECONDS.time(stage='register'):
+			device = register_device(reqjson, device) #if device is not in db this funtion adds initial device and config table entry
+		with STAGE_SECONDS.time(stage='stats'):
+			stored = device is not None and update_stats(reqjson, device) #updates device stats entry
+		if not stored:
+			transaction.set_rollback(True)
+
+	if not device:
+		LOGGER.error('Failed to register device')
+		return HttpResponseServerError()
+
+	if not stored:
+		LOGGER.error('Failed to update stats')
+		return HttpResponseServerError()
+
+	if settings.CONFIG_CACHE_ENABLED and not cached:
+		CONFIG_CACHE.put(device)
+
+	with STAGE_SECONDS.time(stage='config'):
+		config = build_config(reqjson, device) #checks if agent config has changed in db and builts config py dict if it has 
+	with STAGE_SECONDS.time(stage='serialize'):
+		return config_response(config)
+
+def config_response(config):
+	if config:
+		try: # serializes changed configuration and sends to agent
+			respdata = json.dumps(config, sort_keys=True, indent=4)
+		except:
+			LOGGER.error('Failed to serialize config')
+			return HttpResponseServerError()
+		return HttpResponse(respdata, content_type='application/json')
+	else: #failed to built config
+		LOGGER.error('Config was not found')
+		return HttpResponseNotFound()
+
+def device_id_of(mac): #long-poll subscription key, indexed lookup of unique mac, None for unknown device
+	try:
+		return Device.objects.filter(mac=mac).values_list('id', flat=True).first()
+	except:
+		LOGGER.error('Failed to get device')
+		return None
+
+def poll_config(reqjson): #config part of check-in for long-poll, db is read directly as cache of this process may be stale
+	mac = normalize_mac(reqjson['statistics']['system']['mac'])
+	try:
+		device = load_device(mac)
+	except:
+		LOGGER.error('Failed to get device')
+		return None
+
+	if not device:
+		LOGGER.error('Long-poll for unknown device')
+		return None
+
+	return build_config(reqjson, device)
+
+OUTCOMES = {200: 'ok', 400: 'invalid', 403: 'forbidden', 500: 'error'}
+
+def count_checkin(response): #check-in outcome for metrics, by response status
+	CHECKINS.inc(outcome=OUTCOMES.get(response.status_code, 'error'))
+	return response
+
 class ProvisionOperations: #single class which implements device authentification, registration and configuration
 	def process(self, request):
+		return count_checkin(self.handle(request))
+
+	def handle(self, request):
 		if request.method == 'POST':
-			try:
-				reqjson = json.loads(request.body) #deserializes agent post data into py dict
-			except:
-				LOGGER.error('Failed to deserialize post')
+			with STAGE_SECONDS.time(stage='parse'):
+				try:
+					reqjson = json.loads(request.body) #deserializes agent post data into py dict
+				except:
+					reqjson = None
+			if reqjson is None:
+				LOGGER.src_error('Failed to deserialize post', request_source(request))
 				return HttpResponseBadRequest()
 
-			if not data_is_valid(PROV_SCHEMA, reqjson): #verifies if data has required(by reference schema) structure and values
-				LOGGER.error('Invalid post data')
+			with STAGE_SECONDS.time(stage='validate'):
+				errors = validate(reqjson) #verifies if data has required(by reference schema) structure and values
+			if errors:
+				LOGGER.src_error('Invalid post data: {} ({})', request_source(request, reqjson), errors[0]['field'], errors[0]['error'])
 				return HttpResponseBadRequest()
 
-			if not token_is_valid(reqjson['token']): #verifies if agent token is valid(passw correct)
-				LOGGER.error('Invalid security token')
+			source = request_source(request, reqjson)
+			with STAGE_SECONDS.time(stage='auth'):
+				valid = token_is_valid(reqjson['token'], source) #verifies if agent token is valid(passw correct)
+			if not valid:
+				LOGGER.src_error('Invalid security token', source)
 				return HttpResponseForbidden()
 
-			if not register_device(reqjson):
-				LOGGER.error('Failed to register device') #if device is not in db this funtion adds initial device and config table entry
-				return HttpResponseServerError()
+			return checkin(reqjson) #loads, registers and updates device and builds config response
+		else:
+			LOGGER.src_error('Received not a POST request', request_source(request))
+			return HttpResponseBadRequest()
+
+	def process_batch(self, request): #same as process, but for a list of check-ins aggregated by site gateway
+		if request.method != 'POST':
+			LOGGER.src_error('Received not a POST request', request_source(request))
+			return HttpResponseBadRequest()
 
-			if not update_stats(reqjson):
-				LOGGER.error('Failed to update stats')#updates device stats entry
+		try:
+			reqjson = json.loads(request.body)
+		except:
+			LOGGER.src_error('Failed to deserialize post', request_source(request))
+			return HttpResponseBadRequest()
+
+		if not isinstance(reqjson, list) or len(reqjson) > settings.PROVISIONING_BATCH_LIMIT:
+			LOGGER.src_error('Invalid batch post data', request_source(request))
+			return HttpResponseBadRequest()
+
+		results = [None] * len(reqjson) #per device results in the same order as check-ins
+		accepted = [] #(index, mac) of check-ins which passed validation and authentification
+		checkins = {} #mac -> data, last check-in wins if device is reported more than once
+		for idx, data in enumerate(reqjson):
+			errors = validate(data)
+			if errors:
+				results[idx] = {'status': 'INVALID', 'errors': errors}
+				CHECKINS.inc(outcome='invalid')
+				continue
+			if not token_is_valid(data['token'], request_source(request, data)):
+				results[idx] = {'status': 'FORBIDDEN'}
+				CHECKINS.inc(outcome='forbidden')
+				continue
+			mac = normalize_mac(data['statistics']['system']['mac'])
+			accepted.append((idx, mac))
+			checkins[mac] = data
+
+		if checkins:
+			LOGGER.debug('Processing batch of {} check-ins', len(checkins))
+			try:
+				with transaction.atomic(): #registration of new devices and stats upsert are committed as a single transaction
+					devices = register_devices(checkins)
+					update_stats_bulk(checkins, devices)
+			except:
+				LOGGER.error('Failed to store batch')
+				CHECKINS.inc(len(accepted), outcome='error')
 				return HttpResponseServerError()
 
-			config = build_config(reqjson) #checks if agent config has changed in db and builts config py dict if it has 
+		for idx, mac in accepted:
+			config = build_config(checkins[mac], devices[mac])
 			if config:
-				try: # serializes changed configuration and sends to agent
-					respdata = json.dumps(config, sort_keys=True, indent=4)
-				except:
-					LOGGER.error('Failed to serialize config')
-					return HttpResponseServerError()
-				return HttpResponse(respdata, content_type='application/json')
-			else: #failed to built config
-				LOGGER.error('Config was not found')
-				return HttpResponseNotFound()
-		else:
-			LOGGER.error('Received not a POST request')
-			return HttpResponseBadRequest()
+				config['status'] = 'OK'
+			else:
+				config = {'status': 'ERROR'}
+			CHECKINS.inc(outcome='ok' if config['status'] == 'OK' else 'error')
+			config['mac'] = mac
+			results[idx] = config
+
+		try:
+			respdata = json.dumps({'results': results}, sort_keys=True)
+		except:
+			LOGGER.error('Failed to serialize batch results')
+			return HttpResponseServerError()
+		return HttpResponse(respdata, content_type='application/json')
+
+class AsyncProvisionOperations: #async version of ProvisionOperations.process for ASGI deployments
+	async def parse(self, request): #returns (check-in data, None) or (None, error response)
+		if request.method != 'POST':
+			await LOGGER.asrc_error('Received not a POST request', request_source(request))
+			return None, HttpResponseBadRequest()
+
+		#parsing, validation and authentification do not touch db, so they run on the event loop
+		with STAGE_SECONDS.time(stage='parse'):
+			try:
+				reqjson = json.loads(request.body)
+			except:
+				reqjson = None
+		if reqjson is None:
+			await LOGGER.asrc_error('Failed to deserialize post', request_source(request))
+			return None, HttpResponseBadRequest()
+
+		with STAGE_SECONDS.time(stage='validate'):
+			errors = validate(reqjson)
+		if errors:
+			await LOGGER.asrc_error('Invalid post data: {} ({})', request_source(request, reqjson), errors[0]['field'], errors[0]['error'])
+			return None, HttpResponseBadRequest()
+
+		source = request_source(request, reqjson)
+		with STAGE_SECONDS.time(stage='auth'):
+			valid = token_matches(reqjson['token'])
+		if not valid:
+			await LOGGER.asrc_error('Password hash mismatch', source)
+			await LOGGER.asrc_error('Invalid security token', source)
+			return None, HttpResponseForbidden()
+
+		return reqjson, None
+
+	async def process(self, request):
+		reqjson, response = await self.parse(request)
+		if response:
+			return count_checkin(response)
+
+		#whole db part of check-in is done in one worker thread hop instead of a hop per query
+		return count_checkin(await sync_to_async(checkin)(reqjson))
+
+	#long-poll config delivery, request is held until device config changes or LONGPOLL_TIMEOUT passes.
+	#Body is a regular check-in (with config_hash), but stats are not stored. Needs ASGI server
+	async def wait(self, request):
+		reqjson, response = await self.parse(request)
+		if response:
+			return response
+
+		device_id = await sync_to_async(device_id_of)(normalize_mac(reqjson['statistics']['system']['mac']))
+		waiter = NOTIFIER.subscribe(device_id) if device_id else None #unknown device is reported by poll_config
+		try:
+			config = await sync_to_async(poll_config)(reqjson)
+			if waiter and config and config['config_status'] == 'UNCHANGED':
+				if await NOTIFIER.wait(waiter, settings.LONGPOLL_TIMEOUT):
+					config = await sync_to_async(poll_config)(reqjson)
+		finally:
+			if waiter:
+				NOTIFIER.unsubscribe(device_id, waiter)
+
+		return await sync_to_async(config_response)(config)
+
+	process.csrf_exempt = True #csrf_exempt() decorator wraps view into sync function, which breaks async views
+	wait.csrf_exempt = True
 
 ops = ProvisionOperations() #this obj is used by  urls.py as a provisioning url handler
+async_ops = AsyncProvisionOperations()
@@ -0,0 +1,80 @@
+import datetime
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.utils import timezone
+
+from wrtapp.models import StatisticsSample
+from wrtapp.models import StatisticsRollup
+from wrtapp.models import RollupWatermark
+
+#incremental downsampling of stats history into 1 minute, 1 hour and 1 day buckets per device.
+#Every resolution keeps a watermark, only samples between watermark and the last closed bucket are
+#aggregated, so every run reads just newly arrived data. Buckets are closed ROLLUP_LAG seconds after
+#their end, which leaves time for buffered stats (see statsbuffer.py) to be written
+
+RESOLUTIONS = [60, 3600, 86400] # Seconds, from finest to coarsest.
+TRUNC = {60: 'minute', 3600: 'hour', 86400: 'day'}
+MAX_SPAN = datetime.timedelta(days=1) #max period aggregated by one query
+
+def floor_time(value, resolution):
+	epoch = int(value.timestamp())
+	return datetime.datetime.fromtimestamp(epoch - epoch % resolution, tz=datetime.timezone.utc)
+
+def aggregate(resolution, start, end): #aggregates samples in [start, end) and upserts their buckets
+	sqlquery = ('INSERT INTO {rollup} (device_id, resolution, bucket, samples, offline, '
+		'cpu_min, cpu_avg, cpu_max, cpu_p95, memory_min, memory_avg, memory_max, memory_p95) '
+		'SELECT device_id, %s, date_trunc(%s, date) AS bucket, count(*), count(*) FILTER (WHERE status = %s), '
+		'min(cpu_load), avg(cpu_load), max(cpu_load), percentile_cont(0.95) WITHIN GROUP (ORDER BY cpu_load), '
+		'min(memory_usage), avg(memory_usage), max(memory_usage), percentile_cont(0.95) WITHIN GROUP (ORDER BY memory_usage) '
+		'FROM {samples} '
+		'WHERE date >= %s AND date < %s '
+		'GROUP BY device_id, bucket '
+		'ON CONFLICT (device_id, resolution, bucket) DO UPDATE SET '
+		'samples = EXCLUDED.samples, offline = EXCLUDED.offline, '
+		'cpu_min = EXCLUDED.cpu_min, cpu_avg = EXCLUDED.cpu_avg, cpu_max = EXCLUDED.cpu_max, cpu_p95 = EXCLUDED.cpu_p95, '
+		'memory_min = EXCLUDED.memory_min, memory_avg = EXCLUDED.memory_avg, '
+		'memory_max = EXCLUDED.memory_max, memory_p95 = EXCLUDED.memory_p95').format(
+			rollup=StatisticsRollup._meta.db_table, samples=StatisticsSample._meta.db_table)
+	with connection.cursor() as cursor:
+		cursor.execute(sqlquery, [resolution, TRUNC[resolution], 'OFFLINE', start, end])
+		return cursor.rowcount
+
+def run_rollup(resolution, now=None): #aggregates all closed buckets after watermark, returns number of written buckets
+	now = now or timezone.now()
+	end = floor_time(now - datetime.timedelta(seconds=settings.ROLLUP_LAG), resolution)
+	written = 0
+	while True:
+		with transaction.atomic(): #buckets and watermark are moved together
+			watermark = RollupWatermark.objects.select_for_update().filter(resolution=resolution).first()
+			if watermark is None: #first run starts at the oldest history which is kept
+				start = floor_time(now - datetime.timedelta(days=settings.STATS_HISTORY_RETENTION), resolution)
+				watermark = RollupWatermark(resolution=resolution, position=start)
+			start = watermark.position
+			if start >= end:
+				return written
+			stop = min(end, start + max(MAX_SPAN, datetime.timedelta(seconds=resolution)))
+			written += aggregate(resolution, start, stop)
+			watermark.position = stop
+			watermark.save()
+
+def purge_rollups(now=None): #removes buckets older than their resolution retention
+	now = now or timezone.now()
+	deleted = 0
+	for resolution, days in settings.ROLLUP_RETENTION.items():
+		if days:
+			deleted += StatisticsRollup.objects.filter(resolution=resolution, bucket__lt=now - datetime.timedelta(days=days)).delete()[0]
+	return deleted
+
+def choose_resolution(start, end, max_points): #coarse enough resolution, so window has at most max_points buckets
+	span = (end - start).total_seconds()
+	for resolution in RESOLUTIONS:
+		if span / resolution <= max_points:
+			return resolution
+	return RESOLUTIONS[-1]
+
+def query_rollups(device, start, end, max_points=None): #returns (resolution, buckets queryset) for dashboard charts
+	resolution = choose_resolution(start, end, max_points or settings.ROLLUP_MAX_POINTS)
+	buckets = StatisticsRollup.objects.filter(device=device, resolution=resolution,
+		bucket__gte=floor_time(start, resolution), bucket__lt=end).order_by('bucket')
+	return resolution, buckets
@@ -0,0 +1,77 @@
+import re
+
+from django.contrib.postgres.search import SearchQuery, SearchRank
+from django.db.models import F, Q, Value, FloatField
+from django.db.models.functions import Cast
+
+from wrtapp.models import normalize_mac
+
+#dashboard search helpers. Device, Configuration and Log have stored tsvector 'search' columns
+#with GIN indexes, which are kept up to date by db triggers (see 0011 migration). Words are matched
+#as prefixes, which does not work for fragments from the middle of macs and addresses
+#(e.g. '5E:6F' or '.3.1'), those are matched with 'ilike' lookup backed by pg_trgm indexes
+
+SEARCH_CONFIG = 'simple' # Must match config used by the triggers.
+TSQUERY_SPECIAL_RE = re.compile(r"[&|!():*<>'\\]")
+RANGE_RE = re.compile(r'^(cpu|memory)(>=|<=|>|<|=)(\d+(?:\.\d+)?)$', re.IGNORECASE)
+NUMBER_RE = re.compile(r'^\d+(?:\.\d+)?$')
+RANGE_FIELDS = {'cpu': 'cpu_load', 'memory': 'memory_usage'}
+RANGE_LOOKUPS = {'>': 'gt', '>=': 'gte', '<': 'lt', '<=': 'lte'}
+
+def search_query(text): #every word must match as a prefix, e.g. 'regist dev' finds 'Registered new device'
+	terms = [TSQUERY_SPECIAL_RE.sub('', word) for word in text.split()]
+	terms = [term for term in terms if term]
+	if not terms:
+		return None
+	return SearchQuery(' & '.join(term + ':*' for term in terms), config=SEARCH_CONFIG, search_type='raw')
+
+def ranked(queryset, text, vectors=('search',), condition=None):
+	#filters rows with any of vectors matching text (or satisfying condition) and annotates rank of the first vector
+	query = search_query(text)
+	if query is None:
+		rank = Value(0.0, output_field=FloatField())
+		matches = Q(pk__in=[])
+	else:
+		#rank is cast to double precision, so the value in page cursor compares equal to the stored one
+		rank = Cast(SearchRank(F(vectors[0]), query), FloatField())
+		matches = Q()
+		for vector in vectors:
+			matches |= Q(**{vector: query})
+	if condition is not None:
+		matches |= condition
+	return queryset.annotate(rank=rank).filter(matches)
+
+def substring_q(text, fields): #any of fields contains text
+	condition = Q()
+	for field in fields:
+		condition |= Q(**{field + '__ilike': text})
+	return condition
+
+def mac_q(text, field='mac'): #macs are stored in compact form, so 'a4:2b' is looked up as 'A42B'
+	fragment = normalize_mac(text)
+	return Q(**{field + '__ilike': fragment}) if fragment else Q(pk__in=[])
+
+def number_q(text, fields): #range of typed precision, e.g. '12' finds 12 <= x < 13 and '12.5' finds 12.5 <= x < 12.6
+	value = float(text)
+	step = 10 ** -len(text.partition('.')[2])
+	condition = Q()
+	for field in fields:
+		condition |= Q(**{field + '__gte': value, field + '__lt': value + step})
+	return condition
+
+def stats_q(text): #e.g. 'A4:2B offline cpu>50 memory<=20.5', all words must match
+	condition = Q()
+	for word in text.split():
+		match = RANGE_RE.match(word)
+		if match:
+			field = RANGE_FIELDS[match.group(1).lower()]
+			if match.group(2) == '=':
+				condition &= number_q(match.group(3), [field])
+			else:
+				condition &= Q(**{field + '__' + RANGE_LOOKUPS[match.group(2)]: float(match.group(3))})
+			continue
+		alternatives = mac_q(word, 'device__mac') | Q(current_status__iexact=word) #see Statistics.objects.with_current_status
+		if NUMBER_RE.match(word):
+			alternatives |= number_q(word, RANGE_FIELDS.values())
+		condition &= alternatives
+	return condition
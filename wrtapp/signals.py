@@ -0,0 +1,28 @@
+from django.db import transaction
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+
+from wrtapp.models import Device
+from wrtapp.models import Configuration
+
+from wrtapp.configcache import CONFIG_CACHE
+from wrtapp.notifier import NOTIFIER
+
+#cached configs are dropped after the change is committed, otherwise concurrent check-in could
+#cache the old row again before the change becomes visible to it
+
+@receiver(post_save, sender=Device)
+@receiver(post_delete, sender=Device)
+def invalidate_device(sender, instance, **kwargs):
+	device_id, mac = instance.id, instance.mac #delete() clears instance id before commit
+	transaction.on_commit(lambda: CONFIG_CACHE.invalidate(device_id, mac))
+
+@receiver(post_save, sender=Configuration)
+@receiver(post_delete, sender=Configuration)
+def invalidate_configuration(sender, instance, **kwargs):
+	device_id = instance.device_id
+	transaction.on_commit(lambda: CONFIG_CACHE.invalidate(device_id))
+
+@receiver(post_save, sender=Configuration)
+def notify_configuration(sender, instance, **kwargs): #wakes long-poll requests waiting for this device
+	NOTIFIER.publish(instance.device_id) #by id, instance.device would be loaded by extra query on every save
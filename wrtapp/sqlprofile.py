@@ -0,0 +1,137 @@
+import asyncio
+import contextlib
+import contextvars
+import json
+import logging
+import random
+import time
+
+from django.conf import settings
+from django.db import connections
+from django.db.backends.signals import connection_created
+from django.utils.decorators import sync_and_async_middleware
+
+#per-request sql profiling. Every db connection gets an execute wrapper which adds statement and its time
+#to the profile of the current request, profile is found through a context variable, so it also follows
+#async views into sync_to_async threads. Works without DEBUG (connection.queries is not used).
+#One summary line is written per profiled request, requests over thresholds are logged as warnings
+
+LOGGER = logging.getLogger(__name__)
+PROFILE = contextvars.ContextVar('sql_profile', default=None)
+
+class Profile:
+	def __init__(self, path, parent=None):
+		self.path = path
+		self.parent = parent # statements are counted in the enclosing profile too
+		self.started = time.perf_counter()
+		self.count = 0
+		self.duration = 0.0 # Seconds.
+		self.statements = {} # sql -> [count, total seconds, max seconds]
+
+	def add(self, sql, duration):
+		if self.parent is not None:
+			self.parent.add(sql, duration)
+		self.count += 1
+		self.duration += duration
+		stats = self.statements.get(sql)
+		if stats is None:
+			self.statements[sql] = [1, duration, duration]
+		else:
+			stats[0] += 1
+			stats[1] += duration
+			stats[2] = max(stats[2], duration)
+
+	def summary(self, status):
+		slowest = sorted(self.statements.items(), key=lambda item: item[1][2], reverse=True)[:settings.SQL_PROFILE_TOP]
+		#same statement (with different params) executed many times in one request is usually N+1 query in a loop
+		duplicates = [(sql, stats[0]) for sql, stats in self.statements.items() if stats[0] >= settings.SQL_PROFILE_DUPLICATE_THRESHOLD]
+		flags = []
+		if self.count > settings.SQL_PROFILE_MAX_QUERIES:
+			flags.append('queries')
+		if self.duration * 1000 > settings.SQL_PROFILE_MAX_DB_TIME:
+			flags.append('db_time')
+		if duplicates:
+			flags.append('duplicates')
+		return {
+			'path': self.path,
+			'status': status,
+			'time_ms': round((time.perf_counter() - self.started) * 1000, 2),
+			'queries': self.count,
+			'db_time_ms': round(self.duration * 1000, 2),
+			'slowest': [{'sql': sql[:200], 'ms': round(stats[2] * 1000, 2)} for sql, stats in slowest],
+			'duplicates': [{'sql': sql[:200], 'count': count} for sql, count in duplicates],
+			'flags': flags,
+		}
+
+def profile_wrapper(execute, sql, params, many, context):
+	profile = PROFILE.get()
+	if profile is None:
+		return execute(sql, params, many, context)
+	started = time.perf_counter()
+	try:
+		return execute(sql, params, many, context)
+	finally:
+		profile.add(sql, time.perf_counter() - started)
+
+def install(connection, **kwargs):
+	if profile_wrapper not in connection.execute_wrappers:
+		connection.execute_wrappers.append(profile_wrapper)
+
+def install_all():
+	for connection in connections.all(): #connections opened before the signal handler was connected
+		install(connection)
+
+@contextlib.contextmanager
+def profiled(path=''): #profiles block of code (e.g. one check-in for metrics), regardless of settings
+	install_all()
+	profile = Profile(path, PROFILE.get())
+	token = PROFILE.set(profile)
+	try:
+		yield profile
+	finally:
+		PROFILE.reset(token)
+
+def start(request): #returns profile if this request is profiled
+	if not settings.SQL_PROFILE_ENABLED or random.random() >= settings.SQL_PROFILE_SAMPLE_RATE:
+		return None
+	install_all()
+	profile = Profile(request.path)
+	return profile, PROFILE.set(profile)
+
+def finish(started, response):
+	profile, token = started
+	PROFILE.reset(token)
+	summary = profile.summary(getattr(response, 'status_code', None))
+	line = 'sql profile ' + json.dumps(summary)
+	if summary['flags']:
+		LOGGER.warning(line)
+	else:
+		LOGGER.info(line)
+
+@sync_and_async_middleware
+def sql_profile_middleware(get_response):
+	if asyncio.iscoroutinefunction(get_response):
+		async def middleware(request):
+			started = start(request)
+			if started is None:
+				return await get_response(request)
+			response = None
+			try:
+				response = await get_response(request)
+				return response
+			finally:
+				finish(started, response)
+	else:
+		def middleware(request):
+			started = start(request)
+			if started is None:
+				return get_response(request)
+			response = None
+			try:
+				response = get_response(request)
+				return response
+			finally:
+				finish(started, response)
+	return middleware
+
+connection_created.connect(install)
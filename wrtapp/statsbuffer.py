@@ -0,0 +1,85 @@
+import atexit
+import threading
+
+from django.conf import settings
+from django.db import connection
+
+from wrtapp.models import Statistics
+from wrtapp.logger import Logger
+
+LOGGER = Logger(__name__)
+
+#write-behind buffer for device stats. Agents report every few seconds and every report overwrites the same
+#statistics row, so only the latest row per device is kept in memory and all of them are written
+#periodically by a background thread with a single upsert statement
+class StatsBuffer:
+	def __init__(self, interval, max_entries, autostart=True):
+		self.interval = interval / 1000.0 # Milliseconds.
+		self.max_entries = max_entries # bounds memory, new devices are dropped when buffer is full
+		self.autostart = autostart
+		self.pending = {} # device id -> (device_id, status, cpu_load, memory_usage, date)
+		self.lock = threading.Lock()
+		self.wakeup = threading.Event()
+		self.stopping = False
+		self.thread = None
+		self.counters = {'added': 0, 'coalesced': 0, 'dropped': 0, 'flushed': 0, 'skipped': 0, 'failed': 0}
+
+	def start(self): #flush thread is started lazily, so every worker process gets its own one
+		self.thread = threading.Thread(target=self.run, name='stats-buffer', daemon=True)
+		self.thread.start()
+		atexit.register(self.stop)
+
+	def add(self, row):
+		with self.lock:
+			if self.thread is None and self.autostart:
+				self.start()
+			device_id = row[0]
+			if device_id in self.pending: #older not yet written row of the same device is replaced
+				self.counters['coalesced'] += 1
+			elif len(self.pending) >= self.max_entries:
+				self.counters['dropped'] += 1
+				return False
+			self.pending[device_id] = row
+			self.counters['added'] += 1
+		return True
+
+	def flush(self):
+		with self.lock:
+			rows, self.pending = self.pending, {}
+		if not rows:
+			return 0
+
+		try: #rows of devices deleted while their stats were buffered are skipped, not the whole batch
+			written = Statistics.objects.upsert(list(rows.values()))
+		except:
+			LOGGER.error('Failed to flush {} buffered stats'.format(len(rows)))
+			with self.lock:
+				self.counters['failed'] += len(rows)
+			return 0
+
+		with self.lock:
+			self.counters['flushed'] += written
+			self.counters['skipped'] += len(rows) - written
+		return written
+
+	def run(self):
+		while not self.stopping:
+			self.wakeup.wait(self.interval)
+			connection.close_if_unusable_or_obsolete() #thread keeps own db connection, reconnect if it went away
+			self.flush()
+		connection.close()
+
+	def stop(self): #flushes everything on shutdown
+		self.stopping = True
+		self.wakeup.set()
+		if self.thread:
+			self.thread.join(self.interval + 5)
+		self.flush()
+
+	def stats(self):
+		with self.lock:
+			stats = dict(self.counters)
+			stats['pending'] = len(self.pending)
+		return stats
+
+BUFFER = StatsBuffer(settings.STATS_BUFFER_INTERVAL, settings.STATS_BUFFER_MAX_ENTRIES)
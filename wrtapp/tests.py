@@ -1,3 +1,736 @@
+import asyncio
+import datetime
+import json
+import hashlib
+import gzip
+import io
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+from unittest import mock
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.db import connection
+from django.db.migrations.executor import MigrationExecutor
 from django.test import TestCase
+from django.test import TransactionTestCase
+from django.test import RequestFactory
+from django.test import override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+
+from wrtapp.models import Device
+from wrtapp.models import Configuration
+from wrtapp.models import Statistics
+from wrtapp.models import StatisticsSample
+from wrtapp.models import StatisticsRollup
+from wrtapp.models import Log
+from wrtapp import provision
+from wrtapp.statsbuffer import StatsBuffer
+from wrtapp.logsink import LogSink
+from wrtapp.logger import Logger
+from wrtapp.logthrottle import DEDUPLICATOR, LIMITER, LogDeduplicator, RateLimiter
+from wrtapp.configcache import CONFIG_CACHE
+from wrtapp.notifier import ConfigNotifier
+from wrtapp import rollup
+from wrtapp import partitions
+from wrtapp import sqlprofile
+from wrtapp import metrics
+from wrtapp import benchmark
+from wrtapp import bulk
+from wrtapp.pagination import paginate
+from wrtapp.search import ranked, stats_q
+
+#query budgets for a single agent check-in, transaction control statements are not counted
+STEADY_QUERY_BUDGET = 2 #joined device lookup + stats upsert
+REGISTER_QUERY_BUDGET = 5 #device lookup + device insert + log insert + config insert + stats upsert
+
+def checkin_data(mac='A4:2B:3C:4D:5E:6F', hostname='router', ip='192.168.1.1'):
+	token = hashlib.sha256(bytearray(settings.PROVISIONING_PASSWORD, 'utf8')).hexdigest()
+	return {
+		'statistics': {
+			'system': {
+				'mac': mac,
+				'model': 'TL-WR841N',
+				'cpu_load': 12.5,
+				'memory_usage': 40.1,
+				'status': 'OK'
+			}
+		},
+		'configuration': {
+			'system': {
+				'hostname': hostname
+			},
+			'network': {
+				'ip': ip,
+				'netmask': '255.255.255.0',
+				'gateway': '192.168.1.254',
+				'dns1': '8.8.8.8',
+				'dns2': '8.8.4.4'
+			}
+		},
+		'token': token
+	}
+
+class ProvisioningTestCase(TestCase):
+	def checkin(self, data):
+		with CaptureQueriesContext(connection) as ctx:
+			response = self.client.post('/wrtapp/provisioning', json.dumps(data), content_type='application/json')
+		queries = [query for query in ctx.captured_queries if 'SAVEPOINT' not in query['sql']]
+		return response, len(queries)
+
+	def test_register_query_budget(self):
+		response, queries = self.checkin(checkin_data())
+		self.assertEqual(response.status_code, 200)
+		self.assertLessEqual(queries, REGISTER_QUERY_BUDGET)
+		device = Device.objects.get(mac='A42B3C4D5E6F')
+		self.assertTrue(Configuration.objects.filter(device=device).exists())
+		self.assertEqual(Statistics.objects.get(device=device).cpu_load, 12.5)
+
+	def test_steady_state_query_budget(self):
+		self.checkin(checkin_data())
+		data = checkin_data()
+		data['statistics']['system']['cpu_load'] = 55.0
+		response, queries = self.checkin(data)
+		self.assertEqual(response.status_code, 200)
+		self.assertLessEqual(queries, STEADY_QUERY_BUDGET)
+		self.assertEqual(json.loads(response.content)['config_status'], 'UNCHANGED')
+		self.assertEqual(Statistics.objects.get().cpu_load, 55.0)
+		self.assertEqual(StatisticsSample.objects.count(), 2) #history is appended by the same upsert statement
+
+	def test_changed_config_query_budget(self):
+		self.checkin(checkin_data())
+		Configuration.objects.update(hostname='renamed')
+		response, queries = self.checkin(checkin_data())
+		self.assertEqual(response.status_code, 200)
+		self.assertLessEqual(queries, STEADY_QUERY_BUDGET)
+		resp = json.loads(response.content)
+		self.assertEqual(resp['config_status'], 'CHANGED')
+		self.assertEqual(resp['configuration'], {'system': {'hostname': 'renamed'}})
+
+	def test_config_hash(self):
+		response, _ = self.checkin(checkin_data())
+		data = checkin_data()
+		data['config_hash'] = json.loads(response.content)['config_hash']
+		data['configuration']['system']['hostname'] = 'stale' #diff is skipped when agent echoes current hash
+		response, _ = self.checkin(data)
+		self.assertEqual(json.loads(response.content)['config_status'], 'UNCHANGED')
+
+		config = Configuration.objects.get()
+		config.hostname = 'renamed'
+		config.save()
+		self.assertNotEqual(config.config_hash, data['config_hash'])
+		response, _ = self.checkin(data)
+		resp = json.loads(response.content)
+		self.assertEqual(resp['config_status'], 'CHANGED')
+		self.assertEqual(resp['config_hash'], config.config_hash)
+
+	@override_settings(CONFIG_CACHE_ENABLED=True)
+	def test_config_cache(self):
+		CONFIG_CACHE.clear()
+		self.checkin(checkin_data())
+		self.checkin(checkin_data()) #populates cache from joined lookup
+		response, queries = self.checkin(checkin_data())
+		self.assertEqual(response.status_code, 200)
+		self.assertEqual(queries, 1) #only stats upsert
+
+		config = Configuration.objects.get()
+		config.hostname = 'renamed'
+		with self.captureOnCommitCallbacks(execute=True), self.assertNumQueries(1): #update only, signals do not load the device
+			config.save()
+		response, _ = self.checkin(checkin_data())
+		self.assertEqual(json.loads(response.content)['configuration'], {'system': {'hostname': 'renamed'}})
+
+	@override_settings(LONGPOLL_TIMEOUT=0.1)
+	def test_longpoll(self):
+		self.checkin(checkin_data())
+		response = self.client.post('/wrtapp/provisioning/wait', json.dumps(checkin_data()), content_type='application/json')
+		self.assertEqual(json.loads(response.content)['config_status'], 'UNCHANGED') #after timeout
+
+		response = self.client.post('/wrtapp/provisioning/wait', json.dumps(checkin_data(hostname='other')), content_type='application/json')
+		self.assertEqual(json.loads(response.content)['config_status'], 'CHANGED') #immediately
+
+	def test_invalid_token(self):
+		data = checkin_data()
+		data['token'] = '0' * 64
+		response, _ = self.checkin(data)
+		self.assertEqual(response.status_code, 403)
+		self.assertFalse(Device.objects.exists())
+
+	def test_batch_query_budget(self):
+		batch = [checkin_data(mac='A4:2B:3C:4D:5E:{:02X}'.format(idx)) for idx in range(20)]
+		with CaptureQueriesContext(connection):
+			response = self.client.post('/wrtapp/provisioning/batch', json.dumps(batch), content_type='application/json')
+		self.assertEqual(response.status_code, 200)
+		self.assertEqual(Device.objects.count(), 20)
+		self.assertEqual(Configuration.objects.count(), 20)
+
+		batch[3]['token'] = '0' * 64
+		batch[5]['configuration']['network']['ip'] = '999.1.1.1'
+		with CaptureQueriesContext(connection) as ctx:
+			response = self.client.post('/wrtapp/provisioning/batch', json.dumps(batch), content_type='application/json')
+		self.assertEqual(response.status_code, 200)
+		queries = [query for query in ctx.captured_queries if 'SAVEPOINT' not in query['sql'] and 'wrtapp_log' not in query['sql']]
+		self.assertLessEqual(len(queries), STEADY_QUERY_BUDGET)
+		results = json.loads(response.content)['results']
+		self.assertEqual(results[0]['config_status'], 'UNCHANGED')
+		self.assertEqual(results[3]['status'], 'FORBIDDEN')
+		self.assertEqual(results[5]['errors'][0]['field'], 'configuration.network.ip')
+
+	def test_async_checkin(self):
+		response = self.client.post('/wrtapp/provisioning/async', json.dumps(checkin_data()), content_type='application/json')
+		self.assertEqual(response.status_code, 200)
+		self.assertEqual(json.loads(response.content)['config_status'], 'UNCHANGED')
+		self.assertTrue(Statistics.objects.filter(device__mac='A42B3C4D5E6F').exists())
+
+	def test_rotated_token(self):
+		data = checkin_data()
+		data['token'] = hashlib.sha256(b'rotated-password').hexdigest()
+		with mock.patch.object(provision, 'TOKENS', provision.token_index([settings.PROVISIONING_PASSWORD, 'rotated-password'])):
+			response, _ = self.checkin(data)
+		self.assertEqual(response.status_code, 200)
+		self.assertTrue(provision.token_is_valid(checkin_data()['token']))
+
+class ValidationTestCase(TestCase):
+	def errors(self, change):
+		data = checkin_data()
+		change(data)
+		return [(error['field'], error['error']) for error in provision.validate(data)]
+
+	def test_valid(self):
+		self.assertEqual(provision.validate(checkin_data()), [])
+		data = checkin_data()
+		data['statistics']['system']['cpu_load'] = '12.5' #numeric strings of older agents
+		data['statistics']['system']['memory_usage'] = 40
+		data['config_hash'] = 'a' * 64
+		self.assertTrue(provision.data_is_valid(data))
+
+	def test_rejections(self):
+		def remove_network(data):
+			del data['configuration']['network']
+		def set_value(path, value):
+			def change(data):
+				target = data
+				for key in path[:-1]:
+					target = target[key]
+				target[path[-1]] = value
+			return change
+		self.assertEqual(self.errors(remove_network), [('configuration.network', 'dict required by schema')])
+		self.assertEqual(self.errors(set_value(['statistics'], 'text')), [('statistics', 'dict required by schema')])
+		self.assertEqual(self.errors(lambda data: data.pop('token')), [('token', 'key required by schema')])
+		self.assertEqual(self.errors(set_value(['statistics', 'system', 'mac'], 'not-a-mac')),
+			[('statistics.system.mac', 'invalid value by schema')])
+		self.assertEqual(self.errors(set_value(['configuration', 'system', 'hostname'], 5)),
+			[('configuration.system.hostname', 'invalid value by schema')])
+		self.assertEqual(self.errors(set_value(['configuration', 'network', 'ip'], '999.1.1.1')),
+			[('configuration.network.ip', 'invalid value by schema')])
+		self.assertEqual(self.errors(set_value(['config_hash'], 'xyz')), [('config_hash', 'invalid value by schema')])
+
+	def test_numbers(self):
+		for value in [-1, True, None, '1e5', '-1.0', float('nan'), float('inf'), 10 ** 400, '1' * 400]:
+			self.assertFalse(provision.is_number(value), value)
+		for value in [0, 12, 12.5, '12', '12.5', 10 ** 300]:
+			self.assertTrue(provision.is_number(value), value)
+
+	def test_huge_number_is_rejected(self):
+		data = checkin_data()
+		data['statistics']['system']['cpu_load'] = 10 ** 400
+		response = self.client.post('/wrtapp/provisioning', json.dumps(data), content_type='application/json')
+		self.assertEqual(response.status_code, 400)
+
+		batch = [checkin_data(mac='A4:2B:3C:4D:5E:01'), data]
+		response = self.client.post('/wrtapp/provisioning/batch', json.dumps(batch), content_type='application/json')
+		self.assertEqual(response.status_code, 200)
+		results = json.loads(response.content)['results']
+		self.assertEqual(results[0]['status'], 'OK')
+		self.assertEqual(results[1]['errors'], [{'field': 'statistics.system.cpu_load', 'error': 'invalid value by schema'}])
+
+class MacDedupeMigrationTestCase(TransactionTestCase):
+	def migrate(self, targets): #returns historical models at targets
+		executor = MigrationExecutor(connection)
+		executor.migrate(targets)
+		return executor.loader.project_state(targets).apps
+
+	def test_duplicate_macs_are_merged(self):
+		latest = MigrationExecutor(connection).loader.graph.leaf_nodes('wrtapp')
+		apps = self.migrate([('wrtapp', '0005_configuration_config_hash')])
+		try:
+			OldDevice = apps.get_model('wrtapp', 'Device')
+			OldStatistics = apps.get_model('wrtapp', 'Statistics')
+			OldLog = apps.get_model('wrtapp', 'Log')
+			devices = [OldDevice.objects.create(mac=mac, model='TL-WR841N', name='Generic device', description='Added automatically')
+				for mac in ['a4:2b:3c:4d:5e:6f', 'A4-2B-3C-4D-5E-6F', 'A42B3C4D5E6F']]
+			OldStatistics.objects.create(device=devices[2], status='OK', cpu_load=12.5, memory_usage=40.1)
+			for device in devices:
+				OldLog.objects.create(device=device, severity='WARNING', message='Added new device')
+			self.migrate([('wrtapp', '0006_device_mac_unique')])
+		finally:
+			self.migrate(latest)
+
+		device = Device.objects.get()
+		self.assertEqual((device.id, device.mac), (devices[0].id, 'A42B3C4D5E6F')) #oldest device is kept
+		self.assertEqual(Log.objects.filter(device=device).count(), 3)
+		self.assertTrue(Statistics.objects.filter(device=device).exists())
+
+class StatsBufferTestCase(TestCase):
+	def test_coalesce_and_flush(self):
+		devices = [Device.objects.create(mac='A4:2B:3C:4D:5E:{:02X}'.format(idx)) for idx in range(3)]
+		buffer = StatsBuffer(1000, 2, autostart=False)
+		now = timezone.now()
+		self.assertTrue(buffer.add((devices[0].id, 'OK', 10.0, 20.0, now)))
+		self.assertTrue(buffer.add((devices[0].id, 'OK', 11.0, 21.0, now)))
+		self.assertTrue(buffer.add((devices[1].id, 'OK', 12.0, 22.0, now)))
+		self.assertFalse(buffer.add((devices[2].id, 'OK', 13.0, 23.0, now)))
+
+		with self.assertNumQueries(1):
+			self.assertEqual(buffer.flush(), 2)
+		self.assertEqual(Statistics.objects.get(device=devices[0]).cpu_load, 11.0)
+		self.assertFalse(Statistics.objects.filter(device=devices[2]).exists())
+		self.assertEqual(buffer.stats(), {'added': 3, 'coalesced': 1, 'dropped': 1, 'flushed': 2, 'skipped': 0, 'failed': 0, 'pending': 0})
+
+	def test_device_deleted_while_buffered(self):
+		devices = [Device.objects.create(mac='A4:2B:3C:4D:5E:{:02X}'.format(idx)) for idx in range(2)]
+		buffer = StatsBuffer(1000, 10, autostart=False)
+		now = timezone.now()
+		for device in devices:
+			buffer.add((device.id, 'OK', 10.0, 20.0, now))
+		deleted = devices[0].id
+		devices[0].delete()
+
+		self.assertEqual(buffer.flush(), 1)
+		self.assertFalse(Statistics.objects.filter(device_id=deleted).exists())
+		self.assertFalse(StatisticsSample.objects.filter(device_id=deleted).exists())
+		self.assertEqual(Statistics.objects.get(device=devices[1]).cpu_load, 10.0)
+		stats = buffer.stats()
+		self.assertEqual((stats['flushed'], stats['skipped'], stats['failed']), (1, 1, 0))
+
+class LogSinkTestCase(TestCase):
+	def test_batch_and_overflow(self):
+		sink = LogSink(1000, 2, 3, 'drop_old', autostart=False)
+		for i in range(4):
+			self.assertTrue(sink.add(Log(severity='ERROR', message='message {}'.format(i))))
+		with self.assertNumQueries(2): #two batches
+			self.assertEqual(sink.flush(), 3)
+		self.assertEqual(sorted(Log.objects.values_list('message', flat=True)), ['message 1', 'message 2', 'message 3'])
+		self.assertEqual(sink.stats(), {'added': 4, 'dropped': 1, 'flushed': 3, 'failed': 0, 'pending': 0})
+
+		sink = LogSink(1000, 2, 1, 'drop_new', autostart=False)
+		self.assertTrue(sink.add(Log(severity='ERROR', message='kept')))
+		self.assertFalse(sink.add(Log(severity='ERROR', message='dropped')))
+
+	@override_settings(LOG_SINK_ENABLED=True)
+	def test_logger_queues_rows(self):
+		sink = LogSink(1000, 100, 100, 'drop_new', autostart=False)
+		with mock.patch('wrtapp.logger.LOG_SINK', sink), self.assertNumQueries(0):
+			Logger('test').warning('Invalid value {} by schema', 'x' * 200)
+		sink.flush()
+		log = Log.objects.get()
+		self.assertEqual(len(log.message), 128)
+		self.assertTrue(log.message.startswith('Invalid value xxx'))
+
+class LogThrottleTestCase(TestCase):
+	def setUp(self):
+		DEDUPLICATOR.clear()
+		LIMITER.clear()
+		self.device = Device.objects.create(mac='A42B3C4D5E6F')
+
+	def test_repeats_are_merged(self):
+		for i in range(3):
+			with self.assertNumQueries(1): #insert, then counter updates
+				Logger('test').dev_error('Password hash mismatch', self.device)
+		log = Log.objects.get()
+		self.assertEqual(log.count, 3)
+		self.assertIsNotNone(log.last_seen)
+
+	@override_settings(LOG_SINK_ENABLED=True)
+	def test_repeats_are_merged_in_sink(self):
+		sink = LogSink(1000, 100, 100, 'drop_new', autostart=False)
+		with mock.patch('wrtapp.logger.LOG_SINK', sink):
+			for i in range(3):
+				Logger('test').dev_error('Password hash mismatch', self.device)
+			Logger('test').dev_error('Invalid value by schema', self.device)
+			with self.assertNumQueries(2): #one insert and one counter update
+				self.assertEqual(sink.flush(), 2)
+			Logger('test').dev_error('Password hash mismatch', self.device)
+			sink.flush()
+		self.assertEqual(Log.objects.get(message='Password hash mismatch').count, 4)
+
+	def test_rate_limit(self):
+		limiter = RateLimiter(0.001, 2, 10)
+		self.assertTrue(limiter.allow('device:1'))
+		self.assertTrue(limiter.allow('device:1'))
+		self.assertFalse(limiter.allow('device:1'))
+		self.assertTrue(limiter.allow('device:2'))
+		self.assertEqual(limiter.suppressed, 1)
+
+	def test_sources_are_throttled_separately(self):
+		posts = [json.dumps(dict(checkin_data(mac), token='f' * 64)) for mac in ['A42B3C4D5E01', 'A42B3C4D5E02']]
+		#repeats merged per agent: both agents get their own rows
+		with mock.patch('wrtapp.logger.LIMITER', RateLimiter(0.001, 2, 10)):
+			for post in posts:
+				for i in range(5):
+					self.assertEqual(self.client.post('/wrtapp/provisioning', post, content_type='application/json').status_code, 403)
+		self.assertEqual([log.count for log in Log.objects.filter(message='Password hash mismatch')], [5, 5])
+		Log.objects.all().delete()
+		#no merging: one flooding agent uses up only its own budget
+		with mock.patch('wrtapp.logger.LIMITER', RateLimiter(0.001, 2, 10)), mock.patch('wrtapp.logger.DEDUPLICATOR', LogDeduplicator(0, 10)):
+			for post in posts:
+				for i in range(5):
+					self.client.post('/wrtapp/provisioning', post, content_type='application/json')
+		self.assertEqual(Log.objects.filter(message='Password hash mismatch').count(), 2)
+		self.assertEqual(Log.objects.filter(message='Invalid security token').count(), 2)
+
+class ConfigNotifierTestCase(TestCase):
+	def test_wake_from_other_thread(self):
+		notifier = ConfigNotifier('local')
+
+		async def wait():
+			waiter = notifier.subscribe(1)
+			threading.Timer(0.05, notifier.notify, [1]).start()
+			changed = await notifier.wait(waiter, 5)
+			notifier.unsubscribe(1, waiter)
+			return changed
+
+		async def timeout():
+			waiter = notifier.subscribe(1)
+			notifier.notify(2)
+			changed = await notifier.wait(waiter, 0.05)
+			notifier.unsubscribe(1, waiter)
+			return changed
+
+		self.assertTrue(asyncio.run(wait()))
+		self.assertFalse(asyncio.run(timeout()))
+		self.assertEqual(notifier.waiters, {})
+
+class RollupTestCase(TestCase):
+	def test_incremental_rollup(self):
+		device = Device.objects.create(mac='A42B3C4D5E6F')
+		now = datetime.datetime(2026, 10, 18, 12, 0, 30, tzinfo=datetime.timezone.utc)
+		start = now - datetime.timedelta(minutes=10)
+		for idx in range(10):
+			status = 'OFFLINE' if idx == 9 else 'OK'
+			StatisticsSample.objects.create(device=device, status=status, cpu_load=idx, memory_usage=50.0,
+				date=start + datetime.timedelta(seconds=idx * 20))
+
+		rollup.run_rollup(60, now)
+		minutes = StatisticsRollup.objects.filter(resolution=60).order_by('bucket')
+		self.assertEqual([bucket.samples for bucket in minutes], [2, 3, 3, 2])
+		self.assertEqual(minutes[0].cpu_max, 1.0)
+		self.assertEqual(minutes[3].offline, 1)
+
+		#only data after watermark is aggregated, already written buckets stay as they are
+		self.assertEqual(rollup.run_rollup(60, now), 0)
+
+		resolution, buckets = rollup.query_rollups(device, start, now, max_points=100)
+		self.assertEqual(resolution, 60)
+		self.assertEqual(buckets.count(), 4)
+		self.assertEqual(rollup.choose_resolution(start, start + datetime.timedelta(days=7), 500), 3600)
+
+class OfflineStatusTestCase(TestCase):
+	def setUp(self):
+		self.device = Device.objects.create(mac='A42B3C4D5E6F')
+		Statistics.objects.create(device=self.device, status='OK', cpu_load=1.0, memory_usage=2.0)
+		Statistics.objects.update(date=timezone.now() - datetime.timedelta(seconds=settings.OFFLINE_THRESHOLD + 10))
+
+	def test_dashboard_does_not_write(self):
+		User.objects.create_user('viewer', 'viewer@example.com', 'viewerpass')
+		self.client.login(username='viewer', password='viewerpass')
+		with CaptureQueriesContext(connection) as ctx:
+			response = self.client.get('/wrtapp/statistics/show')
+		self.assertContains(response, 'OFFLINE')
+		self.assertFalse([query for query in ctx.captured_queries if query['sql'].startswith('UPDATE "wrtapp_statistics"')])
+		self.assertEqual(Statistics.objects.get().status, 'OK')
+
+	def test_sweeper(self):
+		self.assertEqual(Statistics.objects.mark_offline(settings.OFFLINE_THRESHOLD), 1)
+		self.assertEqual(Statistics.objects.get().status, 'OFFLINE')
+		self.assertEqual(StatisticsSample.objects.get().status, 'OFFLINE')
+		self.assertEqual(Statistics.objects.mark_offline(settings.OFFLINE_THRESHOLD), 0)
+
+class PaginationTestCase(TestCase):
+	def setUp(self):
+		now = timezone.now()
+		for i in range(25):
+			log = Log.objects.create(severity='INFO', message='message {}'.format(i))
+			Log.objects.filter(id=log.id).update(date=now - datetime.timedelta(seconds=i // 2)) #pairs share date
+		self.expected = list(Log.objects.order_by('-date', '-id').values_list('id', flat=True))
+
+	def page(self, query):
+		return paginate(RequestFactory().get('/wrtapp/log/show?' + query), Log.objects.all(), ('-date', '-pk'))
+
+	def test_walk_forward_and_back(self):
+		seen = []
+		pages = []
+		query = 'size=10'
+		while query:
+			page = self.page(query)
+			pages.append([log.id for log in page])
+			seen.extend(pages[-1])
+			query = page.next_query
+		self.assertEqual(seen, self.expected)
+		self.assertEqual([len(ids) for ids in pages], [10, 10, 5])
+
+		self.assertIsNone(self.page('size=10').prev_query)
+		previous = self.page(page.prev_query)
+		self.assertEqual([log.id for log in previous], pages[1])
+
+	def test_constant_query_count(self):
+		page = self.page('size=10')
+		with self.assertNumQueries(1):
+			self.page(page.next_query)
+
+	def test_malformed_cursor_starts_over(self):
+		self.assertEqual([log.id for log in self.page('after=garbage')], self.expected[:100])
+
+class SearchTestCase(TestCase):
+	def setUp(self):
+		self.device = Device.objects.create(mac='A4:2B:3C:4D:5E:6F', model='TL-WR841N', name='office', description='second floor')
+		self.other = Device.objects.create(mac='001122334455', model='Archer C6', name='lab', description='')
+		Log.objects.create(device=self.device, severity='WARNING', message='Registered new device')
+		Log.objects.create(device=self.other, severity='ERROR', message='Invalid provisioning data')
+
+	def search(self, queryset, text):
+		return list(ranked(queryset, text))
+
+	def test_vectors_are_maintained_by_triggers(self):
+		self.assertEqual(self.search(Device.objects.all(), 'a42b'), [self.device])
+		self.device.name = 'warehouse'
+		self.device.save()
+		self.assertEqual(self.search(Device.objects.all(), 'wareh'), [self.device])
+		self.assertEqual(self.search(Device.objects.all(), 'office'), [])
+
+	def test_log_search_includes_device_mac(self):
+		logs = self.search(Log.objects.all(), 'regist a42b3c')
+		self.assertEqual([log.message for log in logs], ['Registered new device'])
+		self.assertEqual(self.search(Log.objects.all(), 'invalid A4:2B'), [])
+
+	def test_empty_query(self):
+		self.assertEqual(self.search(Device.objects.all(), '&|!'), [])
+
+	def test_search_view_pages(self):
+		User.objects.create_user('viewer', 'viewer@example.com', 'viewerpass')
+		self.client.login(username='viewer', password='viewerpass')
+		for i in range(5):
+			Log.objects.create(device=self.device, severity='WARNING', message='Config changed {}'.format(i))
+		response = self.client.get('/wrtapp/log/search', {'search': 'config', 'size': 2})
+		self.assertContains(response, 'Config changed', count=2)
+		self.assertContains(response, 'search=config')
+
+class SubstringSearchTestCase(TestCase):
+	def setUp(self):
+		self.device = Device.objects.create(mac='A4:2B:3C:4D:5E:6F')
+		Configuration.objects.create(device=self.device, hostname='edge-router', ip='10.3.12.1', netmask='255.255.255.0',
+			gateway='10.3.12.254', dns1='8.8.8.8', dns2='8.8.4.4')
+		Statistics.objects.create(device=self.device, status='OK', cpu_load=12.5, memory_usage=40.1)
+
+	def test_ilike(self):
+		self.assertTrue(Device.objects.filter(mac__ilike='5e6f').exists())
+		self.assertTrue(Configuration.objects.filter(ip__ilike='.3.12').exists())
+		self.assertFalse(Configuration.objects.filter(ip__ilike='/24').exists()) #host() drops netmask
+		self.assertFalse(Device.objects.filter(mac__ilike='%').exists()) #wildcards are escaped
+
+	def stats(self, text):
+		return Statistics.objects.with_current_status(settings.OFFLINE_THRESHOLD).filter(stats_q(text)).count()
+
+	def test_stats_ranges(self):
+		self.assertEqual(self.stats('5E:6F cpu>10 memory<=40.1'), 1)
+		self.assertEqual(self.stats('cpu>=13'), 0)
+		self.assertEqual(self.stats('12'), 1)
+		self.assertEqual(self.stats('12.6'), 0)
+		self.assertEqual(self.stats('ok'), 1)
+
+	def test_config_search_view(self):
+		User.objects.create_user('viewer', 'viewer@example.com', 'viewerpass')
+		self.client.login(username='viewer', password='viewerpass')
+		self.assertContains(self.client.get('/wrtapp/configuration/search', {'search': '3.12.25'}), 'edge-router')
+		self.assertContains(self.client.get('/wrtapp/configuration/search', {'search': '4D:5E'}), 'edge-router')
+		self.assertNotContains(self.client.get('/wrtapp/configuration/search', {'search': '192.168'}), 'edge-router')
+
+class LogPartitionTestCase(TestCase):
+	def test_rows_go_to_daily_partitions(self):
+		future = timezone.now() + datetime.timedelta(days=3)
+		Log.objects.create(severity='ERROR', message='future', date=future)
+		Log.objects.create(severity='ERROR', message='past', date=timezone.now() - datetime.timedelta(days=400))
+		with connection.cursor() as cursor:
+			cursor.execute('SELECT message, tableoid::regclass::text FROM wrtapp_log')
+			rows = dict(cursor.fetchall())
+		self.assertEqual(rows['future'], partitions.partition_name('wrtapp_log', future.date()))
+		self.assertEqual(rows['past'], 'wrtapp_log_legacy') #table from before partitioning holds everything older
+		self.assertIn(('wrtapp_log', settings.LOG_RETENTION), partitions.partitioned_tables())
+
+	def test_deleteall_truncates(self):
+		User.objects.create_superuser('admin', 'admin@example.com', 'adminpass')
+		self.client.login(username='admin', password='adminpass')
+		Log.objects.create(severity='ERROR', message='message')
+		with CaptureQueriesContext(connection) as ctx:
+			self.client.get('/wrtapp/log/deleteall')
+		self.assertFalse(Log.objects.exists())
+		self.assertTrue([query for query in ctx.captured_queries if query['sql'].startswith('TRUNCATE')])
+
+@override_settings(SQL_PROFILE_ENABLED=True, SQL_PROFILE_SAMPLE_RATE=1.0, SQL_PROFILE_DUPLICATE_THRESHOLD=3)
+class SQLProfileTestCase(TestCase):
+	def test_summary_and_duplicates(self):
+		User.objects.create_user('viewer', 'viewer@example.com', 'viewerpass')
+		self.client.login(username='viewer', password='viewerpass')
+		with self.assertLogs('wrtapp.sqlprofile', 'INFO') as logs:
+			self.client.get('/wrtapp/device/show')
+		summary = json.loads(logs.records[-1].getMessage().split(' ', 2)[2])
+		self.assertEqual(summary['path'], '/wrtapp/device/show')
+		self.assertEqual(summary['status'], 200)
+		self.assertGreater(summary['queries'], 0)
+		self.assertEqual(summary['duplicates'], [])
+
+		profile = sqlprofile.Profile('/test')
+		token = sqlprofile.PROFILE.set(profile)
+		try:
+			for device in Device.objects.bulk_create([Device(mac='A42B3C4D5E{:02X}'.format(i)) for i in range(3)]):
+				list(Log.objects.filter(device=device))
+		finally:
+			sqlprofile.PROFILE.reset(token)
+		summary = profile.summary(200)
+		self.assertEqual(summary['duplicates'][0]['count'], 3)
+		self.assertIn('duplicates', summary['flags'])
+
+class MetricsTestCase(TestCase):
+	def test_checkin_metrics(self):
+		self.client.post('/wrtapp/provisioning', json.dumps(checkin_data()), content_type='application/json')
+		self.client.post('/wrtapp/provisioning', 'not json', content_type='application/json')
+		response = self.client.get('/wrtapp/metrics')
+		self.assertEqual(response.status_code, 200)
+		text = response.content.decode()
+		self.assertRegex(text, r'wrtapp_checkins_total\{outcome="ok"\} [1-9]')
+		self.assertRegex(text, r'wrtapp_checkins_total\{outcome="invalid"\} [1-9]')
+		for stage in ['parse', 'validate', 'auth', 'lookup', 'register', 'stats', 'config', 'serialize']:
+			self.assertIn('wrtapp_checkin_stage_seconds_count{{stage="{}"}}'.format(stage), text)
+		self.assertIn('wrtapp_checkin_queries_bucket{le="+Inf"}', text)
+		self.assertIn('wrtapp_devices{state="active"} 1', text)
+
+	@override_settings(METRICS_ALLOWED_IPS=['10.0.0.1'])
+	def test_address_allow_list(self):
+		self.assertEqual(self.client.get('/wrtapp/metrics').status_code, 403)
+
+	def test_processes_are_summed(self):
+		with tempfile.TemporaryDirectory() as directory:
+			worker = metrics.Registry(directory, 0)
+			counter = metrics.Counter(worker, 'test_total', 'Test.', ('outcome',))
+			histogram = metrics.Histogram(worker, 'test_seconds', 'Test.', buckets=[0.1, 1.0])
+			counter.inc(outcome='ok')
+			histogram.observe(0.5)
+			worker.dump()
+
+			scraper = metrics.Registry(directory, 0)
+			counter = metrics.Counter(scraper, 'test_total', 'Test.', ('outcome',))
+			histogram = metrics.Histogram(scraper, 'test_seconds', 'Test.', buckets=[0.1, 1.0])
+			counter.inc(2, outcome='ok')
+			histogram.observe(5.0)
+			lines = scraper.render().splitlines()
+		self.assertIn('test_total{outcome="ok"} 3', lines)
+		self.assertIn('test_seconds_bucket{le="1.0"} 1', lines)
+		self.assertIn('test_seconds_bucket{le="+Inf"} 2', lines)
+		self.assertIn('test_seconds_count 2', lines)
+
+	def test_files_of_exited_processes_are_removed(self):
+		process = subprocess.Popen([sys.executable, '-c', ''])
+		process.wait()
+		with tempfile.TemporaryDirectory() as directory:
+			dead = os.path.join(directory, 'metrics-{}-0.json'.format(process.pid))
+			with open(dead, 'w') as fp:
+				json.dump({'test_total': {'["ok"]': 5}}, fp)
+			registry = metrics.Registry(directory, 0)
+			counter = metrics.Counter(registry, 'test_total', 'Test.', ('outcome',))
+			counter.inc(outcome='ok')
+			self.assertIn('test_total{outcome="ok"} 1', registry.render().splitlines())
+			self.assertFalse(os.path.exists(dead))
+
+class BenchmarkTestCase(TestCase):
+	def test_cases_and_compare(self):
+		benchmark.seed(20)
+		self.assertEqual(Device.objects.count(), 20)
+		bench = benchmark.Benchmark(20, 2, 1, 1)
+		results = bench.run(['process steady', 'process new', 'log search'])
+		self.assertEqual([result['case'] for result in results], ['process steady', 'process new', 'log search'])
+		for result in results:
+			self.assertGreater(result['wall_ms']['median'], 0)
+			self.assertGreater(result['queries'], 0)
+			self.assertGreater(result['alloc_kb']['peak'], 0)
+		#every warmup, timing and allocation call of 'process new' registers one device
+		self.assertEqual(Device.objects.count(), bench.size + bench.warmup + bench.iterations + bench.alloc_iterations)
+
+		baseline = [dict(result, wall_ms=dict(result['wall_ms'], median=result['wall_ms']['median'] / 2)) for result in results]
+		rows = benchmark.compare(results, baseline, 10.0)
+		self.assertEqual(len(rows), 3)
+		self.assertTrue(all(row[5] for row in rows))
+
+class BulkDeviceTestCase(TestCase):
+	def import_text(self, text, fmt, update=False):
+		return bulk.import_devices(io.BytesIO(text.encode('utf8')), fmt, update)
+
+	def test_import_validates_and_merges(self):
+		result = self.import_text('mac,model,name,hostname,ip,netmask,gateway,dns1,dns2\n'
+			'a4:2b:3c:4d:5e:01,TL-WR841N,office,router1,192.168.1.1,255.255.255.0,192.168.1.254,8.8.8.8,8.8.4.4\n'
+			'A42B3C4D5E02,TL-WR841N,,,,,,,\n'
+			'A42B3C4D5E03,TL-WR841N,,router3,999.1.1.1,255.255.255.0,192.168.1.254,8.8.8.8,8.8.4.4\n'
+			'A4-2B-3C-4D-5E-01,TL-WR841N,,,,,,,\n', 'csv')
+		self.assertEqual((result['rows'], result['created'], result['configs'], result['invalid']), (4, 2, 1, 2))
+		self.assertEqual([(error['line'], error['error']) for error in result['errors']], [(4, 'invalid ip'), (5, 'duplicate mac')])
+		config = Configuration.objects.get(device__mac='A42B3C4D5E01')
+		self.assertEqual(config.config_hash, config.compute_hash())
+		self.assertFalse(Configuration.objects.filter(device__mac='A42B3C4D5E02').exists())
+
+		line = json.dumps({'mac': 'A42B3C4D5E01', 'model': 'TL-WR841N', 'hostname': 'renamed', 'ip': '192.168.1.1',
+			'netmask': '255.255.255.0', 'gateway': '192.168.1.254', 'dns1': '8.8.8.8', 'dns2': '8.8.4.4'})
+		result = self.import_text(line + '\n', 'jsonl')
+		self.assertEqual((result['created'], result['configs']), (0, 0)) #existing devices are kept without update
+		result = self.import_text(line + '\n', 'jsonl', update=True)
+		self.assertEqual((result['updated'], result['configs']), (1, 1))
+		config = Configuration.objects.get(device__mac='A42B3C4D5E01')
+		self.assertEqual(config.hostname, 'renamed')
+		self.assertEqual(config.config_hash, config.compute_hash())
+
+	def test_export_can_be_imported(self):
+		self.import_text('mac,model,hostname,ip,netmask,gateway,dns1,dns2\n'
+			'A42B3C4D5E01,TL-WR841N,router1,192.168.1.1,255.255.255.0,192.168.1.254,8.8.8.8,8.8.4.4\n', 'csv')
+		User.objects.create_user('viewer', 'viewer@example.com', 'viewerpass')
+		self.client.login(username='viewer', password='viewerpass')
+		response = self.client.get('/wrtapp/device/export?format=csv')
+		text = b''.join(response.streaming_content).decode('utf8')
+		self.assertEqual(text.splitlines()[1], 'A42B3C4D5E01,TL-WR841N,Generic device,Imported,router1,192.168.1.1,255.255.255.0,192.168.1.254,8.8.8.8,8.8.4.4')
+		result = self.import_text(text, 'csv', update=True)
+		self.assertEqual((result['rows'], result['invalid'], result['updated'], result['configs']), (1, 0, 0, 0))
+
+@override_settings(EXPORT_CHUNK_SIZE=2)
+class ExportTestCase(TestCase):
+	def setUp(self):
+		User.objects.create_user('viewer', 'viewer@example.com', 'viewerpass')
+		self.client.login(username='viewer', password='viewerpass')
+		self.devices = Device.objects.bulk_create([Device(mac='A42B3C4D5E{:02X}'.format(i), model='TL-WR841N') for i in range(2)])
+		self.day = timezone.now().replace(hour=12, minute=0, second=0, microsecond=0) - datetime.timedelta(days=3)
+		StatisticsSample.objects.bulk_create([StatisticsSample(device=self.devices[i % 2], status='OK', cpu_load=i, memory_usage=i,
+			date=self.day + datetime.timedelta(days=i // 2)) for i in range(5)]) #days 0, 0, 1, 1, 2
+		Log.objects.bulk_create([Log(device=self.devices[0], severity='ERROR', message='log {}'.format(i),
+			date=self.day + datetime.timedelta(hours=i)) for i in range(5)])
+
+	def export(self, path):
+		response = self.client.get(path)
+		self.assertEqual(response.status_code, 200)
+		return b''.join(response.streaming_content)
+
+	def test_chunks_and_filters(self):
+		lines = self.export('/wrtapp/statistics/export').decode('utf8').splitlines()
+		self.assertEqual(lines[0], 'date,device_id,mac,status,cpu_load,memory_usage')
+		self.assertEqual([line.split(',')[4] for line in lines[1:]], ['0.0', '1.0', '2.0', '3.0', '4.0']) #all chunks in order
+
+		day = self.day.date()
+		lines = self.export('/wrtapp/statistics/export?from={}&to={}&device=a4:2b:3c:4d:5e:00'.format(day, day + datetime.timedelta(days=1)))
+		self.assertEqual([line.split(',')[4] for line in lines.decode('utf8').splitlines()[1:]], ['0.0', '2.0'])
+
+		lines = gzip.decompress(self.export('/wrtapp/log/export?format=jsonl&gzip=1')).decode('utf8').splitlines()
+		self.assertEqual([json.loads(line)['message'] for line in lines], ['log {}'.format(i) for i in range(5)])
+		self.assertEqual(json.loads(lines[0])['mac'], 'A42B3C4D5E00')
+		self.assertEqual(len(self.export('/wrtapp/log/export?format=jsonl&gzip=0').decode('utf8').splitlines()), 5)
 
-# Create your tests here.
+	def test_invalid_filter(self):
+		self.assertEqual(self.client.get('/wrtapp/log/export?from=yesterday').status_code, 400)
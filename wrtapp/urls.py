@@ -15,6 +15,8 @@ urlpatterns = [ #url patterns specific to wrtapp django application
 	path('device/update/<int:id>', views.deviceView.update),
 	path('device/delete/<int:id>', views.deviceView.delete),
 	path('device/deleteall', views.deviceView.deleteall),
+	path('device/import', views.deviceView.importfile),
+	path('device/export', views.deviceView.export),
 	# Configuration
 	path('configuration/show', views.configView.show),
 	path('configuration/search', views.configView.search),
@@ -25,6 +27,7 @@ urlpatterns = [ #url patterns specific to wrtapp django application
 	path('statistics/search', views.statsView.search),
 	path('statistics/delete/<int:id>', views.statsView.delete),
 	path('statistics/deleteall', views.statsView.deleteall),
+	path('statistics/export', views.statsView.export),
 	# User
 	path('user/show', views.userView.show),
 	path('user/search', views.userView.search),
@@ -37,6 +40,7 @@ urlpatterns = [ #url patterns specific to wrtapp django application
 	path('log/search', views.logView.search),
 	path('log/delete/<int:id>', views.logView.delete),
 	path('log/deleteall', views.logView.deleteall),
+	path('log/export', views.logView.export),
 	# Tools
 	path('tools/show', views.toolsView.refresh),
 	path('tools/refresh', views.toolsView.refresh),
@@ -46,6 +50,11 @@ urlpatterns = [ #url patterns specific to wrtapp django application
 	path('contact/show', views.contactView.show),
 	# Provision
 	path('provisioning', csrf_exempt(provision.ops.process)),
+	path('provisioning/batch', csrf_exempt(provision.ops.process_batch)),
+	path('provisioning/async', provision.async_ops.process), #csrf exempt, see AsyncProvisionOperations
+	path('provisioning/wait', provision.async_ops.wait),
+	# Metrics
+	path('metrics', views.metricsView.show),
 	# Errors
 	path('errors/notfound', views.errorsView.notfound),
 	path('errors/forbidden', views.errorsView.forbidden),
@@ -1,5 +1,3 @@
-import datetime
-
 from django.shortcuts import render
 from django.shortcuts import redirect
 
@@ -7,36 +5,52 @@ from django.contrib.auth import login, authenticate, logout
 from django.contrib.auth.models import User
 from django.contrib.auth.forms import AuthenticationForm
 
-from django.contrib.postgres.search import SearchVector, SearchQuery
-
 from django import forms
 
 from wrtapp.forms import DeviceForm
 from wrtapp.forms import ConfigurationForm
-from wrtapp.forms import UserCreateForm, UserUpdateForm, SearchForm
+from wrtapp.forms import UserCreateForm, UserUpdateForm, SearchForm, DeviceImportForm
 
 from wrtapp.models import Device
 from wrtapp.models import Configuration
 from wrtapp.models import Statistics
 from wrtapp.models import Log
+from wrtapp.models import StatisticsSample
 
+from django.http import HttpResponse
 from django.http import HttpResponseForbidden
+from django.http import HttpResponseBadRequest
+from django.conf import settings
 
 # Built-in DB module, which uses DB connector to manage DB and provides an API to it.
 from django.db import connection, transaction
-from django.db import reset_queries
-from django.db.models import Q
+from django.db.models import Q, F, OuterRef, Subquery
 
 from wrtapp.logger import Logger
+from wrtapp.pagination import paginate
+from wrtapp.search import ranked, substring_q, mac_q, stats_q
+from wrtapp.metrics import REGISTRY
+from wrtapp.export import export_response, export_filter, keyset_rows
+from wrtapp import bulk
 
 LOGGER = Logger(__name__)
-OFFLINE_THRESHOLD = 60 # Seconds. # if device does not respond in 60 s marked as offline
 
-# Dump SQL queries to console
-def log_sql_query():
-	for query in connection.queries:
-		LOGGER.debug("SQL: {}".format(query['sql']))
-		reset_queries()
+#stable orderings of dashboard tables used for keyset pagination, see pagination.py
+DEVICE_ORDERING = ('pk',)
+CONFIG_ORDERING = ('pk',)
+STATS_ORDERING = ('-date', '-pk')
+USER_ORDERING = ('pk',)
+LOG_ORDERING = ('-date', '-pk')
+DEVICE_SEARCH_ORDERING = ('-rank', '-pk')
+CONFIG_SEARCH_ORDERING = ('-rank', '-pk')
+LOG_SEARCH_ORDERING = ('-rank', '-date', '-pk')
+
+#orderings and columns of streamed exports, see export.py. Stats history is read in id order, which
+#follows arrival time and uses primary key index of every partition
+SAMPLE_EXPORT_ORDERING = ('pk',)
+SAMPLE_EXPORT_COLUMNS = ['date', 'device_id', 'mac', 'status', 'cpu_load', 'memory_usage']
+LOG_EXPORT_ORDERING = ('date', 'pk')
+LOG_EXPORT_COLUMNS = ['date', 'severity', 'message', 'count', 'last_seen', 'mac', 'username']
 
 #all classes bellow represent specific wrtapp backend module and implements handlers for every url pattern defined in urls.py
 
@@ -54,7 +68,6 @@ class LoginView:
 				if user:
 					login(request, user)
 					LOGGER.user_warning('Logged in', user)
-					log_sql_query()
 					return redirect('/wrtapp/statistics/show')
 				else:
 					failed = True
@@ -64,7 +77,6 @@ class LoginView:
 				failed = True
 
 		form = AuthenticationForm()
-		log_sql_query()
 		return render(request, 'login.html', {'form': form, "failed": failed}) #render is the main method which binds html template with data model. 
 		#the last argument to this function is py dict which can be accessed in the template using django template scripting language 
 
@@ -93,7 +105,6 @@ class DeviceView:
 			if form.is_valid():
 				try:
 					form.save() #save method saves form data to the db via model class
-					log_sql_query()
 					return redirect('/wrtapp/device/show')
 				except:
 					LOGGER.error('Failed to save device form')
@@ -101,45 +112,37 @@ class DeviceView:
 				LOGGER.error('Invalid device form: {}'.format(str(form.errors)))
 		else:
 			form = DeviceForm()
-		log_sql_query()
 		return render(request, 'device/create.html', {'form': form, 'is_administrator': request.user.is_superuser, 'current_user': request.user.username})
 
 	def show(self, request):
 		if not request.user.is_authenticated:
 			return redirect('/wrtapp/login')
 
-		devices = Device.objects.all()
-		log_sql_query()
+		devices = paginate(request, Device.objects.all(), DEVICE_ORDERING)
 		return render(request, 'device/index.html', {'devices': devices, 'is_administrator': request.user.is_superuser, 'current_user': request.user.username})
 
-	# Search using built-in postgres search feature
+	# Search using built-in postgres full text search, see search.py
 	def search(self, request):
 		if not request.user.is_authenticated:
 			return redirect('/wrtapp/login')
 
-		if request.method == 'POST':
-			form = SearchForm(request.POST)
+		if request.method == 'POST' or 'search' in request.GET: #page links of search results are GET requests
+			form = SearchForm(request.POST or request.GET)
 			if form.is_valid():
 				try:
 					searchstr = form.cleaned_data.get('search')
-					devices = Device.objects.filter(Q(mac__icontains=searchstr) |
-						Q(model__icontains=searchstr) |
-						Q(name__icontains=searchstr) |
-						Q(description__icontains=searchstr))
+					devices = paginate(request, ranked(Device.objects.all(), searchstr, condition=mac_q(searchstr)),
+						DEVICE_SEARCH_ORDERING, {'search': searchstr})
 
-					log_sql_query()
 					return render(request, 'device/index.html', {'devices': devices, 'is_administrator': request.user.is_superuser, 'current_user': request.user.username})
 				except:
 					LOGGER.error('Failed to search')
-					log_sql_query()
 					return redirect('/wrtapp/device/show')
 			else:
 				LOGGER.error('Invalid search form: {}'.format(str(form.errors)))
-				log_sql_query()
 				return redirect('/wrtapp/device/show')
 		else:
-			LOGGER.error('Search attempt with not a POST')
-			log_sql_query()
+			LOGGER.error('Search attempt without search string')
 			return redirect('/wrtapp/device/show')
 
 	def edit(self, request, id):
@@ -147,7 +150,6 @@ class DeviceView:
 			return redirect('/wrtapp/login')
 
 		device = Device.objects.get(id=id)
-		log_sql_query()
 		return render(request, 'device/edit.html', {'device': device, 'is_administrator': request.user.is_superuser, 'current_user': request.user.username})
 
 	def update(self, request, id):
@@ -159,13 +161,11 @@ class DeviceView:
 		if form.is_valid():
 			try:
 				form.save()
-				log_sql_query()
 				return redirect('/wrtapp/device/show')
 			except:
 				LOGGER.error('Failed to save device form')
 		else:
 			LOGGER.error('Invalid device form: {}'.format(str(form.errors)))
-		log_sql_query()
 		return render(request, 'device/edit.html', {'device': device, 'is_administrator': request.user.is_superuser, 'current_user': request.user.username})
 
 	def delete(self, request, id):
@@ -178,7 +178,6 @@ class DeviceView:
 		device = Device.objects.get(id=id)
 		try:
 			device.delete()
-			log_sql_query()
 			return redirect('/wrtapp/device/show')
 		except:
 			LOGGER.error('Failed to delete device')
@@ -194,48 +193,70 @@ class DeviceView:
 			Device.objects.all().delete()
 		except:
 			LOGGER.error('Failed to delete all devices')
-		log_sql_query()
 		return redirect('/wrtapp/device/show')
 
+	# Bulk import of devices with configs from csv or jsonl file, see bulk.py
+	def importfile(self, request):
+		if not request.user.is_authenticated:
+			return redirect('/wrtapp/login')
+
+		if not request.user.is_superuser:
+			return redirect('/wrtapp/errors/forbidden')
+
+		result = None
+		failed = False
+		if request.method == 'POST':
+			form = DeviceImportForm(request.POST, request.FILES)
+			if form.is_valid():
+				try:
+					result = bulk.import_devices(form.cleaned_data['file'], form.cleaned_data['format'], form.cleaned_data['update'])
+					LOGGER.user_warning('Imported devices: {} rows, {} created, {} updated, {} invalid', request.user,
+						result['rows'], result['created'], result['updated'], result['invalid'])
+				except:
+					LOGGER.user_error('Failed to import devices', request.user)
+					failed = True
+			else:
+				LOGGER.error('Invalid device import form: {}'.format(str(form.errors)))
+		else:
+			form = DeviceImportForm()
+		return render(request, 'device/import.html', {'form': form, 'result': result, 'failed': failed, 'is_administrator': request.user.is_superuser, 'current_user': request.user.username})
+
+	def export(self, request):
+		if not request.user.is_authenticated:
+			return redirect('/wrtapp/login')
+
+		return export_response(request, bulk.export_rows(), bulk.DEVICE_COLUMNS, 'devices')
+
 class ConfigurationView:
 	def show(self, request):
 		if not request.user.is_authenticated:
 			return redirect('/wrtapp/login')
 
-		configs = Configuration.objects.all()
-		log_sql_query()
+		configs = paginate(request, Configuration.objects.select_related('device'), CONFIG_ORDERING)
 		return render(request, 'config/index.html', {'configs': configs, 'is_administrator': request.user.is_superuser, 'current_user': request.user.username})
 
 	def search(self, request):
 		if not request.user.is_authenticated:
 			return redirect('/wrtapp/login')
 
-		if request.method == 'POST':
-			form = SearchForm(request.POST)
+		if request.method == 'POST' or 'search' in request.GET: #page links of search results are GET requests
+			form = SearchForm(request.POST or request.GET)
 			if form.is_valid():
 				try:
 					searchstr = form.cleaned_data.get('search')
-					configs = Configuration.objects.filter(Q(device__mac__icontains=searchstr) |
-						Q(hostname__icontains=searchstr) |
-						Q(ip__icontains=searchstr) |
-						Q(netmask__icontains=searchstr) |
-						Q(gateway__icontains=searchstr) |
-						Q(dns1__icontains=searchstr) |
-						Q(dns2__icontains=searchstr))
-
-					log_sql_query()
+					configs = paginate(request, ranked(Configuration.objects.select_related('device'), searchstr, ('search', 'device__search'),
+						substring_q(searchstr.strip(), ['hostname', 'ip', 'gateway', 'dns1', 'dns2']) | mac_q(searchstr, 'device__mac')),
+						CONFIG_SEARCH_ORDERING, {'search': searchstr})
+
 					return render(request, 'config/index.html', {'configs': configs, 'is_administrator': request.user.is_superuser, 'current_user': request.user.username})
 				except:
 					LOGGER.error('Failed to search')
-					log_sql_query()
 					return redirect('/wrtapp/configuration/show')
 			else:
 				LOGGER.error('Invalid search form: {}'.format(str(form.errors)))
-				log_sql_query()
 				return redirect('/wrtapp/configuration/show')
 		else:
-			LOGGER.error('Search attempt with not a POST')
-			log_sql_query()
+			LOGGER.error('Search attempt without search string')
 			return redirect('/wrtapp/configuration/show')
 
 	def edit(self, request, id):
@@ -243,7 +264,6 @@ class ConfigurationView:
 			return redirect('/wrtapp/login')
 
 		config = Configuration.objects.get(device_id=id)
-		log_sql_query()
 		return render(request, 'config/edit.html', {'config': config, 'is_administrator': request.user.is_superuser, 'current_user': request.user.username})
 
 	def update(self, request, id):
@@ -255,60 +275,42 @@ class ConfigurationView:
 		if form.is_valid():
 			try:
 				form.save()
-				log_sql_query()
 				return redirect('/wrtapp/configuration/show')
 			except:
 				LOGGER.error('Failed to save config form')
 		else:
 			LOGGER.error('Invalid config form: {}'.format(str(form.errors)))
-		log_sql_query()
 		return render(request, 'config/edit.html', {'config': config, 'is_administrator': request.user.is_superuser, 'current_user': request.user.username})
 
-def check_status(stat):
-	now = datetime.datetime.now(stat.date.tzinfo)
-	diff = now - stat.date
-	if diff.total_seconds() > OFFLINE_THRESHOLD:
-		stat.status = 'OFFLINE'
-		stat.save()
-
 class StatisticsView:
 	def show(self, request):
 		if not request.user.is_authenticated:
 			return redirect('/wrtapp/login')
 
-		stats = Statistics.objects.all()
-		for stat in stats:
-			check_status(stat)
-		log_sql_query()
+		stats = paginate(request, Statistics.objects.with_current_status(settings.OFFLINE_THRESHOLD).select_related('device'), STATS_ORDERING)
 		return render(request, 'stats/index.html', {'stats': stats, 'is_administrator': request.user.is_superuser, 'current_user': request.user.username})
 
 	def search(self, request):
 		if not request.user.is_authenticated:
 			return redirect('/wrtapp/login')
 
-		if request.method == 'POST':
-			form = SearchForm(request.POST)
+		if request.method == 'POST' or 'search' in request.GET: #page links of search results are GET requests
+			form = SearchForm(request.POST or request.GET)
 			if form.is_valid():
 				try:
 					searchstr = form.cleaned_data.get('search')
-					stats = Statistics.objects.filter(Q(device__mac__icontains=searchstr) |
-						Q(status__icontains=searchstr) |
-						Q(cpu_load__icontains=searchstr) |
-						Q(memory_usage__icontains=searchstr))
+					stats = paginate(request, Statistics.objects.with_current_status(settings.OFFLINE_THRESHOLD).select_related('device').filter(
+						stats_q(searchstr)), STATS_ORDERING, {'search': searchstr}) #e.g. 'A4:2B cpu>50'
 
-					log_sql_query()
 					return render(request, 'stats/index.html', {'stats': stats, 'is_administrator': request.user.is_superuser, 'current_user': request.user.username})
 				except:
 					LOGGER.error('Failed to search')
-					log_sql_query()
 					return redirect('/wrtapp/statistics/show')
 			else:
 				LOGGER.error('Invalid search form: {}'.format(str(form.errors)))
-				log_sql_query()
 				return redirect('/wrtapp/statistics/show')
 		else:
-			LOGGER.error('Search attempt with not a POST')
-			log_sql_query()
+			LOGGER.error('Search attempt without search string')
 			return redirect('/wrtapp/statistics/show')
 
 	def delete(self, request, id):
@@ -321,7 +323,6 @@ class StatisticsView:
 		stat = Statistics.objects.get(device_id=id)
 		try:
 			stat.delete()
-			log_sql_query()
 			return redirect('/wrtapp/statistics/show')
 		except:
 			LOGGER.error('Failed to delete stats')
@@ -337,9 +338,22 @@ class StatisticsView:
 			Statistics.objects.all().delete()
 		except:
 			LOGGER.error('Failed to delete all statistics')
-		log_sql_query()
 		return redirect('/wrtapp/statistics/show')
 
+	# Streamed export of stats history, e.g. ?from=2024-05-01&to=2024-05-07&device=A42B3C4D5E6F&format=jsonl&gzip=1
+	def export(self, request):
+		if not request.user.is_authenticated:
+			return redirect('/wrtapp/login')
+
+		try:
+			condition = export_filter(request)
+		except ValueError:
+			LOGGER.error('Invalid export filter')
+			return HttpResponseBadRequest()
+		#mac by subquery, history has no db foreign key and keeps rows of deleted devices
+		samples = StatisticsSample.objects.filter(condition).annotate(mac=Subquery(Device.objects.filter(pk=OuterRef('device_id')).values('mac')))
+		return export_response(request, keyset_rows(samples, SAMPLE_EXPORT_ORDERING, SAMPLE_EXPORT_COLUMNS), SAMPLE_EXPORT_COLUMNS, 'statistics')
+
 class UserView:
 	def create(self, request):
 		if not request.user.is_authenticated:
@@ -359,7 +373,6 @@ class UserView:
 					)
 					user.is_superuser = form.cleaned_data['is_superuser']
 					user.save()
-					log_sql_query()
 					return redirect('/wrtapp/user/show')
 				except:
 					LOGGER.error('Failed to save user form')
@@ -368,40 +381,35 @@ class UserView:
 		else:
 			form = UserCreateForm()
 		# Show form again if NOT OK
-		log_sql_query()
 		return render(request, 'user/create.html', {'form': form, 'is_administrator': request.user.is_superuser, 'current_user': request.user.username})
 
 	def show(self, request):
 		if not request.user.is_authenticated:
 			return redirect('/wrtapp/login')
 
-		users = User.objects.all()
-		log_sql_query()
+		users = paginate(request, User.objects.all(), USER_ORDERING)
 		return render(request, 'user/index.html', {'users': users, 'is_administrator': request.user.is_superuser, 'current_user': request.user.username})
 
 	def search(self, request):
 		if not request.user.is_authenticated:
 			return redirect('/wrtapp/login')
 
-		if request.method == 'POST':
-			form = SearchForm(request.POST)
+		if request.method == 'POST' or 'search' in request.GET: #page links of search results are GET requests
+			form = SearchForm(request.POST or request.GET)
 			if form.is_valid():
 				try:
 					searchstr = form.cleaned_data.get('search')
-					users = User.objects.filter(Q(username__icontains=searchstr) | Q(email__icontains=searchstr))
-					log_sql_query()
+					users = paginate(request, User.objects.filter(Q(username__icontains=searchstr) | Q(email__icontains=searchstr)),
+						USER_ORDERING, {'search': searchstr})
 					return render(request, 'user/index.html', {'users': users, 'is_administrator': request.user.is_superuser, 'current_user': request.user.username})
 				except:
 					LOGGER.error('Failed to search')
-					log_sql_query()
 					return redirect('/wrtapp/user/show')
 			else:
 				LOGGER.error('Invalid search form: {}'.format(str(form.errors)))
-				log_sql_query()
 				return redirect('/wrtapp/user/show')
 		else:
-			LOGGER.error('Search attempt with not a POST')
-			log_sql_query()
+			LOGGER.error('Search attempt without search string')
 			return redirect('/wrtapp/user/show')
 
 	def edit(self, request, id):
@@ -420,7 +428,6 @@ class UserView:
 		}
 		form = UserUpdateForm()
 		form.update(userData)
-		log_sql_query()
 		return render(request, 'user/edit.html', {'form': form, 'userId': user.id, 'is_administrator': request.user.is_superuser, 'current_user': request.user.username})
 
 	def update(self, request, id):
@@ -442,10 +449,9 @@ class UserView:
 						try:
 							user.set_password(form.cleaned_data['newpassword'])
 						except:
-							LOGGER.error('Invalid password format', user)
+							LOGGER.user_error('Invalid password format', user)
 						LOGGER.user_warning('Changed password', user)
 					user.save()
-					log_sql_query()
 					return redirect('/wrtapp/user/show')
 				except:
 					LOGGER.error('Failed to save user form')
@@ -453,7 +459,6 @@ class UserView:
 				LOGGER.error('Invalid user form: {}'.format(str(form.errors)))
 		else:
 			form = UserUpdateForm()
-		log_sql_query()
 		return render(request, 'user/edit.html', {'form': form, 'is_administrator': request.user.is_superuser, 'current_user': request.user.username})
 
 	def delete(self, request, id):
@@ -466,11 +471,9 @@ class UserView:
 		user = User.objects.get(id=id)
 		if user.username == 'admin':
 			LOGGER.error('Cannot delete built-in admin user')
-			log_sql_query()
 			return redirect('/wrtapp/user/show')
 		try:
 			user.delete()
-			log_sql_query()
 			return redirect('/wrtapp/user/show')
 		except:
 			LOGGER.error('Failed to delete user')
@@ -480,37 +483,30 @@ class LogView:
 		if not request.user.is_authenticated:
 			return redirect('/wrtapp/login')
 
-		logs = Log.objects.all()
-		log_sql_query()
+		logs = paginate(request, Log.objects.select_related('device', 'user'), LOG_ORDERING)
 		return render(request, 'log/index.html', {'logs': logs, 'is_administrator': request.user.is_superuser, 'current_user': request.user.username})
 
 	def search(self, request):
 		if not request.user.is_authenticated:
 			return redirect('/wrtapp/login')
 
-		if request.method == 'POST':
-			form = SearchForm(request.POST)
+		if request.method == 'POST' or 'search' in request.GET: #page links of search results are GET requests
+			form = SearchForm(request.POST or request.GET)
 			if form.is_valid():
 				try:
 					searchstr = form.cleaned_data.get('search')
-					logs = Log.objects.filter(Q(device__mac__icontains=searchstr) |
-						Q(user__username__icontains=searchstr) |
-						Q(severity__icontains=searchstr) |
-						Q(message__icontains=searchstr))
+					logs = paginate(request, ranked(Log.objects.select_related('device', 'user'), searchstr),
+						LOG_SEARCH_ORDERING, {'search': searchstr}) #log search vector includes device mac and username
 
-					log_sql_query()
 					return render(request, 'log/index.html', {'logs': logs, 'is_administrator': request.user.is_superuser, 'current_user': request.user.username})
 				except:
 					LOGGER.error('Failed to search')
-					log_sql_query()
 					return redirect('/wrtapp/log/show')
 			else:
 				LOGGER.error('Invalid search form: {}'.format(str(form.errors)))
-				log_sql_query()
 				return redirect('/wrtapp/log/show')
 		else:
-			LOGGER.error('Search attempt with not a POST')
-			log_sql_query()
+			LOGGER.error('Search attempt without search string')
 			return redirect('/wrtapp/log/show')
 
 	def delete(self, request, id):
@@ -523,7 +519,6 @@ class LogView:
 		log = Log.objects.get(id=id)
 		try:
 			log.delete()
-			log_sql_query()
 			return redirect('/wrtapp/log/show')
 		except:
 			LOGGER.error('Failed to delete log')
@@ -536,12 +531,24 @@ class LogView:
 			return redirect('/wrtapp/errors/forbidden')
 
 		try:
-			Log.objects.all().delete()
+			Log.objects.truncate() #one TRUNCATE of all partitions instead of DELETE of every row
 		except:
 			LOGGER.error('Failed to delete all logs')
-		log_sql_query()
 		return redirect('/wrtapp/log/show')
 
+	# Streamed export of logs, same query parameters as statistics export
+	def export(self, request):
+		if not request.user.is_authenticated:
+			return redirect('/wrtapp/login')
+
+		try:
+			condition = export_filter(request)
+		except ValueError:
+			LOGGER.error('Invalid export filter')
+			return HttpResponseBadRequest()
+		logs = Log.objects.filter(condition).annotate(mac=F('device__mac'), username=F('user__username'))
+		return export_response(request, keyset_rows(logs, LOG_EXPORT_ORDERING, LOG_EXPORT_COLUMNS), LOG_EXPORT_COLUMNS, 'logs')
+
 class ToolsView:
 	def show(self, request):
 		if not request.user.is_authenticated:
@@ -594,7 +601,6 @@ class ToolsView:
 			return render(request, 'tools/index.html', {'is_administrator': request.user.is_superuser, 'current_user': request.user.username, 'summary': summary})
 		except:
 			LOGGER.error('Failed to refresh summary')
-			log_sql_query()
 			return redirect('/wrtapp/tools/show')
 
 class AboutView:
@@ -611,6 +617,18 @@ class ContactView:
 
 		return render(request, 'contact/index.html', {'is_administrator': request.user.is_superuser, 'current_user': request.user.username})
 
+#prometheus scrape endpoint, it is not behind login, access is limited by client address instead
+class MetricsView:
+	def show(self, request):
+		if settings.METRICS_ALLOWED_IPS and request.META.get('REMOTE_ADDR') not in settings.METRICS_ALLOWED_IPS:
+			return HttpResponseForbidden()
+
+		try:
+			return HttpResponse(REGISTRY.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
+		except:
+			LOGGER.error('Failed to render metrics')
+			return HttpResponse(status=500)
+
 class ErrorsView:
 	def notfound(self, request):
 		if not request.user.is_authenticated:
@@ -635,3 +653,4 @@ toolsView = ToolsView()
 aboutView = AboutView()
 contactView = ContactView()
 errorsView = ErrorsView()
+metricsView = MetricsView()
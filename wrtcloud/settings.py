@@ -43,6 +43,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'wrtapp.sqlprofile.sql_profile_middleware', # First, so queries of other middleware are counted too.
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -165,6 +166,94 @@ LOGGING = {
 
 # Custom key - provisioning password
 PROVISIONING_PASSWORD = 'yJAFruh5RTuMVpvxRvc7xOBFGTrB3abd'
+# Additional accepted provisioning passwords (per-site or rotated ones)
+PROVISIONING_PASSWORDS = []
+# Max number of device check-ins accepted in one batch provisioning request
+PROVISIONING_BATCH_LIMIT = 500
+
+# Write-behind buffer for device statistics: latest stats of every device are kept
+# in memory and written with one bulk upsert every STATS_BUFFER_INTERVAL milliseconds
+STATS_BUFFER_ENABLED = False
+STATS_BUFFER_INTERVAL = 1000 # Milliseconds.
+STATS_BUFFER_MAX_ENTRIES = 100000 # Devices, stats of new devices are dropped when buffer is full
+
+# Cache of device ids and desired configurations used by provisioning.
+# 'local' is per-process LRU, changes made by other processes are seen after
+# CONFIG_CACHE_TIMEOUT, so use 'django' (shared CACHES alias) with several workers
+CONFIG_CACHE_ENABLED = False
+CONFIG_CACHE_BACKEND = 'local' # 'local' or 'django'
+CONFIG_CACHE_ALIAS = 'default'
+CONFIG_CACHE_MAX_ENTRIES = 100000
+CONFIG_CACHE_TIMEOUT = 300 # Seconds.
+
+# Long-poll config delivery (/wrtapp/provisioning/wait, requires ASGI server).
+# 'local' wakes only requests held by the process which saved the config,
+# 'postgres' uses LISTEN/NOTIFY and wakes requests in every process
+CONFIG_NOTIFY_BACKEND = 'local' # 'local' or 'postgres'
+LONGPOLL_TIMEOUT = 60 # Seconds.
+
+# Device is shown as OFFLINE if it did not report for this long, 'manage.py sweepoffline'
+# (e.g. with --loop 30) stores OFFLINE status for such devices
+OFFLINE_THRESHOLD = 60 # Seconds.
+
+# Stats history (append-only, daily partitions). Run 'manage.py partitions' daily
+# to create upcoming partitions and drop the ones older than retention period
+STATS_HISTORY_ENABLED = True
+STATS_HISTORY_RETENTION = 30 # Days.
+PARTITIONS_AHEAD = 7 # Days.
+
+# Stats rollups (1 minute, 1 hour, 1 day buckets), run 'manage.py rollup' every minute
+ROLLUP_LAG = 120 # Seconds, bucket is aggregated this long after its end.
+ROLLUP_MAX_POINTS = 500 # Max buckets returned for a chart, picks resolution.
+ROLLUP_RETENTION = {60: 7, 3600: 90, 86400: None} # Days per resolution, None keeps forever.
+
+# Write-behind queue for ERROR and WARNING rows of the Log table, rows are written by
+# a background thread with bulk inserts every LOG_SINK_INTERVAL milliseconds or as soon
+# as LOG_SINK_BATCH_SIZE rows are queued. With full queue rows are dropped according
+# to LOG_SINK_OVERFLOW: 'drop_new', 'drop_old' or 'block' (wait up to one interval)
+LOG_SINK_ENABLED = False
+LOG_SINK_INTERVAL = 500 # Milliseconds.
+LOG_SINK_BATCH_SIZE = 500 # Rows.
+LOG_SINK_MAX_QUEUE = 10000 # Rows.
+LOG_SINK_OVERFLOW = 'drop_new'
+
+# Repeats of the same log message (same device, user, sender and severity) within
+# LOG_DEDUP_WINDOW seconds only increase repeat count of the first row (0 disables).
+# New rows are limited per device (or user, or sender: agent mac or client address
+# of a rejected check-in) by a token bucket: LOG_RATE_LIMIT rows per second with
+# bursts of LOG_RATE_BURST rows (0 disables)
+LOG_DEDUP_WINDOW = 300 # Seconds.
+LOG_DEDUP_MAX_ENTRIES = 10000
+LOG_RATE_LIMIT = 1.0 # Rows per second.
+LOG_RATE_BURST = 20 # Rows.
+
+# Log table has daily partitions too, 'manage.py partitions' drops the ones older than this
+LOG_RETENTION = 90 # Days.
+
+# Per-request SQL profiling, one 'sql profile {...}' line is logged for a sampled
+# share of requests. Requests over any limit below are logged as warnings
+SQL_PROFILE_ENABLED = False
+SQL_PROFILE_SAMPLE_RATE = 1.0 # Share of profiled requests, 0.0 - 1.0.
+SQL_PROFILE_MAX_QUERIES = 20 # Queries per request.
+SQL_PROFILE_MAX_DB_TIME = 200 # Milliseconds per request.
+SQL_PROFILE_DUPLICATE_THRESHOLD = 5 # Same statement this many times is reported as N+1.
+SQL_PROFILE_TOP = 3 # Slowest statements in the summary.
+
+# Metrics in prometheus text format at /wrtapp/metrics. With several worker processes
+# set METRICS_DIR to a directory shared by them (and emptied on deploy), every process
+# dumps its values there and scrape sums them
+METRICS_DIR = None
+METRICS_DUMP_INTERVAL = 5 # Seconds.
+METRICS_ALLOWED_IPS = ['127.0.0.1'] # Empty list allows everyone.
+
+# Dashboard tables are paged by keyset (see wrtapp/pagination.py), '?size=' can
+# change page size up to PAGE_SIZE_MAX
+PAGE_SIZE = 100 # Rows.
+PAGE_SIZE_MAX = 1000 # Rows.
+
+# Exports (e.g. /wrtapp/device/export) are streamed, rows are fetched from server-side
+# cursor and sent in chunks of this many rows
+EXPORT_CHUNK_SIZE = 2000 # Rows.
 
 REST_FRAMEWORK = {
     'DEFAULT_PAGINATION_CLASS': 'rest_framework.pagination.PageNumberPagination',